@@ -0,0 +1,286 @@
+"""
+Reproducible performance benchmarks of the analysis stages, on synthetic fractal DEMs and random landmark sets:
+
+    python -m terrain_relative_navigation.benchmark [--scale {small,medium,large,all}] [--output results.json]
+
+Each stage (peak extraction, peak prominence, viewsheds, FIM sum, quality, path evaluation) is timed separately, along
+with the peak resident memory reached during it, and the results are written as JSON; `--compare baseline.json`
+reports the change of every stage against the results of an earlier run (e.g. of a previous version).
+"""
+
+import argparse
+import contextlib
+import datetime
+import itertools
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from osgeo import gdal
+
+from . import path_evaluation
+from . import peak_extraction
+from . import prominence
+from . import quality_analysis
+from . import viewshed_analysis
+from .instrumentation import peak_rss, reset_peak_rss
+from .visibility_store import VisibilityStore, VisibilityStoreWriter
+
+
+# (DEM sizes, numbers of landmarks) of the benchmark cases of each scale
+SCALES = {
+    "small": ([1024], [10, 100]),
+    "medium": ([4096], [100, 500]),
+    "large": ([16384], [500, 2000]),
+}
+
+# max number of DEM rows upsampled at once by `fractal_dem`, to bound the size of temporaries
+MAX_STRIP_ROWS = 1024
+
+
+@contextlib.contextmanager
+def measure(stages, name):
+    """time the body of the `with` block, and record its duration and peak resident memory as `stages[name]`"""
+    reset_peak_rss()
+    start = time.perf_counter()
+    yield
+    stages[name] = {"seconds": time.perf_counter() - start, "peak_rss_mb": peak_rss() / 2**20}
+
+
+def upsample(grid, size):
+    """bilinearly upsample a (g + 1, g + 1) grid of corner values to (size, size) pixel centers, as a generator of row strips"""
+    g = grid.shape[0] - 1
+    t = (np.arange(size) + 0.5) * (g / size)
+    i = np.minimum(t.astype(np.int64), g - 1)
+    f = t - i
+
+    columns = grid[:, i] * (1 - f) + grid[:, i + 1] * f      # (g + 1, size)
+    for r0 in range(0, size, MAX_STRIP_ROWS):
+        rows = slice(r0, min(r0 + MAX_STRIP_ROWS, size))
+        yield rows, columns[i[rows]] * (1 - f[rows, np.newaxis]) + columns[i[rows] + 1] * f[rows, np.newaxis]
+
+
+def fractal_dem(size, seed=0, relief=500.0, hurst=0.8):
+    """
+    a synthetic (size, size) fractal DEM: the sum of octaves of bilinearly upsampled white noise, each with twice the
+    frequency and 2**-hurst times the amplitude of the previous one (a fractional Brownian surface), starting from an
+    amplitude of `relief` map units. The same seed always gives the same DEM.
+    """
+    rng = np.random.default_rng(seed)
+    dem = np.zeros((size, size), dtype=np.float64)
+    cells, amplitude = 2, relief
+    while cells < size:
+        grid = rng.standard_normal((cells + 1, cells + 1))
+        for rows, strip in upsample(grid, size):
+            dem[rows] += amplitude * strip
+        cells, amplitude = cells * 2, amplitude * 2**-hurst
+    return dem
+
+
+def random_landmarks(shape, num_landmarks, seed=0):
+    """(px, py) pixel locations of `num_landmarks` landmarks uniformly distributed over a raster of the given shape"""
+    rng = np.random.default_rng(seed)
+    h, w = shape
+    return [(int(px), int(py)) for px, py in zip(rng.integers(0, w, num_landmarks), rng.integers(0, h, num_landmarks))]
+
+
+def diagonal_path(shape, geotransform, num_vertices=8, seed=0):
+    """(x, y) map coordinates of the vertices of a random walk across a raster, from one corner to the opposite one"""
+    rng = np.random.default_rng(seed)
+    h, w = shape
+    t = np.linspace(0.05, 0.95, num_vertices)
+    px = t * w + rng.normal(scale=0.05 * w, size=num_vertices)
+    py = t * h + rng.normal(scale=0.05 * h, size=num_vertices)
+    px, py = np.clip(px, 0, w - 1), np.clip(py, 0, h - 1)
+    return np.stack([geotransform[0] + px * geotransform[1], geotransform[3] + py * geotransform[5]], axis=1)
+
+
+def write_fim_raster(filename, fim, window, geotransform):
+    """write a landmark's (h, w, 3) FIM to a GeoTIFF covering only its (rows, cols) window of the raster"""
+    rows, cols = window
+    gt = list(geotransform)
+    gt[0] += cols.start * gt[1]
+    gt[3] += rows.start * gt[5]
+
+    ds = gdal.GetDriverByName("GTiff").Create(filename, fim.shape[1], fim.shape[0], 3, gdal.GDT_Float32)
+    ds.SetGeoTransform(gt)
+    for band in range(3):
+        ds.GetRasterBand(band + 1).WriteArray(fim[:,:,band])
+    ds = None       # flush to disk
+
+
+def run_case(size, num_landmarks, work_dir, pixel_size=10.0, radius=2000.0, window_size=21, pointing=1.75e-3,
+             path_landmarks=50, seed=0, log=None):
+    """
+    run every stage of the analysis once on a synthetic (size, size) DEM with `num_landmarks` random landmarks,
+    writing intermediate files to `work_dir`; returns the per-stage durations and peak memory, and a few summary
+    results to check that runs are comparable. Path evaluation uses the FIMs of at most `path_landmarks` landmarks.
+    """
+    stages = {}
+    case = {"dem_size": size, "num_landmarks": num_landmarks, "stages": stages, "results": {}}
+    gt = (0.0, pixel_size, 0.0, size * pixel_size, 0.0, -pixel_size)
+
+    def stage(name):
+        if log is not None:
+            log(f"{size}x{size} DEM, {num_landmarks} landmarks: {name}")
+        return measure(stages, name)
+
+    with stage("generate_dem"):
+        dem = fractal_dem(size, seed=seed)
+
+    with stage("peak_extraction"):
+        peaks = peak_extraction.feature_peaks(dem, gt, window_size, 10 * pixel_size)
+    with stage("peak_extraction_local_maxima"):
+        local_maxima, _ = peak_extraction.extract_peaks(dem, gt, window_size, 10 * pixel_size)
+    with stage("peak_prominence"):
+        peak_prominence, _ = prominence.peak_prominence(dem, gt, peaks)
+    case["results"]["num_peaks"] = len(peaks)
+    case["results"]["max_prominence"] = float(np.nanmax(peak_prominence, initial=0.0))
+    case["results"]["num_local_maxima"] = len(local_maxima)
+
+    viewpoints = random_landmarks(dem.shape, num_landmarks, seed=seed)
+    radius_px = quality_analysis.radius_in_pixels(radius, pixel_size, pixel_size)
+    store_path = os.path.join(work_dir, "viewsheds.trnvis")
+    with stage("viewsheds"):
+        with VisibilityStoreWriter(store_path, dem.shape, gt) as writer:
+            viewsheds = viewshed_analysis.iter_viewsheds(dem, viewpoints, radius_px, pixel_size, pixel_size, 2.0, 2.0, radius=radius)
+            for viewpoint, window, viewshed in viewsheds:
+                writer.add(viewpoint, window, viewshed)
+    store = VisibilityStore(store_path)
+    case["results"]["mean_visible_pixels"] = float(np.mean([np.count_nonzero(viewshed) for _, _, viewshed in store]))
+
+    with stage("fims"):
+        fim_sum = quality_analysis.accumulate_viewshed_fims(iter(store), dem.shape, pixel_size, pixel_size, radius_px)
+    with stage("quality"):
+        quality = quality_analysis.compute_quality(fim_sum, pointing)
+    observed = quality < 1_000_000      # nodata where no landmark is visible
+    case["results"]["observed_fraction"] = float(observed.mean())
+    case["results"]["median_gdop"] = float(np.median(quality[observed])) if observed.any() else None
+    del fim_sum, quality, observed
+
+    kernel = quality_analysis.fim_kernel(pixel_size, pixel_size, *radius_px)
+    fim_paths = []
+    for i in range(min(path_landmarks, len(store))):
+        fim_paths.append(os.path.join(work_dir, f"FIM_{i}.tif"))
+        fim = quality_analysis.landmark_fim(store.viewshed(i), store.viewpoint(i), store.window(i), kernel)
+        write_fim_raster(fim_paths[-1], fim, store.window(i), gt)
+
+    path = diagonal_path(dem.shape, gt, seed=seed)
+    with stage("path_animation"):
+        waypoints = path_evaluation.points_along_line(path, pixel_size)
+        total_fims, _ = path_evaluation.path_fims(waypoints, fim_paths)
+        drawn, _, _ = path_evaluation.covariance_ellipses(waypoints, total_fims, pointing, 40.0)
+    case["results"]["num_waypoints"] = len(waypoints)
+    case["results"]["num_ellipses"] = int(drawn.sum())
+    return case
+
+
+def git_revision():
+    """the git commit of the code being benchmarked, if it is a git checkout"""
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], cwd=os.path.dirname(os.path.abspath(__file__)),
+            capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def environment():
+    """versions and machine the benchmarks were run with"""
+    return {
+        "git_revision": git_revision(),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "gdal": gdal.__version__,
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "peak_rss_per_stage": reset_peak_rss(),     # otherwise, peak memory is since the start of the process
+        "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+    }
+
+
+def compare(baseline, results):
+    """lines reporting the time and peak memory of each stage of each case of the results, relative to the baseline's"""
+    baseline_cases = {(case["dem_size"], case["num_landmarks"]): case for case in baseline["cases"]}
+    lines = []
+    for case in results["cases"]:
+        key = (case["dem_size"], case["num_landmarks"])
+        if key not in baseline_cases:
+            continue
+        for name, stage in case["stages"].items():
+            before = baseline_cases[key]["stages"].get(name)
+            if before is None:
+                continue
+            lines.append(
+                f"{key[0]}x{key[0]}, {key[1]} landmarks, {name}: {stage['seconds']:.3f}s "
+                f"({stage['seconds'] / max(before['seconds'], 1e-9):.2f}x), {stage['peak_rss_mb']:.0f} MiB "
+                f"({stage['peak_rss_mb'] / max(before['peak_rss_mb'], 1e-9):.2f}x)"
+            )
+    return lines
+
+
+def parser():
+    """the command line argument parser"""
+    main_parser = argparse.ArgumentParser(
+        prog="python -m terrain_relative_navigation.benchmark",
+        description="Benchmark the analysis stages on synthetic fractal DEMs and landmark sets."
+    )
+    main_parser.add_argument("--scale", choices=sorted(SCALES) + ["all"], default="small", help="benchmark cases to run (default: small)")
+    main_parser.add_argument("--sizes", type=int, nargs="+", help="DEM sizes in pixels, instead of those of the scale")
+    main_parser.add_argument("--landmarks", type=int, nargs="+", help="numbers of landmarks, instead of those of the scale")
+    main_parser.add_argument("--pixel-size", type=float, default=10.0, help="DEM pixel size, map units (default: 10)")
+    main_parser.add_argument("--radius", type=float, default=2000.0, help="radius of analysis, map units (default: 2000)")
+    main_parser.add_argument("--window-size", type=int, default=21, help="peak extraction window size, pixels (default: 21)")
+    main_parser.add_argument("--path-landmarks", type=int, default=50, help="max number of landmark FIMs sampled along the path (default: 50)")
+    main_parser.add_argument("--seed", type=int, default=0, help="random seed of the DEMs and landmarks (default: 0)")
+    main_parser.add_argument("--output", help="output JSON file of the results (default: standard output)")
+    main_parser.add_argument("--compare", help="JSON results of an earlier run to compare against")
+    return main_parser
+
+
+def main(argv=None):
+    args = parser().parse_args(argv)
+
+    def log(message):
+        print(message, file=sys.stderr)
+
+    scales = sorted(SCALES) if args.scale == "all" else [args.scale]
+    sizes = args.sizes or sorted({size for scale in scales for size in SCALES[scale][0]})
+    landmarks = args.landmarks or sorted({n for scale in scales for n in SCALES[scale][1]})
+    if args.sizes is None and args.landmarks is None:
+        cases = [case for scale in scales for case in itertools.product(*SCALES[scale])]
+    else:
+        cases = list(itertools.product(sizes, landmarks))
+
+    gdal.UseExceptions()
+    results = {"environment": environment(), "parameters": vars(args), "cases": []}
+    for size, num_landmarks in cases:
+        # anything the stages print goes to standard error, so that standard output is only the JSON results
+        with tempfile.TemporaryDirectory() as work_dir, contextlib.redirect_stdout(sys.stderr):
+            results["cases"].append(run_case(
+                size, num_landmarks, work_dir, pixel_size=args.pixel_size, radius=args.radius,
+                window_size=args.window_size, path_landmarks=args.path_landmarks, seed=args.seed, log=log
+            ))
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    else:
+        json.dump(results, sys.stdout, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            for line in compare(json.load(f), results):
+                log(line)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,361 @@
+"""
+Command line interface to the terrain relative navigation analyses, without QGIS: only numpy and GDAL are needed, so
+that many jobs can be run in parallel (e.g. on a batch cluster).
+
+    python -m terrain_relative_navigation.cli peaks DEM OUTPUT [options]
+    python -m terrain_relative_navigation.cli peaks-sweep DEM OUTPUT_DIR --window-sizes W [W ...] --spacings S [S ...] [options]
+    python -m terrain_relative_navigation.cli quality DEM LANDMARKS OUTPUT [options]
+    python -m terrain_relative_navigation.cli path PATH LANDMARKS FIM [FIM ...] [options]
+    python -m terrain_relative_navigation.cli job-create DEM LANDMARKS JOB_DIR --shards N [options]
+    python -m terrain_relative_navigation.cli job-run JOB_DIR [--shard K | --processes N] [--reclaim] [options]
+    python -m terrain_relative_navigation.cli job-merge JOB_DIR OUTPUT [options]
+
+Rasters are read with GDAL and written as GeoTIFFs; vector files are read with OGR, and written in the format of
+their extension (see `vector_io.VECTOR_DRIVERS`).
+"""
+
+import argparse
+import contextlib
+import os
+import sys
+import tempfile
+
+import numpy as np
+
+from osgeo import gdal, ogr
+
+from . import instrumentation
+from . import masking
+from . import path_evaluation
+from . import peak_extraction
+from . import peak_stages
+from . import prominence
+from . import quality_pipeline
+from . import sharding
+from . import tiled_peaks
+from . import vector_io
+from .viewshed_cache import ViewshedCache
+
+
+METRICS = {"gdop": 0, "worst-case": 1}
+
+
+def fim_index(path):
+    """the landmark index of a FIM raster written by the quality analysis (see `quality_pipeline.fim_filename`)"""
+    return int(os.path.splitext(os.path.basename(path))[0].split("_")[-1])
+
+
+def peak_stages_of(args, profiler):
+    """the (cached, if `--cache-dir`) peak extraction stages of the DEM"""
+    if not args.prominence and (args.max_peaks > 0 or args.min_prominence > 0):
+        raise ValueError("Peaks can only be filtered by prominence if it is computed (--prominence)")
+    cache = None if args.cache_dir is None else peak_stages.StageCache(args.cache_dir, args.cache_size * 2**20)
+    return peak_stages.PeakStages(args.dem, cache=cache, profiler=profiler)
+
+
+def peaks_command(args, log, profiler):
+    stages = peak_stages_of(args, profiler)
+    gt = stages.geotransform
+    size = peak_extraction.window_size_in_pixels(args.window_size, gt[1], -gt[5])
+
+    if args.tile_size > 0:
+        log(f"Using analysis window of size {size}px, in tiles of {args.tile_size}px")
+        points = tiled_peaks_points(args, log, profiler, size)
+    else:
+        log(f"Using analysis window of size {size}px")
+        if args.method == "local-maxima":
+            points, _ = stages.local_maxima_peaks(size, args.spacing)
+        else:
+            points = stages.feature_peaks(size, args.spacing)
+    write_peaks(args, log, profiler, stages, points, args.output, tiled=args.tile_size > 0)
+    stages.evict()
+
+
+def tiled_peaks_points(args, log, profiler, size):
+    def report_progress(fraction):
+        log(f"{100 * fraction:.0f}%")
+
+    options = dict(
+        tile_size=args.tile_size, num_workers=args.workers, progress_callback=report_progress if args.verbose else None
+    )
+    with profiler.stage("extract_peaks"):
+        if args.method == "local-maxima":
+            points, _ = tiled_peaks.tiled_extract_peaks(args.dem, size, args.spacing, **options)
+        else:
+            points = tiled_peaks.tiled_feature_peaks(args.dem, size, args.spacing, **options)
+    return points
+
+
+def peaks_sweep_command(args, log, profiler):
+    stages = peak_stages_of(args, profiler)
+    os.makedirs(args.output_dir, exist_ok=True)
+    combinations = peak_stages.sweep(stages, args.window_sizes, args.spacings, method=args.method)
+    for window_size, spacing, points in combinations:
+        log(f"Window size {window_size:g}, spacing {spacing:g}:")
+        output = peak_stages.sweep_filename(args.output_dir, window_size, spacing, "." + args.format)
+        write_peaks(args, log, profiler, stages, points, output)
+    stages.evict()
+
+
+def write_peaks(args, log, profiler, stages, points, output, tiled=False):
+    """
+    write the peaks to the output vector file, with their prominence and isolation if `--prominence` (keeping only the
+    most prominent if asked to), unless the peaks were found in tiles: it would read the whole DEM
+    """
+    attributes = None
+    if args.prominence and tiled:
+        log("WARNING: the prominence needs the whole DEM in memory, so it is not computed for peaks found in tiles")
+    elif args.prominence:
+        peak_prominence, peak_isolation = stages.peak_prominence(points)
+        keep = prominence.select_prominent(peak_prominence, args.max_peaks, args.min_prominence)
+        if len(keep) < len(points):
+            log(f"Keeping the {len(keep)} most prominent of {len(points)} peaks")
+        points = points[keep]
+        attributes = {"prominence": peak_prominence[keep], "isolation": peak_isolation[keep]}
+
+    projection = gdal.OpenShared(args.dem).GetProjection()
+    with profiler.stage("write_peaks"):
+        vector_io.write_vector(output, ogr.wkbPoint, vector_io.point_wkbs(points), projection, attributes)
+    log(f"Number of peaks detected: {len(points)}")
+
+
+def quality_command(args, log, profiler):
+    landmarks = vector_io.read_points(args.landmarks)
+    cache = None if args.cache_dir is None else ViewshedCache(args.cache_dir, args.cache_size * 2**20)
+    with profiler.stage("analysis_mask"):
+        mask = masking.analysis_mask(
+            args.dem, aoi_wkbs=None if args.aoi is None else vector_io.read_wkbs(args.aoi), mask_raster=args.mask,
+            max_slope=args.max_slope
+        )
+
+    def report_progress(fraction):
+        log(f"{100 * fraction:.0f}%")
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        store_path = args.visibility_store
+        if args.block_size > 0 and not store_path:
+            store_path = os.path.join(temp_dir, "viewsheds.trnvis")     # blocks read their viewsheds from it
+
+        log(f"Computing the localization quality of {len(landmarks)} landmarks. . .")
+        quality_pipeline.run_quality_analysis(
+            args.dem, landmarks, args.output, args.radius, args.landmark_height, args.robot_height, args.pointing * 1e-3,
+            metric=METRICS[args.metric], num_workers=args.workers, block_size=args.block_size, store_path=store_path,
+            fim_sum_path=args.fim_sum, fims_dir=args.fims_dir, viewsheds_dir=args.viewsheds_dir,
+            bands_path=args.all_metrics, mask=mask, cache=cache,
+            progress_callback=report_progress if args.verbose else None, log=log, profiler=profiler
+        )
+
+
+def job_create_command(args, log, profiler):
+    landmarks = vector_io.read_points(args.landmarks)
+    job = sharding.create_job(
+        args.job_dir, args.dem, landmarks, args.shards, args.radius, args.landmark_height, args.robot_height,
+        args.pointing * 1e-3, metric=METRICS[args.metric]
+    )
+    log(f"Created a job of {len(landmarks)} landmarks in {job['num_shards']} shards")
+
+
+def job_run_command(args, log, profiler):
+    cache = None if args.cache_dir is None else ViewshedCache(args.cache_dir, args.cache_size * 2**20)
+    options = dict(num_workers=args.workers, block_size=args.block_size, cache=cache)
+    if args.reclaim and args.shard is None:
+        options["reclaim"] = sharding.job_claims(args.job_dir)
+        log(f"Reclaiming {len(options['reclaim'])} claimed shards")
+    if args.shard is not None:
+        sharding.run_shard(args.job_dir, args.shard, log=log, profiler=profiler, **options)
+    elif args.processes > 1:
+        sharding.run_local(args.job_dir, args.processes, **options)
+    else:
+        sharding.run_shards(args.job_dir, log=log, profiler=profiler, **options)
+    status = sharding.job_status(args.job_dir)
+    log(f"Shards done: {len(status['done'])}, claimed: {len(status['claimed'])}, pending: {len(status['pending'])}")
+
+
+def job_merge_command(args, log, profiler):
+    def report_progress(fraction):
+        log(f"{100 * fraction:.0f}%")
+
+    sharding.merge_shards(
+        args.job_dir, args.output, pointing=None if args.pointing is None else args.pointing * 1e-3,
+        metric=None if args.metric is None else METRICS[args.metric], fim_sum_path=args.fim_sum,
+        bands_path=args.all_metrics, block_size=args.block_size,
+        progress_callback=report_progress if args.verbose else None, log=log, profiler=profiler
+    )
+
+
+def path_command(args, log, profiler):
+    fim_paths = sorted(args.fims, key=fim_index)
+    indices = np.array([fim_index(path) for path in fim_paths], dtype=np.int64)
+    points = vector_io.read_points(args.landmarks)
+    if len(indices) and indices[-1] >= len(points):
+        raise ValueError(f"{fim_paths[-1]} is the FIM of landmark {indices[-1]}, but there are only {len(points)} landmarks")
+    landmarks = points[indices]       # the landmark of each FIM, in order
+    projection = vector_io.vector_projection(args.path)
+
+    spacing = args.speed * args.seconds_per_waypoint
+    waypoints = [path_evaluation.points_along_line(line, spacing) for line in vector_io.read_lines(args.path)]
+    waypoints = np.concatenate(waypoints or [np.empty((0, 2))])
+    times = np.arange(len(waypoints)) * args.seconds_per_waypoint
+    log(f"Evaluating {len(waypoints)} waypoints against {len(fim_paths)} landmarks. . .")
+
+    with profiler.stage("path_fims"):
+        total_fims, visible = path_evaluation.path_fims(waypoints, fim_paths)
+    with profiler.stage("covariance_ellipses"):
+        drawn, rings, singular = path_evaluation.covariance_ellipses(waypoints, total_fims, args.pointing * 1e-3, args.num_sds)
+    log(f"singular FIMs: {singular.sum()}, infinite GDOP: {(~singular & ~drawn).sum()}")
+
+    if args.waypoints:
+        vector_io.write_vector(args.waypoints, ogr.wkbPoint, vector_io.point_wkbs(waypoints), projection, {"time": times})
+    if args.rays:
+        w, j = np.nonzero(visible)
+        vector_io.write_vector(
+            args.rays, ogr.wkbLineString, vector_io.segment_wkbs(waypoints[w], landmarks[j]), projection,
+            {"time": times[w], "landmark": indices[j]}
+        )
+    if args.ellipses:
+        vector_io.write_vector(
+            args.ellipses, ogr.wkbPolygon, path_evaluation.polygon_wkbs(rings), projection, {"time": times[drawn]}
+        )
+
+
+def parser():
+    """the command line argument parser"""
+    main_parser = argparse.ArgumentParser(
+        prog="python -m terrain_relative_navigation.cli",
+        description="Terrain relative navigation analyses, without QGIS."
+    )
+    main_parser.add_argument("-v", "--verbose", action="store_true", help="report progress, and the time and memory of each stage")
+    main_parser.add_argument("-q", "--quiet", action="store_true", help="don't print any messages")
+    main_parser.add_argument("--debug", action="store_true", help="also print debug messages (e.g. per landmark)")
+    main_parser.add_argument("--trace", help="output JSON trace of the time and memory of each stage")
+    subparsers = main_parser.add_subparsers(dest="command", required=True)
+
+    peaks = subparsers.add_parser("peaks", help="extract peaks from a DEM")
+    peaks.add_argument("dem", help="DEM raster")
+    peaks.add_argument("output", help="output vector file of the extracted peaks")
+    peaks.add_argument("--window-size", type=float, default=500.0, help="size of analysis window, map units (default: 500)")
+    peaks.add_argument("--spacing", type=float, default=100.0, help="minimum distance between distinct peaks, map units (default: 100)")
+    peaks.add_argument(
+        "--tile-size", type=int, default=0,
+        help="extract the peaks in tiles of this many pixels (with a halo of the window size plus the spacing), 0 = whole DEM in memory (default: 0)"
+    )
+    peaks.add_argument("--workers", type=int, default=1, help="tile worker processes, 0 = one per core (default: 1)")
+    peaks.set_defaults(run=peaks_command)
+
+    peaks_sweep = subparsers.add_parser("peaks-sweep", help="extract peaks from a DEM for every combination of window sizes and spacings")
+    peaks_sweep.add_argument("dem", help="DEM raster")
+    peaks_sweep.add_argument("output_dir", help="output folder of the peaks of each combination (peaks_w<window size>_s<spacing>.<format>)")
+    peaks_sweep.add_argument("--window-sizes", type=float, nargs="+", required=True, help="sizes of analysis window, map units")
+    peaks_sweep.add_argument("--spacings", type=float, nargs="+", required=True, help="minimum distances between distinct peaks, map units")
+    peaks_sweep.add_argument("--format", choices=["gpkg", "shp", "geojson", "csv"], default="gpkg", help="output vector format (default: gpkg)")
+    peaks_sweep.set_defaults(run=peaks_sweep_command)
+
+    for peak_parser in (peaks, peaks_sweep):
+        peak_parser.add_argument(
+            "--method", choices=["features", "local-maxima"], default="features",
+            help="morphometric features (same peaks as r.param.scale), or raster local maxima (default: features)"
+        )
+        peak_parser.add_argument(
+            "--prominence", action="store_true",
+            help="compute the prominence and isolation attributes of the peaks (which needs the whole DEM in memory, so not with --tile-size)"
+        )
+        peak_parser.add_argument("--min-prominence", type=float, default=0.0, help="drop the peaks less prominent than this, map units (default: 0)")
+        peak_parser.add_argument("--max-peaks", type=int, default=0, help="only keep this many of the most prominent peaks, 0 = all (default: 0)")
+        peak_parser.add_argument("--cache-dir", help="cache folder of the intermediate stages (peak pixels, prominences), reused across runs")
+        peak_parser.add_argument("--cache-size", type=int, default=2048, help="maximum stage cache size, MiB (default: 2048)")
+
+    quality = subparsers.add_parser("quality", help="compute the localization quality raster of a set of landmarks")
+    quality.add_argument("dem", help="DEM raster")
+    quality.add_argument("landmarks", help="vector file of the landmark points")
+    quality.add_argument("output", help="output quality GeoTIFF")
+    quality.add_argument("--radius", type=int, default=10000, help="radius of analysis, map units (default: 10000)")
+    quality.add_argument("--landmark-height", type=float, default=2.0, help="landmark height above the DEM (default: 2)")
+    quality.add_argument("--robot-height", type=float, default=2.0, help="robot height above the DEM (default: 2)")
+    quality.add_argument("--pointing", type=float, default=1.75, help="pointing accuracy, milliradians (default: 1.75)")
+    quality.add_argument("--metric", choices=sorted(METRICS), default="gdop", help="quality metric (default: gdop)")
+    quality.add_argument("--workers", type=int, default=1, help="viewshed worker processes, 0 = one per core (default: 1)")
+    quality.add_argument("--block-size", type=int, default=0, help="compute the quality in blocks of this many pixels, 0 = in memory (default: 0)")
+    quality.add_argument("--aoi", help="vector file of the area of interest polygons, in the CRS of the DEM (quality is nodata outside)")
+    quality.add_argument("--mask", help="traversability mask raster aligned with the DEM (quality is nodata where it is 0 or nodata)")
+    quality.add_argument("--max-slope", type=float, help="maximum traversable slope, degrees (quality is nodata on steeper pixels)")
+    quality.add_argument("--visibility-store", help="output visibility store of the landmark viewsheds (.trnvis)")
+    quality.add_argument("--fim-sum", help="output running FIM sum GeoTIFF, for later updates")
+    quality.add_argument(
+        "--all-metrics",
+        help="output GeoTIFF of all quality metrics, one per band: GDOP, worst-case SD, minor SD, orientation (degrees from north), visible landmarks"
+    )
+    quality.add_argument("--fims-dir", help="output folder of the individual landmark FIMs")
+    quality.add_argument("--viewsheds-dir", help="output folder of the individual landmark viewsheds")
+    quality.add_argument("--cache-dir", help="viewshed cache folder")
+    quality.add_argument("--cache-size", type=int, default=2048, help="maximum viewshed cache size, MiB (default: 2048)")
+    quality.set_defaults(run=quality_command)
+
+    path = subparsers.add_parser("path", help="evaluate the localization quality along a robot path")
+    path.add_argument("path", help="vector file of the robot path lines")
+    path.add_argument("landmarks", help="vector file of the landmark points")
+    path.add_argument("fims", nargs="+", help="FIM rasters of the landmarks (FIM_<landmark index>.tif)")
+    path.add_argument("--pointing", type=float, default=1.75, help="pointing accuracy, milliradians (default: 1.75)")
+    path.add_argument("--num-sds", type=float, default=40.0, help="number of SD's for ellipses (default: 40)")
+    path.add_argument("--seconds-per-waypoint", type=float, default=1.0, help="travel time between waypoints, seconds (default: 1)")
+    path.add_argument("--speed", type=float, default=1.0, help="robot speed, map units per second (default: 1)")
+    path.add_argument("--waypoints", help="output vector file of the waypoints")
+    path.add_argument("--rays", help="output vector file of the observation rays")
+    path.add_argument("--ellipses", help="output vector file of the covariance ellipses")
+    path.set_defaults(run=path_command)
+
+    job_create = subparsers.add_parser("job-create", help="split a quality analysis into shards, to be run on several nodes")
+    job_create.add_argument("dem", help="DEM raster (at the same path on every node)")
+    job_create.add_argument("landmarks", help="vector file of the landmark points")
+    job_create.add_argument("job_dir", help="job folder, on a filesystem shared by all nodes")
+    job_create.add_argument("--shards", type=int, required=True, help="number of shards")
+    job_create.add_argument("--radius", type=int, default=10000, help="radius of analysis, map units (default: 10000)")
+    job_create.add_argument("--landmark-height", type=float, default=2.0, help="landmark height above the DEM (default: 2)")
+    job_create.add_argument("--robot-height", type=float, default=2.0, help="robot height above the DEM (default: 2)")
+    job_create.add_argument("--pointing", type=float, default=1.75, help="pointing accuracy, milliradians (default: 1.75)")
+    job_create.add_argument("--metric", choices=sorted(METRICS), default="gdop", help="quality metric (default: gdop)")
+    job_create.set_defaults(run=job_create_command)
+
+    job_run = subparsers.add_parser("job-run", help="compute the partial FIM sums of shards of a job")
+    job_run.add_argument("job_dir", help="job folder")
+    job_run.add_argument("--shard", type=int, help="only run this shard, even if claimed or done (default: every unclaimed shard)")
+    job_run.add_argument("--processes", type=int, default=1, help="run the unclaimed shards with this many local processes (default: 1)")
+    job_run.add_argument("--workers", type=int, default=1, help="viewshed worker processes per shard, 0 = one per core (default: 1)")
+    job_run.add_argument("--block-size", type=int, default=0, help="compute the FIM sums in blocks of this many pixels, 0 = in memory (default: 0)")
+    job_run.add_argument("--reclaim", action="store_true", help="also run the shards claimed before this run, e.g. by workers killed on other nodes (claims of dead processes on this node are always taken over)")
+    job_run.add_argument("--cache-dir", help="viewshed cache folder")
+    job_run.add_argument("--cache-size", type=int, default=2048, help="maximum viewshed cache size, MiB (default: 2048)")
+    job_run.set_defaults(run=job_run_command)
+
+    job_merge = subparsers.add_parser("job-merge", help="merge the partial FIM sums of a finished job into its quality raster")
+    job_merge.add_argument("job_dir", help="job folder")
+    job_merge.add_argument("output", help="output quality GeoTIFF")
+    job_merge.add_argument("--pointing", type=float, help="pointing accuracy, milliradians (default: that of the job)")
+    job_merge.add_argument("--metric", choices=sorted(METRICS), help="quality metric (default: that of the job)")
+    job_merge.add_argument("--fim-sum", help="output running FIM sum GeoTIFF of all landmarks, for later updates")
+    job_merge.add_argument("--all-metrics", help="output GeoTIFF of all quality metrics, one per band")
+    job_merge.add_argument("--block-size", type=int, default=1024, help="merge in blocks of this many pixels (default: 1024)")
+    job_merge.set_defaults(run=job_merge_command)
+
+    return main_parser
+
+
+def main(argv=None):
+    args = parser().parse_args(argv)
+
+    def log(message):
+        if not args.quiet:
+            print(message, file=sys.stderr)
+
+    gdal.UseExceptions()
+    profiler = instrumentation.Profiler(events=bool(args.trace))
+    with instrumentation.debug_messages(log) if args.debug else contextlib.nullcontext():
+        args.run(args, log, profiler)
+    if args.verbose:
+        instrumentation.report(profiler, log)
+    if args.trace:
+        profiler.write_trace(args.trace)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
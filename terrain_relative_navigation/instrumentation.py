@@ -0,0 +1,161 @@
+import contextlib
+import json
+import logging
+import resource
+import sys
+import time
+
+
+def reset_peak_rss():
+    """reset the peak resident memory of this process (Linux only); returns whether it could be reset"""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def peak_rss():
+    """peak resident memory of this process in bytes, since it started or since the last `reset_peak_rss`"""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return max_rss if sys.platform == "darwin" else max_rss * 1024      # bytes on macOS, KiB elsewhere
+
+
+class Profiler:
+    """
+    Records the wall time, CPU time (of this process; not of worker processes) and peak resident memory of named
+    stages of a pipeline, e.g.:
+
+        with profiler.stage("quality"):
+            quality = compute_quality(fim_sum, pointing)
+
+    A stage can be entered any number of times (its totals accumulate) and stages can be nested, in which case the
+    "self" times of a stage exclude those of the stages nested in it, so that the self times of all stages add up to
+    the total. Peak memory is only per stage where the peak can be reset (Linux), and since the start of the process
+    otherwise.
+    """
+
+    def __init__(self, events=True):
+        self.stages = {}
+        self.events = [] if events else None
+        self.open = []      # [name, wall start, cpu start, nested wall, nested cpu] of the stages being timed
+        self.start = time.perf_counter()
+        self.resettable = reset_peak_rss()
+
+    def update_peaks(self):
+        """fold the peak memory since the last reset into all open stages"""
+        peak = peak_rss()
+        for frame in self.open:
+            stage = self.stages[frame[0]]
+            stage["peak_rss"] = max(stage["peak_rss"], peak)
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        """time the body of the `with` block as (another call of) the given stage"""
+        stage = self.stages.setdefault(name, {"calls": 0, "wall": 0.0, "cpu": 0.0, "self_wall": 0.0, "self_cpu": 0.0, "peak_rss": 0})
+        self.update_peaks()
+        reset_peak_rss()
+        frame = [name, time.perf_counter(), time.process_time(), 0.0, 0.0]
+        self.open.append(frame)
+        try:
+            yield
+        finally:
+            wall, cpu = time.perf_counter() - frame[1], time.process_time() - frame[2]
+            self.update_peaks()
+            self.open.pop()
+            if self.open:
+                self.open[-1][3] += wall
+                self.open[-1][4] += cpu
+
+            stage["calls"] += 1
+            stage["wall"] += wall
+            stage["cpu"] += cpu
+            stage["self_wall"] += wall - frame[3]
+            stage["self_cpu"] += cpu - frame[4]
+            if self.events is not None:
+                self.events.append({"stage": name, "start": frame[1] - self.start, "wall": wall, "cpu": cpu})
+
+    def iterate(self, name, iterable):
+        """lazily yield the items of the iterable, timing the production of each one as a call of the given stage"""
+        iterator = iter(iterable)
+        try:
+            while True:
+                with self.stage(name):
+                    try:
+                        item = next(iterator)
+                    except StopIteration:
+                        return
+                yield item
+        finally:
+            if hasattr(iterator, "close"):
+                iterator.close()
+
+    def summary(self):
+        """one line per stage, in the order they were first entered, with its self and total times and peak memory"""
+        lines = []
+        for name, stage in self.stages.items():
+            lines.append(
+                f"{name}: {stage['self_wall']:.2f}s wall ({stage['wall']:.2f}s incl. nested), "
+                f"{stage['self_cpu']:.2f}s CPU, {stage['calls']} call{'s' if stage['calls'] != 1 else ''}, "
+                f"peak memory {stage['peak_rss'] / 2**20:.0f} MiB"
+            )
+        lines.append(f"total: {time.perf_counter() - self.start:.2f}s wall")
+        return lines
+
+    def trace(self):
+        """the recorded stages (and individual calls, if kept) as a JSON-serializable dict"""
+        trace = {
+            "total_wall": time.perf_counter() - self.start,
+            "peak_rss_per_stage": self.resettable,
+            "stages": self.stages,
+        }
+        if self.events is not None:
+            trace["events"] = self.events
+        return trace
+
+    def write_trace(self, path):
+        with open(path, "w") as f:
+            json.dump(self.trace(), f, indent=2)
+
+
+def report(profiler, log, trace_path=None):
+    """pass the profiler's summary to `log(message)` line by line, and write its trace to the given path, if any"""
+    log("Time and memory by stage:")
+    for line in profiler.summary():
+        log(f"  {line}")
+    if trace_path:
+        profiler.write_trace(trace_path)
+
+
+class CallbackHandler(logging.Handler):
+    """logging handler passing each formatted record to a callback, e.g. `feedback.pushDebugInfo`"""
+
+    def __init__(self, callback):
+        super().__init__()
+        self.callback = callback
+
+    def emit(self, record):
+        self.callback(self.format(record))
+
+
+@contextlib.contextmanager
+def debug_messages(callback, logger_name=__package__):
+    """pass the debug messages of this package (e.g. per-landmark messages) to the callback within the `with` block"""
+    logger = logging.getLogger(logger_name)
+    handler = CallbackHandler(callback)
+    level = logger.level
+    logger.addHandler(handler)
+    logger.setLevel(logging.DEBUG)
+    try:
+        yield
+    finally:
+        logger.removeHandler(handler)
+        logger.setLevel(level)
@@ -0,0 +1,112 @@
+import heapq
+
+import numpy as np
+
+from . import quality_analysis
+
+
+def capped_quality(fim, pointing, metric=0, nodata_value=1_000_000):
+    """
+    `compute_quality` (float32), with (near-)singular pixels clipped to the nodata value, so that it can be averaged;
+    its sums are taken in double precision, so that running totals of it stay exact enough to compare gains
+    """
+    quality = quality_analysis.compute_quality(fim, pointing, metric=metric, nodata_value=nodata_value)
+    return np.minimum(quality, nodata_value, dtype=np.float32)
+
+
+def sorted_percentile(sorted_values, percentile):
+    """the `percentile`-th percentile of sorted values, interpolated linearly as by `np.percentile`"""
+    position = percentile / 100 * (len(sorted_values) - 1)
+    lo = int(np.floor(position))
+    hi = min(lo + 1, len(sorted_values) - 1)
+    return float(sorted_values[lo]) + (position - lo) * (float(sorted_values[hi]) - float(sorted_values[lo]))
+
+
+def replace_sorted(sorted_values, old, new):
+    """
+    the sorted values with the given `old` values (all of which are in them) replaced by the `new` ones: only these
+    are searched for, instead of sorting (or partitioning) all the values again
+    """
+    old, new = np.sort(old, axis=None), np.sort(new, axis=None)
+    # positions of the old values, the n-th of equal values at the n-th position of their run
+    positions = np.searchsorted(sorted_values, old) + np.arange(len(old)) - np.searchsorted(old, old)
+    remaining = np.delete(sorted_values, positions)
+    return np.insert(remaining, np.searchsorted(remaining, new), new)
+
+
+def select_landmarks(store, num_selected, pointing, metric=0, percentile=None, nodata_value=1_000_000, progress_callback=None):
+    """
+    greedily pick up to `num_selected` landmarks of a visibility store, each time adding the landmark whose FIM most
+    reduces the quality metric (GDOP or worst-case, clipped to the nodata value where unobservable) of the running FIM
+    sum of the landmarks picked so far; lazily yields an (index, gain, objective) tuple for each pick, in order.
+
+    The objective is the mean quality over the raster or, if given, its `percentile`-th percentile; in the latter case,
+    gains only count the pixels at or above the current percentile, so picks concentrate on the worst-covered areas.
+    The percentile is kept up to date from the window of each pick (see `replace_sorted`), at the cost of a sorted
+    copy of the quality raster. The FIM sum and quality are float32, as in `accumulate_viewshed_fims`.
+
+    Since gains only shrink as landmarks are added (in practice; it's not guaranteed), candidates are evaluated lazily:
+    a stale gain is only recomputed when it reaches the top of the priority queue, and a candidate whose recomputed
+    gain is still the best is picked without evaluating the others. `progress_callback(fraction)` is called while the
+    initial gains of all candidates are computed.
+    """
+    h, w = store.shape
+    gt = store.geotransform
+    kernel = quality_analysis.fim_kernel(gt[1], -gt[5], *store.radius_px())
+
+    fim_sum = np.zeros((h, w, 3), dtype=np.float32)
+    quality = capped_quality(fim_sum, pointing, metric, nodata_value)
+    quality_total = quality.sum(dtype=np.float64)
+    sorted_quality = threshold = None
+    if percentile is not None:
+        sorted_quality = np.sort(quality, axis=None)
+        threshold = sorted_percentile(sorted_quality, percentile)
+
+    def landmark_fim(i):
+        viewshed = store.viewshed(i)
+        if not viewshed.any():
+            return None
+        return quality_analysis.landmark_fim(viewshed, store.viewpoint(i), store.window(i), kernel)
+
+    def gain(i):
+        fim = landmark_fim(i)
+        if fim is None:
+            return 0.0
+        window = store.window(i)
+        before, after = quality[window], capped_quality(fim_sum[window] + fim, pointing, metric, nodata_value)
+        if threshold is not None:
+            counted = before >= threshold
+            before, after = before[counted], after[counted]
+        return (before.sum(dtype=np.float64) - after.sum(dtype=np.float64)) / (h * w)
+
+    # (-gain, index, number of picks when the gain was computed)
+    candidates = []
+    for i in range(len(store)):
+        candidates.append((-gain(i), i, 0))
+        if progress_callback is not None:
+            progress_callback((i + 1) / len(store))
+    heapq.heapify(candidates)
+
+    for num_picked in range(min(num_selected, len(store))):
+        while True:
+            neg_gain, i, evaluated_at = heapq.heappop(candidates)
+            if evaluated_at == num_picked:
+                break       # up to date, and no other candidate can beat it
+            heapq.heappush(candidates, (-gain(i), i, num_picked))
+
+        window = store.window(i)
+        fim = landmark_fim(i)
+        if fim is not None:
+            fim_sum[window] += fim
+            updated = capped_quality(fim_sum[window], pointing, metric, nodata_value)
+            quality_total += updated.sum(dtype=np.float64) - quality[window].sum(dtype=np.float64)
+            if sorted_quality is not None:
+                sorted_quality = replace_sorted(sorted_quality, quality[window], updated)
+            quality[window] = updated
+
+        if percentile is not None:
+            threshold = sorted_percentile(sorted_quality, percentile)
+            objective = threshold
+        else:
+            objective = quality_total / (h * w)
+        yield i, -neg_gain, objective
@@ -0,0 +1,233 @@
+# -*- coding: utf-8 -*-
+
+"""
+/***************************************************************************
+ LandmarkSelector
+                                 A QGIS plugin
+ This plugin selects the subset of landmarks that best improves the
+ localization quality, ranked by their contribution.
+                              -------------------
+        begin                : 2021-03-10
+        copyright            : (C) 2021 by NASA JPL
+        email                : russells@jpl.nasa.gov
+ ***************************************************************************/
+"""
+
+__author__ = "NASA JPL"
+__date__ = "2021-03-10"
+__copyright__ = "(C) 2021 by NASA JPL"
+
+# This will get replaced with a git SHA1 when you do a git archive
+
+__revision__ = "$Format:%H$"
+
+from qgis.PyQt.QtCore import QCoreApplication, QVariant
+from qgis.core import (QgsProcessing,
+                       QgsProcessingAlgorithm,
+                       QgsProcessingException,
+                       QgsProcessingParameterFeatureSource,
+                       QgsProcessingParameterFile,
+                       QgsProcessingParameterNumber,
+                       QgsProcessingParameterEnum,
+                       QgsProcessingParameterFeatureSink,
+                       QgsFeature,
+                       QgsField,
+                       QgsFields)
+
+from . import quality_analysis
+from .landmark_selection import select_landmarks
+from .visibility_store import VisibilityStore
+
+
+class LandmarkSelectionAlgorithm(QgsProcessingAlgorithm):
+    """
+    Greedily selects the landmarks that most reduce the mean (or a percentile of the) localization quality metric,
+    using the per-landmark viewsheds of a visibility store written by the Localization Quality algorithm, and outputs
+    them ranked in the order they were picked.
+    """
+
+    LANDMARKS_LAYER = "INPUT_LANDMARKS"
+    VISIBILITY_STORE = "VISIBILITY_STORE"
+    NUM_SELECTED = "NUM_SELECTED"
+    POINTING_ACCURACY = "POINTING_ACCURACY"
+    QUALITY_METRIC = "QUALITY_METRIC"
+    OBJECTIVE = "OBJECTIVE"
+    PERCENTILE = "PERCENTILE"
+
+    OUTPUT = "OUTPUT"
+
+    OBJECTIVE_MEAN = 0
+    OBJECTIVE_PERCENTILE = 1
+
+    def initAlgorithm(self, config):
+        """
+        Here we define the inputs and output of the algorithm, along
+        with some other properties.
+        """
+
+        # Candidate landmarks (the same layer the visibility store was computed for)
+        self.addParameter(
+            QgsProcessingParameterFeatureSource(
+                self.LANDMARKS_LAYER,
+                self.tr("Landmarks"),
+                [QgsProcessing.TypeVectorPoint]
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterFile(
+                self.VISIBILITY_STORE,
+                self.tr("Visibility store of the landmarks"),
+                extension="trnvis"
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterNumber(
+                self.NUM_SELECTED,
+                self.tr("Number of landmarks to select"),
+                QgsProcessingParameterNumber.Integer,
+                defaultValue=50,
+                minValue=1
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterNumber(
+                self.POINTING_ACCURACY,
+                self.tr("Pointing accuracy, milliradians"),
+                QgsProcessingParameterNumber.Double,
+                defaultValue=1.75
+            ),
+        )
+
+        self.addParameter(
+            QgsProcessingParameterEnum(
+                self.QUALITY_METRIC,
+                self.tr("Quality metric"),
+                ["GDOP = sqrt(trace(C))", "Worst-Case = sqrt(max_eigenvalue(C))"],
+                defaultValue=0
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterEnum(
+                self.OBJECTIVE,
+                self.tr("Minimize"),
+                ["Mean of quality metric", "Percentile of quality metric"],
+                defaultValue=self.OBJECTIVE_MEAN
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterNumber(
+                self.PERCENTILE,
+                self.tr("Percentile (when minimizing a percentile; keeps a sorted copy of the quality raster in memory)"),
+                QgsProcessingParameterNumber.Double,
+                defaultValue=90.0,
+                minValue=0.0,
+                maxValue=100.0
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterFeatureSink(
+                self.OUTPUT,
+                self.tr("Selected Landmarks")
+            )
+        )
+
+    def processAlgorithm(self, parameters, context, feedback):
+        """
+        Here is where the processing itself takes place.
+        """
+        landmarks_layer = self.parameterAsSource(parameters, self.LANDMARKS_LAYER, context)
+        store = VisibilityStore(self.parameterAsFile(parameters, self.VISIBILITY_STORE, context))
+
+        viewpoint_pixel_locs = quality_analysis.viewpoint_pixel_locations(landmarks_layer, store.geotransform)
+        if viewpoint_pixel_locs != [store.viewpoint(i) for i in range(len(store))]:
+            raise QgsProcessingException(self.tr("The visibility store was not computed for the given landmarks"))
+
+        num_selected = self.parameterAsInt(parameters, self.NUM_SELECTED, context)
+        pointing = self.parameterAsDouble(parameters, self.POINTING_ACCURACY, context) * 1e-3
+        metric_id = self.parameterAsEnum(parameters, self.QUALITY_METRIC, context)
+        percentile = None
+        if self.parameterAsEnum(parameters, self.OBJECTIVE, context) == self.OBJECTIVE_PERCENTILE:
+            percentile = self.parameterAsDouble(parameters, self.PERCENTILE, context)
+
+        fields = QgsFields(landmarks_layer.fields())
+        fields.append(QgsField("rank", QVariant.Int))
+        fields.append(QgsField("gain", QVariant.Double))
+        fields.append(QgsField("objective", QVariant.Double))
+        sink, dest_id = self.parameterAsSink(
+            parameters,
+            self.OUTPUT,
+            context,
+            fields,
+            landmarks_layer.wkbType(),
+            landmarks_layer.sourceCrs()     # same as input layer
+        )
+
+        def report_progress(fraction):
+            if feedback.isCanceled():
+                raise QgsProcessingException(self.tr("Canceled"))
+            feedback.setProgress(int(50 * fraction))     # first half: initial gains of all candidates
+
+        feedback.pushInfo(f"Selecting {min(num_selected, len(store))} of {len(store)} landmarks. . .")
+        landmarks = list(landmarks_layer.getFeatures())
+        picks = select_landmarks(store, num_selected, pointing, metric=metric_id, percentile=percentile, progress_callback=report_progress)
+        for rank, (i, gain, objective) in enumerate(picks, start=1):
+            if feedback.isCanceled():
+                return {}
+            feedback.setProgress(50 + int(50 * rank / min(num_selected, len(store))))
+            feedback.pushInfo(f"#{rank}: landmark {i} (gain {gain:.4g}, objective {objective:.4g})")
+
+            feature = QgsFeature(fields)
+            feature.setGeometry(landmarks[i].geometry())
+            feature.setAttributes(landmarks[i].attributes() + [rank, gain, objective])
+            sink.addFeature(feature)
+
+        return {
+            self.OUTPUT: dest_id
+        }
+
+
+    def name(self):
+        """
+        Returns the algorithm name, used for identifying the algorithm. This
+        string should be fixed for the algorithm, and must not be localised.
+        The name should be unique within each provider. Names should contain
+        lowercase alphanumeric characters only and no spaces or other
+        formatting characters.
+        """
+        return "select_landmarks"
+
+    def displayName(self):
+        """
+        Returns the translated algorithm name, which should be used for any
+        user-visible display of the algorithm name.
+        """
+        return "Select Landmarks"
+
+    def group(self):
+        """
+        Returns the name of the group this algorithm belongs to. This string
+        should be localised.
+        """
+        return self.tr(self.groupId())
+
+    def groupId(self):
+        """
+        Returns the unique ID of the group this algorithm belongs to. This
+        string should be fixed for the algorithm, and must not be localised.
+        The group id should be unique within each provider. Group id should
+        contain lowercase alphanumeric characters only and no spaces or other
+        formatting characters.
+        """
+        return ""
+
+    def tr(self, string):
+        return QCoreApplication.translate("Processing", string)
+
+    def createInstance(self):
+        return LandmarkSelectionAlgorithm()
@@ -0,0 +1,177 @@
+import hashlib
+
+import numpy as np
+
+from osgeo import gdal, ogr, osr
+
+from . import quality_analysis
+from .viewshed_analysis import read_dem
+
+
+# max number of DEM rows read at once by `slope_mask`, to bound its memory whatever the size of the DEM
+MAX_STRIP_ROWS = 1024
+
+
+def rasterize_polygons(wkbs, geotransform, shape):
+    """(h, w) mask of the pixels (of a raster with the given geotransform) whose centers are inside any of the WKB polygons"""
+    h, w = shape
+    ds = gdal.GetDriverByName("MEM").Create("", w, h, 1, gdal.GDT_Byte)
+    ds.SetGeoTransform(geotransform)
+
+    source = ogr.GetDriverByName("Memory").CreateDataSource("")
+    layer = source.CreateLayer("aoi", geom_type=ogr.wkbUnknown)
+    for wkb in wkbs:
+        feature = ogr.Feature(layer.GetLayerDefn())
+        feature.SetGeometry(ogr.CreateGeometryFromWkb(bytes(wkb)))
+        layer.CreateFeature(feature)
+    gdal.RasterizeLayer(ds, [1], layer, burn_values=[1])
+    return ds.GetRasterBand(1).ReadAsArray().astype(bool)
+
+
+def same_projection(wkt, other_wkt):
+    """whether the given projections (WKT) are the same spatial reference (an unknown, empty one only matches another)"""
+    if not wkt or not other_wkt:
+        return not wkt and not other_wkt
+    srs, other_srs = osr.SpatialReference(), osr.SpatialReference()
+    srs.ImportFromWkt(wkt)
+    other_srs.ImportFromWkt(other_wkt)
+    return bool(srs.IsSame(other_srs))
+
+
+def raster_mask(source, geotransform, shape, projection):
+    """
+    (h, w) mask of the nonzero, valid (not nodata) pixels of a traversability raster, which must be aligned with the
+    DEM of the given geotransform, shape and projection (WKT): same size, pixel grid (to 1/1000 pixel) and CRS
+    """
+    mask_gt, mask_shape = quality_analysis.read_raster_geometry(source)
+    if tuple(mask_shape) != tuple(shape):
+        raise ValueError(f"The mask raster ({mask_shape[1]}x{mask_shape[0]}) must be aligned with the DEM ({shape[1]}x{shape[0]})")
+    if not np.allclose(mask_gt, geotransform, rtol=0, atol=1e-3 * min(abs(geotransform[1]), abs(geotransform[5]))):
+        raise ValueError(f"The mask raster (geotransform {tuple(mask_gt)}) must be aligned with the DEM ({tuple(geotransform)})")
+    if not same_projection(quality_analysis.read_raster_projection(source), projection):
+        raise ValueError("The mask raster must be in the CRS of the DEM")
+    values = quality_analysis.read_raster(source, nan_nodata=True)
+    return np.isfinite(values) & (values != 0)
+
+
+def slope_mask(dem, geotransform, shape, max_slope):
+    """
+    (h, w) mask of the pixels of a DEM (a filename or a QgsRasterLayer) whose slope is at most `max_slope` degrees;
+    the DEM is read a strip of rows at a time (with one row of overlap, so slopes are the same as on the whole DEM)
+    """
+    h, w = shape
+    pixelSizeX, pixelSizeY = geotransform[1], -geotransform[5]
+    mask = np.zeros(shape, dtype=bool)
+    for r0 in range(0, h, MAX_STRIP_ROWS):
+        r1 = min(r0 + MAX_STRIP_ROWS, h)
+        halo = slice(max(r0 - 1, 0), min(r1 + 1, h))
+        strip, _ = read_dem(dem, (halo, slice(0, w)))
+        if strip.shape[0] < 2:
+            strip = np.vstack([strip, strip])       # a single row is flat along the columns
+        dz_dy, dz_dx = np.gradient(strip, pixelSizeY, pixelSizeX)
+        slope = np.degrees(np.arctan(np.hypot(dz_dx, dz_dy)))[r0 - halo.start : r1 - halo.start]
+        mask[r0:r1] = slope <= max_slope       # NaN (nodata, or next to it) is never traversable
+    return mask
+
+
+def analysis_mask(dem, aoi_wkbs=None, mask_raster=None, max_slope=None):
+    """
+    the (h, w) mask of the DEM pixels to compute the quality of: those inside any of the AOI polygons (WKB, in the CRS
+    of the DEM), valid in the traversability mask raster and with a slope of at most `max_slope` degrees, for each of
+    these that is given; None if none are
+    """
+    gt, shape = quality_analysis.read_raster_geometry(dem)
+    mask = None
+    if aoi_wkbs is not None:
+        mask = rasterize_polygons(aoi_wkbs, gt, shape)
+    if mask_raster is not None:
+        valid = raster_mask(mask_raster, gt, shape, quality_analysis.read_raster_projection(dem))
+        mask = valid if mask is None else mask & valid
+    if max_slope is not None:
+        mask = slope_mask(dem, gt, shape, max_slope) if mask is None else mask & slope_mask(dem, gt, shape, max_slope)
+    return mask
+
+
+class ValidPixels:
+    """
+    Compact index of the valid pixels of a (h, w) mask: their flat (row-major) indices, sorted, so that per-pixel
+    values of the valid pixels only can be kept in compact (n, ...) arrays, and the pixels of any window found by
+    binary search.
+    """
+
+    def __init__(self, mask):
+        self.shape = mask.shape
+        self.flat = np.flatnonzero(mask)
+        rows, cols = np.divmod(self.flat, self.shape[1])
+        self.rows, self.cols = rows.astype(np.int32), cols.astype(np.int32)
+
+    def __len__(self):
+        return len(self.flat)
+
+    def window(self, window):
+        """positions (in the compact arrays) of the valid pixels of the given (rows, cols) window, row by row"""
+        rows, cols = window
+        w = self.shape[1]
+        row_starts = np.arange(rows.start, rows.stop, dtype=np.int64) * w
+        lo = np.searchsorted(self.flat, row_starts + cols.start)
+        hi = np.searchsorted(self.flat, row_starts + cols.stop)
+        counts = hi - lo
+        # concatenation of the ranges lo[i]:hi[i]
+        return np.repeat(lo - np.cumsum(counts) + counts, counts) + np.arange(counts.sum())
+
+    def scatter(self, values, fill, dtype=None):
+        """full (h, w, ...) array of the given compact (n, ...) values of the valid pixels, `fill` elsewhere"""
+        values = np.asarray(values)
+        full = np.full(self.shape + values.shape[1:], fill, dtype=dtype or values.dtype)
+        full.reshape((-1,) + values.shape[1:])[self.flat] = values
+        return full
+
+
+def accumulate_masked_fims(viewsheds, valid, pixelSizeX, pixelSizeY, radius_px, fim_callback=None,
+                           visible_count=None, dtype=np.float32):
+    """
+    `quality_analysis.accumulate_viewshed_fims`, on the valid pixels of a `ValidPixels` index only: the FIM sum is a
+    compact (n, 3) array, and each viewshed only touches the valid pixels of its window. If given, the compact (n,)
+    `visible_count` is incremented in-place. `fim_callback(i, fim, window)` is still called with the whole FIM of each
+    landmark's window, if given.
+    """
+    kernel = quality_analysis.fim_kernel(pixelSizeX, pixelSizeY, *radius_px)
+    ry, rx = kernel.shape[0] // 2, kernel.shape[1] // 2
+    fim_sum = np.zeros((len(valid), 3), dtype=dtype)
+
+    for i, (viewpoint, window, viewshed) in enumerate(viewsheds):
+        if fim_callback is not None:
+            fim_callback(i, quality_analysis.landmark_fim(viewshed, viewpoint, window, kernel), window)
+
+        (px, py), (rows, cols) = viewpoint, window
+        positions = valid.window(window)
+        r, c = valid.rows[positions], valid.cols[positions]
+        visible = viewshed[r - rows.start, c - cols.start] != 0
+        positions, r, c = positions[visible], r[visible], c[visible]
+
+        fim_sum[positions] += kernel[r - py + ry, c - px + rx]     # positions are unique
+        if visible_count is not None:
+            visible_count[positions] += 1
+    return fim_sum
+
+
+def masked_quality_bands(fim_sum, pointing, valid, visible_count=None, bands=None, nodata_value=1_000_000):
+    """
+    `quality_analysis.quality_bands` of a compact (n, 3) FIM sum of the valid pixels of a `ValidPixels` index (and
+    their compact visible landmark counts), as full (len(bands), h, w) rasters that are nodata (or a count of 0)
+    everywhere else
+    """
+    bands = tuple(range(len(quality_analysis.QUALITY_BANDS))) if bands is None else tuple(bands)
+    compact = quality_analysis.quality_bands(
+        fim_sum[:, np.newaxis], pointing, None if visible_count is None else visible_count[:, np.newaxis],
+        bands=bands, nodata_value=nodata_value
+    )
+    return np.stack([
+        valid.scatter(values[:, 0], 0 if band == quality_analysis.VISIBLE_COUNT else nodata_value)
+        for band, values in zip(bands, compact)
+    ])
+
+
+def mask_hash(mask):
+    """hex digest of a mask, recorded in the manifests of masked running FIM sums"""
+    return hashlib.sha256(np.packbits(mask).tobytes() + repr(mask.shape).encode()).hexdigest()
@@ -36,18 +36,12 @@ from qgis.core import (QgsProcessing,
                        QgsField,
                        QgsFeature,
                        QgsGeometry,
-                       QgsExpression,
-                       QgsExpressionContext,
+                       QgsPointXY,
                        NULL)
 
-
-import processing
-
-from osgeo import gdal
-from affine import Affine
-
 import numpy as np
-from math import atan2, degrees
+
+from . import path_evaluation
 
 
 class PathAnimationAlgorithm(QgsProcessingAlgorithm):
@@ -247,98 +241,66 @@ class PathAnimationAlgorithm(QgsProcessingAlgorithm):
 
         # split path into waypoints
         distance_between_waypoints = robot_speed * seconds_per_waypoint
-        waypoints_layer_name = processing.run(
-            "native:pointsalonglines",
-            {
-                'INPUT': parameters[self.PATH],
-                'DISTANCE': distance_between_waypoints,
-                'END_OFFSET': 0,
-                'START_OFFSET': 0,
-                'OUTPUT': 'TEMPORARY_OUTPUT'
-            },
-            is_child_algorithm=True,
-            context=context,
-            feedback=feedback
-        )["OUTPUT"]
-        waypoints_layer = context.takeResultLayer(waypoints_layer_name)
+        path_waypoints = [
+            path_evaluation.points_along_line([(v.x(), v.y()) for v in part.vertices()], distance_between_waypoints)
+            for path in path_layer.getFeatures() for part in path.geometry().constParts()
+        ]
+        waypoint_coords = np.concatenate(path_waypoints or [np.empty((0, 2))])
 
 
         # assosciate timestamps with waypoints and add to output sink
         waypoints = []
-        for i, waypoint in enumerate(waypoints_layer.getFeatures()):
+        for i, (x, y) in enumerate(waypoint_coords):
             timestamp = start_time.addSecs(seconds_per_waypoint * i)
-            waypoint_copy = QgsFeature(waypoint)
-            waypoint_copy.setFields(waypoints_fields)
-            waypoint_copy.setAttribute("timestamp", timestamp)
-            waypoints_sink.addFeature(waypoint_copy)
-            waypoints.append(waypoint_copy)
+            waypoint = QgsFeature(waypoints_fields)
+            waypoint.setGeometry(QgsGeometry.fromPointXY(QgsPointXY(x, y)))
+            waypoint.setAttribute("timestamp", timestamp)
+            waypoints_sink.addFeature(waypoint)
+            waypoints.append(waypoint)
+
+
+        # sample every FIM raster at every waypoint in one pass per raster
+        landmarks = landmarks[:len(fim_layers)]
+        landmark_points = [landmark.geometry().asPoint() for landmark in landmarks]
 
+        def report_progress(fraction):
+            feedback.setProgress(int(100 * fraction))
+            return not feedback.isCanceled()       # stops sampling
 
-        # compute observation rays and covariance ellipses and add them to their respective sinks
-        expr_context = QgsExpressionContext()
-        for waypoint in waypoints:
-            feedback.pushDebugInfo(f"waypoint: {waypoint.attributes()} @ {waypoint.geometry()}")
+        total_fims, visible = path_evaluation.path_fims(waypoint_coords, fim_layers[:len(landmarks)], progress_callback=report_progress)
+        if feedback.isCanceled(): return {}
+
+
+        # compute observation rays and add them to their sink
+        for w, waypoint in enumerate(waypoints):
             if feedback.isCanceled(): return {}
 
             timestamp = waypoint.attribute("timestamp")
-            waypoint_point = waypoint.geometry().asPoint()
-
-            total_fim = np.array([0.0, 0.0, 0.0])
-
-            # create observation rays
-            for landmark, fim_layer in zip(landmarks, fim_layers):
-                fim_result = [fim_layer.dataProvider().sample(waypoint_point, i)[0] for i in range(1, 4)]
-                # feedback.pushDebugInfo(f"fim_result: {fim_result}")
-
-                total_fim += np.array(fim_result)
-
-                if fim_result != [0.0, 0.0, 0.0]:   # landmark is visible
-                    # create a new feature
-                    seg = QgsFeature()
-                    line_start = waypoint_point
-                    line_end = landmark.geometry().asPoint()
-                    seg.setGeometry(QgsGeometry.fromPolylineXY([line_start, line_end]))
-                    seg.setFields(rays_fields)
-                    seg.setAttribute("timestamp", timestamp)
-                    rays_sink.addFeature(seg)
-            
-            total_fim /= pointing ** 2
-
-            # create covariance ellipses
-            fim_mat = np.array([
-                [total_fim[0], total_fim[1]],
-                [total_fim[1], total_fim[2]]
-            ])
-
-            try:
-                cov_mat = np.linalg.inv(fim_mat)    # TODO: handle singular matrix exception
-            except np.linalg.LinAlgError:
-                feedback.pushDebugInfo(f"singular FIM encountered at {waypoint_point}")
-                continue
-        
-            ellipse = QgsFeature()
+            for j in np.flatnonzero(visible[w]):
+                # create a new feature
+                seg = QgsFeature()
+                line_start = QgsPointXY(*waypoint_coords[w])
+                line_end = landmark_points[j]
+                seg.setGeometry(QgsGeometry.fromPolylineXY([line_start, line_end]))
+                seg.setFields(rays_fields)
+                seg.setAttribute("timestamp", timestamp)
+                rays_sink.addFeature(seg)
+
+
+        # compute covariance ellipses for all waypoints at once and add them to their sink
+        drawn, rings, singular = path_evaluation.covariance_ellipses(waypoint_coords, total_fims, pointing, num_sds)
+        feedback.pushDebugInfo(f"singular FIMs: {singular.sum()}, infinite GDOP: {(~singular & ~drawn).sum()}")
+
+        for w, wkb in zip(np.flatnonzero(drawn), path_evaluation.polygon_wkbs(rings)):
+            if feedback.isCanceled(): return {}
 
-            # https://cookierobotics.com/007/
-            try:
-                eigs, _ = np.linalg.eig(cov_mat)
-                l1, l2 = sorted(eigs, reverse=True)
-                if l1 > 1_000_000:
-                    feedback.pushDebugInfo(f"GDOP: infty")
-                    continue     # don't draw stupudly huge ellipses
-                # if l1 < l2: l1, l2 = l2, l1
-                feedback.pushDebugInfo(f"GDOP: {l1 ** 0.5 + l2 ** 0.5}")
-                major = (l1 ** 0.5) * num_sds
-                minor = (l2 ** 0.5) * num_sds
-                theta = degrees(atan2(l1 - cov_mat[0,0], cov_mat[0,1])) + 90     # TODO: make sure this is right
-                feedback.pushDebugInfo(f"{major}, {minor}, {theta}")
-                ellipse_expr = QgsExpression(f"make_ellipse(make_point({waypoint_point.x()},{waypoint_point.y()}), {major}, {minor}, {theta})")
-                ellipse.setGeometry(ellipse_expr.evaluate(expr_context))
-                ellipse.setFields(ellipses_fields)
-                ellipse.setAttribute("timestamp", timestamp)
-                ellipses_sink.addFeature(ellipse)
-            except np.linalg.LinAlgError:
-                feedback.pushDebugInfo(f"GDOP: infty")
-                continue
+            ellipse = QgsFeature()
+            geometry = QgsGeometry()
+            geometry.fromWkb(wkb)
+            ellipse.setGeometry(geometry)
+            ellipse.setFields(ellipses_fields)
+            ellipse.setAttribute("timestamp", waypoints[w].attribute("timestamp"))
+            ellipses_sink.addFeature(ellipse)
 
 
 
@@ -0,0 +1,90 @@
+import numpy as np
+
+from . import quality_analysis
+
+
+def points_along_line(vertices, spacing):
+    """
+    points every `spacing` map units along the polyline through the given (m, 2) vertices, starting at its first
+    vertex (and only including the last one if the length is a multiple of the spacing), as an (n, 2) array; same
+    points as QGIS' "Points along geometry" without offsets
+    """
+    if spacing <= 0:
+        raise ValueError("Distance between points must be positive")
+    vertices = np.asarray(vertices, dtype=np.float64).reshape(-1, 2)
+    if len(vertices) == 0:
+        return np.empty((0, 2))
+
+    lengths = np.concatenate([[0.0], np.cumsum(np.hypot(*np.diff(vertices, axis=0).T))])
+    distances = np.arange(0.0, lengths[-1] + 1e-9 * max(lengths[-1], 1.0), spacing)
+    return np.stack([np.interp(distances, lengths, vertices[:,0]), np.interp(distances, lengths, vertices[:,1])], axis=1)
+
+
+def path_fims(waypoints, fim_paths, progress_callback=None):
+    """
+    sample the FIM rasters (filenames or QgsRasterLayers) of each landmark at every one of the (n, 2) waypoint
+    coordinates; returns the (n, 3) sum of the landmark FIMs at each waypoint, and an (n, num_landmarks) mask of the
+    landmarks visible from it. `progress_callback(fraction)` is called after each raster; if it returns False,
+    sampling stops there (e.g. when canceled), and the sums so far are returned.
+    """
+    total_fims = np.zeros((len(waypoints), 3))
+    visible = np.zeros((len(waypoints), len(fim_paths)), dtype=bool)
+    for j, samples in enumerate(quality_analysis.iter_fim_samples(fim_paths, waypoints)):
+        total_fims += samples
+        visible[:,j] = samples.any(axis=1)      # landmark is visible
+        if progress_callback is not None and progress_callback((j + 1) / len(fim_paths)) is False:
+            break
+    return total_fims, visible
+
+
+def covariance_ellipses(waypoints, total_fims, pointing, num_sds):
+    """
+    the `num_sds`-sigma covariance ellipses of the position estimates at the given (n, 2) waypoints, from their (n, 3)
+    summed FIMs (see `path_fims`) and the pointing accuracy in radians; returns a mask of the waypoints whose ellipse
+    can be drawn, the (drawn, segments + 1, 2) rings of their ellipses and a mask of the singular FIMs
+    """
+    # https://cookierobotics.com/007/
+    _, l1, l2, singular = quality_analysis.fim_covariances(total_fims / pointing ** 2)
+    with np.errstate(invalid="ignore"):
+        too_large = l1 > 1_000_000      # don't draw stupudly huge ellipses
+    drawn = ~singular & ~too_large & np.isfinite(l1) & np.isfinite(l2)
+
+    major = np.sqrt(l1[drawn]) * num_sds
+    minor = np.sqrt(l2[drawn]) * num_sds
+    theta = quality_analysis.major_axis_azimuth(*total_fims[drawn].T)
+    return drawn, ellipse_rings(waypoints[drawn], major, minor, theta), singular
+
+
+def ellipse_rings(centers, semi_major, semi_minor, azimuth, segments=36):
+    """
+    vertices of the closed rings of n ellipses with the given (n, 2) centers, axes and azimuths (degrees clockwise
+    from north, of the major axis), as an (n, segments + 1, 2) array; same vertices as QGIS' `make_ellipse`
+    """
+    t = np.linspace(0, 2 * np.pi, segments + 1)[np.newaxis,:]
+    t[:,-1] = 0.0       # close the ring exactly
+    angle = np.radians(90.0 - azimuth)[:,np.newaxis]
+    cos_angle, sin_angle = np.cos(angle), np.sin(angle)
+    major_t = semi_major[:,np.newaxis] * np.cos(t)
+    minor_t = semi_minor[:,np.newaxis] * np.sin(t)
+
+    rings = np.empty((len(centers), segments + 1, 2))
+    rings[:,:,0] = centers[:,0,np.newaxis] + major_t * cos_angle - minor_t * sin_angle
+    rings[:,:,1] = centers[:,1,np.newaxis] + major_t * sin_angle + minor_t * cos_angle
+    return rings
+
+
+def polygon_wkbs(rings):
+    """encode an (n, m, 2) array of closed rings as n single-ring WKB polygons, all at once"""
+    n, m, _ = rings.shape
+    wkb_dtype = np.dtype([
+        ("byte_order", "u1"), ("wkb_type", "<u4"), ("num_rings", "<u4"), ("num_points", "<u4"), ("points", "<f8", (m, 2))
+    ])
+    wkbs = np.empty(n, dtype=wkb_dtype)
+    wkbs["byte_order"] = 1      # little endian
+    wkbs["wkb_type"] = 3        # Polygon
+    wkbs["num_rings"] = 1
+    wkbs["num_points"] = m
+    wkbs["points"] = rings
+
+    data = wkbs.tobytes()
+    return [data[i * wkb_dtype.itemsize : (i + 1) * wkb_dtype.itemsize] for i in range(n)]
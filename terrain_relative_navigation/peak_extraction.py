@@ -0,0 +1,433 @@
+import functools
+import math
+
+import numpy as np
+
+
+# max number of window pixels gathered at once when fitting candidate peaks, to bound the size of temporaries
+MAX_FIT_SAMPLES = 4_000_000
+
+# max number of pixels (including the window halo) classified at once by `classify_features`
+MAX_STRIP_PIXELS = 4_000_000
+
+# r.param.scale 'feature' classes
+PLANAR, PIT, CHANNEL, PASS, RIDGE, PEAK = range(1, 7)
+
+
+def round_up_to_odd(x: float) -> int:
+    """round the given float up to the nearest odd integer"""
+    n = math.ceil(x)
+    return n + (1 - n%2)
+
+
+def window_size_in_pixels(window_size, pixelSizeX, pixelSizeY):
+    """convert an analysis window size in map units to an odd number of pixels (the window needs a "center" pixel)"""
+    size = round_up_to_odd(window_size / pixelSizeX)
+    if size <= 1:
+        raise ValueError(f"Analysis window must be >1px per side (given DEM has pixel size {pixelSizeX}m x {pixelSizeY}m)")
+    return size
+
+
+def running_max(a, size, axis):
+    """
+    maximum over the centered window of the given odd size along one axis of a float array (-inf beyond the edges),
+    in constant time per element regardless of the window size (van Herk / Gil-Werman)
+    """
+    r = size // 2
+    a = np.moveaxis(a, axis, -1)
+    n = a.shape[-1]
+    num_blocks = -(-(n + 2 * r) // size)
+
+    padded = np.full(a.shape[:-1] + (num_blocks * size,), -np.inf)
+    padded[..., r:r + n] = a
+    blocks = padded.reshape(a.shape[:-1] + (num_blocks, size))
+
+    # max from the start of each block up to each element, and from each element up to the end of its block
+    prefix = np.maximum.accumulate(blocks, axis=-1).reshape(padded.shape)
+    suffix = np.maximum.accumulate(blocks[..., ::-1], axis=-1)[..., ::-1].reshape(padded.shape)
+
+    # the window starting at padded index i spans at most two blocks: [i, end of block] and [start of block, i+size-1]
+    result = np.maximum(suffix[..., :n], prefix[..., size - 1:size - 1 + n])
+    return np.moveaxis(result, -1, axis)
+
+
+def maximum_filter(dem, size):
+    """maximum of the (size, size) window around each pixel, ignoring NaN (nodata) pixels"""
+    dem = np.where(np.isnan(dem), -np.inf, dem)
+    return running_max(running_max(dem, size, 0), size, 1)
+
+
+def local_maxima(dem, size):
+    """(rows, cols) of the pixels that are the highest of the full (size, size) window around them"""
+    r = size // 2
+    is_max = dem == maximum_filter(dem, size)       # never true for NaN pixels
+
+    # like r.param.scale, only pixels whose whole window is on the raster are classified
+    is_max[:r] = False
+    is_max[dem.shape[0] - r:] = False
+    is_max[:, :r] = False
+    is_max[:, dem.shape[1] - r:] = False
+    return np.nonzero(is_max)
+
+
+@functools.lru_cache(maxsize=8)
+def quadratic_design(size, pixelSizeX, pixelSizeY):
+    """
+    (size*size, 6) design matrix of the terms (x^2, y^2, x*y, x, y, 1) of a quadratic surface over the row-major pixels
+    of a (size, size) window, with x, y the map offsets from the window center
+    """
+    r = size // 2
+    y, x = np.mgrid[-r:r + 1, -r:r + 1]
+    x, y = (x * pixelSizeX).ravel(), (-y * pixelSizeY).ravel()       # rows go south
+    return np.stack([x * x, y * y, x * y, x, y, np.ones_like(x)], axis=1)
+
+
+@functools.lru_cache(maxsize=8)
+def quadratic_fit_matrix(size, pixelSizeX, pixelSizeY):
+    """
+    (6, size*size) least-squares matrix that maps the row-major elevations of a (size, size) window to the coefficients
+    (a, b, c, d, e, f) of z = a*x^2 + b*y^2 + c*x*y + d*x + e*y + f
+    """
+    return np.linalg.pinv(quadratic_design(size, pixelSizeX, pixelSizeY))
+
+
+def peak_shape_mask(dem, rows, cols, size, pixelSizeX, pixelSizeY, slope_tolerance=1.0, curvature_tolerance=0.0001):
+    """
+    for each of the given (interior) candidate pixels, whether a quadratic surface fit to its (size, size) window is
+    a peak in the sense of r.param.scale's 'feature' classification: flatter than `slope_tolerance` degrees, and curving
+    down by more than `curvature_tolerance` in every direction
+    """
+    r = size // 2
+    fit = quadratic_fit_matrix(size, pixelSizeX, pixelSizeY)
+    dy, dx = np.mgrid[-r:r + 1, -r:r + 1]
+    dy, dx = dy.ravel(), dx.ravel()
+
+    mask = np.zeros(len(rows), dtype=bool)
+    chunk = max(MAX_FIT_SAMPLES // (size * size), 1)
+    for start in range(0, len(rows), chunk):
+        windows = dem[rows[start:start + chunk, np.newaxis] + dy, cols[start:start + chunk, np.newaxis] + dx]
+        a, b, c, d, e, _ = fit @ windows.T
+
+        slope = np.degrees(np.arctan(np.hypot(d, e)))
+        # largest eigenvalue of the Hessian [[2a, c], [c, 2b]]
+        max_curvature = (a + b) + np.sqrt(np.square(a - b) + np.square(c))
+
+        # NaN windows (touching nodata) are never peaks
+        mask[start:start + chunk] = (slope < slope_tolerance) & (max_curvature < -curvature_tolerance)
+    return mask
+
+
+def window_moments(a, size, max_power, axis):
+    """
+    the moments [sum(d^p * a[i + d] for d in -r..r) for p in 0..max_power] of the centered window of the given odd size
+    around every element along one axis (zero beyond the edges), at constant cost per element regardless of the window
+    size. They are differences of prefix sums, taken over segments of the axis with local coordinates so that the
+    float64 sums stay accurate on wide rasters.
+    """
+    r = size // 2
+    a = np.moveaxis(a, axis, -1)
+    n = a.shape[-1]
+    segment = max(size, 256)
+    moments = [np.empty(a.shape) for _ in range(max_power + 1)]
+
+    for s in range(0, n, segment):
+        e = min(s + segment, n)
+        lo, hi = max(s - r, 0), min(e + r, n)
+        j = np.arange(lo, hi) - s                  # coordinates relative to the segment start
+        centers = np.arange(e - s)
+        start = np.clip(centers - r + s, lo, hi) - lo
+        stop = np.clip(centers + r + 1 + s, lo, hi) - lo
+
+        # window sums of j^p * a
+        sums = []
+        prefix = np.zeros(a.shape[:-1] + (hi - lo + 1,))
+        for p in range(max_power + 1):
+            np.cumsum(a[..., lo:hi] * j**p, axis=-1, out=prefix[..., 1:])
+            sums.append(prefix[..., stop] - prefix[..., start])
+
+        # (j - center)^p, expanded binomially
+        for p in range(max_power + 1):
+            moments[p][..., s:e] = sum(math.comb(p, q) * (-centers)**(p - q) * sums[q] for q in range(p + 1))
+
+    return [np.moveaxis(m, -1, axis) for m in moments]
+
+
+def quadratic_surface(dem, size, pixelSizeX, pixelSizeY):
+    """
+    least-squares fit of z = a*x^2 + b*y^2 + c*x*y + d*x + e*y + f to the (size, size) window around every pixel of a
+    DEM array (as in r.param.scale, with uniform weights), computed from separable window moments so that the cost
+    per pixel does not depend on the window size. Returns the (5, h, w) coefficients (a, b, c, d, e), which are NaN
+    where the window is not entirely on the DEM or touches a nodata (NaN) pixel.
+    """
+    r = size // 2
+    nodata = np.isnan(dem)
+    z = np.where(nodata, 0.0, dem - np.nanmean(dem) if not nodata.all() else 0.0)     # (the offset only changes f)
+
+    # moments in pixel offsets (u: columns, v: rows)
+    x0, x1, x2 = window_moments(z, size, 2, axis=1)
+    m00, m01, m02 = window_moments(x0, size, 2, axis=0)
+    m10, m11 = window_moments(x1, size, 1, axis=0)
+    m20, = window_moments(x2, size, 0, axis=0)
+    del x0, x1, x2
+
+    # moments of the design terms (x^2, y^2, x*y, x, y, 1) in map offsets, where y = -v * pixelSizeY
+    moments = np.stack([
+        pixelSizeX**2 * m20, pixelSizeY**2 * m02, -pixelSizeX * pixelSizeY * m11,
+        pixelSizeX * m10, -pixelSizeY * m01, m00
+    ])
+    design = quadratic_design(size, pixelSizeX, pixelSizeY)
+    solve = np.linalg.inv(design.T @ design)[:5]
+    coefficients = np.einsum("ij,j...->i...", solve, moments)
+
+    invalid = window_moments(nodata.astype(np.float64), size, 0, axis=1)[0]
+    invalid = window_moments(invalid, size, 0, axis=0)[0] > 0.5
+    invalid[:r] = invalid[dem.shape[0] - r:] = True
+    invalid[:, :r] = invalid[:, dem.shape[1] - r:] = True
+    coefficients[:, invalid] = np.nan
+    return coefficients
+
+
+def classify_features(dem, size, pixelSizeX, pixelSizeY, slope_tolerance=1.0, curvature_tolerance=0.0001):
+    """
+    classify every pixel of a DEM array into the morphometric features of r.param.scale's 'feature' method (PLANAR,
+    PIT, CHANNEL, PASS, RIDGE, PEAK; 0 where the window is off the DEM or touches nodata) from the quadratic surface
+    fit to its (size, size) window. Works through strips of rows, so memory use is bounded for large rasters.
+    """
+    h, w = dem.shape
+    r = size // 2
+    features = np.zeros((h, w), dtype=np.uint8)
+    strip = max(MAX_STRIP_PIXELS // w - 2 * r, 1)
+
+    for start in range(0, h, strip):
+        stop = min(start + strip, h)
+        lo, hi = max(start - r, 0), min(stop + r, h)
+        a, b, c, d, e = quadratic_surface(dem[lo:hi], size, pixelSizeX, pixelSizeY)[:, start - lo : stop - lo]
+
+        # slope and curvatures, as defined by r.param.scale (positive curvature = convex)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            slope = np.degrees(np.arctan(np.hypot(d, e)))
+            root = np.sqrt(np.square(a - b) + np.square(c))
+            max_curvature = -a - b + root
+            min_curvature = -a - b - root
+            cross_curvature = -2 * (b * d * d + a * e * e - c * d * e) / (d * d + e * e)
+
+        steep = slope > slope_tolerance
+        flat = slope <= slope_tolerance
+        classes = np.select(
+            [
+                steep & (cross_curvature > curvature_tolerance),
+                steep & (cross_curvature < -curvature_tolerance),
+                steep,
+                flat & (max_curvature > curvature_tolerance) & (min_curvature > curvature_tolerance),
+                flat & (max_curvature > curvature_tolerance) & (min_curvature < -curvature_tolerance),
+                flat & (max_curvature > curvature_tolerance),
+                flat & (min_curvature < -curvature_tolerance) & (max_curvature < -curvature_tolerance),
+                flat & (min_curvature < -curvature_tolerance),
+                flat,
+            ],
+            [RIDGE, CHANNEL, PLANAR, PEAK, PASS, RIDGE, PIT, CHANNEL, PLANAR],
+            default=0       # NaN coefficients
+        )
+        features[start:stop] = classes
+    return features
+
+
+def connected_labels(n, i, j):
+    """
+    label the connected components of the graph with nodes 0..n-1 and edges (i[k], j[k]): each node gets the smallest
+    node of its component. Union-find, vectorized: every edge joining two components hooks the larger root onto the
+    smaller one, and pointer jumping then flattens the trees, until no edge joins two components.
+    """
+    labels = np.arange(n)
+    i, j = np.asarray(i, dtype=np.int64), np.asarray(j, dtype=np.int64)
+    while True:
+        li, lj = labels[i], labels[j]
+        joins = li != lj
+        if not joins.any():
+            return labels
+        i, j, li, lj = i[joins], j[joins], li[joins], lj[joins]      # edges within a component stay that way
+        np.minimum.at(labels, np.maximum(li, lj), np.minimum(li, lj))
+        while True:
+            jumped = labels[labels]
+            if np.array_equal(jumped, labels):
+                break
+            labels = jumped
+
+
+def pixel_neighbors(rows, cols, shape):
+    """(i, j) index pairs of the given row-major sorted pixels that are 8-connected neighbors"""
+    w = shape[1]
+    index = rows * w + cols
+    pairs_i, pairs_j = [], []
+    for dr, dc in [(0, 1), (1, -1), (1, 0), (1, 1)]:
+        r, c = rows + dr, cols + dc
+        inside = (r < shape[0]) & (c >= 0) & (c < w)
+        neighbor = r * w + c
+        k = np.minimum(np.searchsorted(index, neighbor), len(index) - 1)
+        found = inside & (index[k] == neighbor)
+        pairs_i.append(np.nonzero(found)[0])
+        pairs_j.append(k[found])
+    return np.concatenate(pairs_i), np.concatenate(pairs_j)
+
+
+def nearby_pixel_pairs(rows, cols, pixelSizeX, pixelSizeY, spacing):
+    """
+    (i, j) index pairs of the given pixels whose squares are closer than `spacing` map units to each other, i.e. whose
+    `spacing / 2` buffers overlap; uses a grid of cells just larger than that distance as a spatial index, so only
+    pixels in neighboring cells are compared
+    """
+    cell = spacing + pixelSizeX + pixelSizeY        # upper bound on the center distance of such pixels
+    cell_x = np.floor(cols * pixelSizeX / cell).astype(np.int64)
+    cell_y = np.floor(rows * pixelSizeY / cell).astype(np.int64)
+
+    grid = {}
+    for k, key in enumerate(zip(cell_y.tolist(), cell_x.tolist())):
+        grid.setdefault(key, []).append(k)
+    grid = {key: np.array(members) for key, members in grid.items()}
+
+    pairs_i, pairs_j = [], []
+    for (cy, cx), members in grid.items():
+        # each pair of cells is visited once
+        for dy, dx in [(0, 0), (0, 1), (1, -1), (1, 0), (1, 1)]:
+            others = grid.get((cy + dy, cx + dx))
+            if others is None:
+                continue
+            gap_x = np.maximum(np.abs(cols[members, np.newaxis] - cols[others]) - 1, 0) * pixelSizeX
+            gap_y = np.maximum(np.abs(rows[members, np.newaxis] - rows[others]) - 1, 0) * pixelSizeY
+            a, b = np.nonzero(np.square(gap_x) + np.square(gap_y) < spacing**2)
+            pairs_i.append(members[a])
+            pairs_j.append(others[b])
+
+    if not pairs_i:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    return np.concatenate(pairs_i), np.concatenate(pairs_j)
+
+
+def find_pixels(rows, cols, shape, query_rows, query_cols):
+    """whether each of the query pixels is one of the given row-major sorted pixels (of a raster of the given shape)"""
+    h, w = shape
+    index = rows * w + cols
+    inside = (query_rows >= 0) & (query_rows < h) & (query_cols >= 0) & (query_cols < w)
+    query = query_rows * w + query_cols
+    k = np.minimum(np.searchsorted(index, query), len(index) - 1)
+    return inside & (index[k] == query)
+
+
+def pixel_clusters(rows, cols, shape, pixelSizeX, pixelSizeY, spacing):
+    """
+    cluster the given row-major sorted pixels (of a raster of the given shape): connected pixels are labeled as
+    regions, and regions closer than `spacing` map units to each other are merged (as the dissolved `spacing / 2`
+    buffers of their pixels would be). Returns the label of each pixel: the index of the first pixel of its cluster.
+    """
+    labels = connected_labels(len(rows), *pixel_neighbors(rows, cols, shape))
+
+    if spacing > 0 and len(rows) > 0:
+        # the closest pixels of two regions are always on their boundaries
+        interior = np.ones(len(rows), dtype=bool)
+        for dr, dc in [(-1, 0), (1, 0), (0, -1), (0, 1)]:
+            interior &= find_pixels(rows, cols, shape, rows + dr, cols + dc)
+        boundary = np.nonzero(~interior)[0]
+        i, j = nearby_pixel_pairs(rows[boundary], cols[boundary], pixelSizeX, pixelSizeY, spacing)
+        i, j = labels[boundary[i]], labels[boundary[j]]
+        joins = i != j
+        labels = connected_labels(len(rows), i[joins], j[joins])[labels]
+    return labels
+
+
+def cluster_centroids(rows, cols, labels, geotransform):
+    """
+    the (n, 2) map coordinates of the centroid of the pixels of each cluster (weighted by pixel area), in the order of
+    their labels, and the number of pixels of each cluster
+    """
+    _, cluster, counts = np.unique(labels, return_inverse=True, return_counts=True)
+    col_centers = np.bincount(cluster, weights=cols + 0.5) / counts
+    row_centers = np.bincount(cluster, weights=rows + 0.5) / counts
+
+    xs = geotransform[0] + col_centers * geotransform[1] + row_centers * geotransform[2]
+    ys = geotransform[3] + col_centers * geotransform[4] + row_centers * geotransform[5]
+    return np.stack([xs, ys], axis=1), counts
+
+
+def cluster_peak_pixels(rows, cols, shape, geotransform, spacing):
+    """
+    group the given row-major sorted peak pixels of a raster of the given shape into peaks (see `pixel_clusters`).
+    Returns the (n, 2) map coordinates of the centroid of each peak's pixels (weighted by pixel area), and the number
+    of pixels of each peak.
+    """
+    if len(rows) == 0:
+        return np.zeros((0, 2)), np.zeros(0, dtype=np.int64)
+    pixelSizeX, pixelSizeY = abs(geotransform[1]), abs(geotransform[5])
+    labels = pixel_clusters(rows, cols, shape, pixelSizeX, pixelSizeY, spacing)
+    return cluster_centroids(rows, cols, labels, geotransform)
+
+
+def cluster_peaks(peak_mask, geotransform, spacing):
+    """group the peak pixels of a boolean raster into peaks, on the raster (see `cluster_peak_pixels`)"""
+    return cluster_peak_pixels(*np.nonzero(peak_mask), peak_mask.shape, geotransform, spacing)
+
+
+def suppress_non_maxima(xs, ys, elevations, spacing):
+    """
+    indices of the points to keep so that no two kept points are closer than `spacing` (map units), preferring
+    higher points; uses a grid of `spacing`-sized cells as a spatial index, so only neighboring cells are searched
+    """
+    order = np.argsort(-elevations, kind="stable")
+    if spacing <= 0:
+        return order
+
+    grid = {}
+    kept = []
+    for i in order:
+        x, y = xs[i], ys[i]
+        cx, cy = int(np.floor(x / spacing)), int(np.floor(y / spacing))
+        near = (
+            (xs[j] - x)**2 + (ys[j] - y)**2 < spacing**2
+            for gx in (cx - 1, cx, cx + 1) for gy in (cy - 1, cy, cy + 1) for j in grid.get((gx, gy), ())
+        )
+        if not any(near):
+            grid.setdefault((cx, cy), []).append(i)
+            kept.append(i)
+    return np.array(kept, dtype=np.int64)
+
+
+def peak_candidates(dem, size, pixelSizeX, pixelSizeY, slope_tolerance=1.0, curvature_tolerance=0.0001):
+    """
+    (rows, cols) of the candidate peaks of a DEM array (NaN for nodata), in row-major order: pixels that are the local
+    maximum of their (size, size) window and whose window has a peak shape (see `peak_shape_mask`)
+    """
+    rows, cols = local_maxima(dem, size)
+    is_peak = peak_shape_mask(dem, rows, cols, size, pixelSizeX, pixelSizeY, slope_tolerance, curvature_tolerance)
+    return rows[is_peak], cols[is_peak]
+
+
+def thin_peaks(rows, cols, elevations, geotransform, spacing):
+    """
+    thin the given row-major sorted candidate peak pixels so that no two are closer than `spacing` map units
+    (preferring higher ones, see `suppress_non_maxima`); returns the (n, 2) map coordinates of the kept pixel centers
+    and their elevations, highest first
+    """
+    xs = geotransform[0] + (cols + 0.5) * geotransform[1] + (rows + 0.5) * geotransform[2]
+    ys = geotransform[3] + (cols + 0.5) * geotransform[4] + (rows + 0.5) * geotransform[5]
+    keep = suppress_non_maxima(xs, ys, elevations, spacing)
+    return np.stack([xs[keep], ys[keep]], axis=1), elevations[keep]
+
+
+def extract_peaks(dem, geotransform, size, spacing, slope_tolerance=1.0, curvature_tolerance=0.0001):
+    """
+    find the peaks of a DEM array (NaN for nodata) directly on the raster: the candidate peaks (see
+    `peak_candidates`), thinned so that no two peaks are closer than `spacing` map units. Returns the (n, 2) map
+    coordinates of the peak pixel centers and their elevations, highest first.
+    """
+    rows, cols = peak_candidates(dem, size, geotransform[1], -geotransform[5], slope_tolerance, curvature_tolerance)
+    return thin_peaks(rows, cols, dem[rows, cols], geotransform, spacing)
+
+
+def feature_peaks(dem, geotransform, size, spacing, slope_tolerance=1.0, curvature_tolerance=0.0001):
+    """
+    find the peaks of a DEM array (NaN for nodata) the way r.param.scale does: the pixels classified as PEAK (see
+    `classify_features`), grouped into peaks no closer than `spacing` map units (see `cluster_peaks`). Returns the
+    (n, 2) map coordinates of the peaks.
+    """
+    features = classify_features(dem, size, geotransform[1], -geotransform[5], slope_tolerance, curvature_tolerance)
+    points, _ = cluster_peaks(features == PEAK, geotransform, spacing)
+    return points
@@ -21,27 +21,46 @@ __copyright__ = "(C) 2021 by NASA JPL"
 
 __revision__ = "$Format:%H$"
 
-from qgis.PyQt.QtCore import QCoreApplication
+from qgis.PyQt.QtCore import QCoreApplication, QVariant
 from qgis.core import (QgsProcessing,
                        QgsProcessingAlgorithm,
+                       QgsProcessingException,
                        QgsProcessingParameterRasterLayer,
                        QgsProcessingParameterNumber,
+                       QgsProcessingParameterEnum,
+                       QgsProcessingParameterBoolean,
                        QgsProcessingParameterFeatureSink,
+                       QgsProcessingParameterFileDestination,
+                       QgsProcessingParameterFile,
+                       QgsProcessingParameterFolderDestination,
+                       QgsProcessingParameterString,
+                       QgsFeature,
+                       QgsField,
                        QgsFields,
+                       QgsGeometry,
+                       QgsPointXY,
+                       QgsProcessingUtils,
                        QgsWkbTypes)
 
+from osgeo import gdal, ogr
+
 
 import processing
 # import grass.script as grass
 
 
-import math
+import os
 
+import numpy as np
 
-def round_up_to_odd(x: float) -> int:
-    """round the given float up to the nearest odd integer"""
-    n = math.ceil(x)
-    return n + (1 - n%2)
+from . import instrumentation
+from . import peak_extraction
+from . import peak_stages
+from . import prominence
+from . import quality_analysis
+from . import tiled_peaks
+from . import vector_io
+from . import viewshed_analysis
 
 
 class PeakExtractorAlgorithm(QgsProcessingAlgorithm):
@@ -65,9 +84,26 @@ class PeakExtractorAlgorithm(QgsProcessingAlgorithm):
     INPUT = "INPUT"
     ANALYSIS_WINDOW_SIZE = "ANALYSIS_WINDOW_SIZE"
     PEAK_SPACING = "PEAK_SPACING"
+    ENGINE = "ENGINE"
+    RASTER_CLUSTERING = "RASTER_CLUSTERING"
+    TILE_SIZE = "TILE_SIZE"
+    NUM_WORKERS = "NUM_WORKERS"
+    PROMINENCE = "PROMINENCE"
+    MIN_PROMINENCE = "MIN_PROMINENCE"
+    MAX_PEAKS = "MAX_PEAKS"
+    STAGE_CACHE_DIR = "STAGE_CACHE_DIR"
+    STAGE_CACHE_SIZE = "STAGE_CACHE_SIZE"
+    SWEEP_WINDOW_SIZES = "SWEEP_WINDOW_SIZES"
+    SWEEP_SPACINGS = "SWEEP_SPACINGS"
+    SWEEP_OUTPUT = "SWEEP_OUTPUT"
+    PROFILE_TRACE = "PROFILE_TRACE"
 
     OUTPUT = "OUTPUT"
 
+    ENGINE_GRASS = 0
+    ENGINE_LOCAL_MAXIMA = 1
+    ENGINE_FEATURES = 2
+
     def initAlgorithm(self, config):
         """
         Here we define the inputs and output of the algorithm, along
@@ -100,6 +136,131 @@ class PeakExtractorAlgorithm(QgsProcessingAlgorithm):
             )
         )
 
+        self.addParameter(
+            QgsProcessingParameterEnum(
+                self.ENGINE,
+                self.tr("Peak extraction engine"),
+                [
+                    "GRASS r.param.scale (vectorizes every pixel)",
+                    "Built-in (raster local maxima)",
+                    "Built-in morphometric features (same peaks as r.param.scale, any window size)"
+                ],
+                defaultValue=self.ENGINE_GRASS
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterBoolean(
+                self.RASTER_CLUSTERING,
+                self.tr("Group peak pixels on the raster instead of buffering and dissolving polygons (faster; the peaks are then the centroids of their pixels, not of the dissolved buffers)"),
+                defaultValue=False
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterNumber(
+                self.TILE_SIZE,
+                self.tr("Process the DEM in tiles of this many pixels per side with the built-in engines, for very large DEMs (0 = whole DEM at once)"),
+                QgsProcessingParameterNumber.Integer,
+                defaultValue=0,
+                minValue=0
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterNumber(
+                self.NUM_WORKERS,
+                self.tr("Number of worker processes for the tiles (0 = one per core)"),
+                QgsProcessingParameterNumber.Integer,
+                defaultValue=1,
+                minValue=0
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterBoolean(
+                self.PROMINENCE,
+                self.tr("Compute the prominence and isolation of each peak (needs the whole DEM in memory, so not done in tiles)"),
+                defaultValue=False
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterNumber(
+                self.MIN_PROMINENCE,
+                self.tr("Minimum peak prominence, meters (if the prominence is computed)"),
+                QgsProcessingParameterNumber.Double,
+                defaultValue=0.0,
+                minValue=0.0
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterNumber(
+                self.MAX_PEAKS,
+                self.tr("Only keep this many of the most prominent peaks, if the prominence is computed (0 = all)"),
+                QgsProcessingParameterNumber.Integer,
+                defaultValue=0,
+                minValue=0
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterFile(
+                self.STAGE_CACHE_DIR,
+                self.tr("Cache folder of the intermediate stages (peak pixels, prominences; reused across runs)"),
+                behavior=QgsProcessingParameterFile.Folder,
+                optional=True
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterNumber(
+                self.STAGE_CACHE_SIZE,
+                self.tr("Stage cache size limit, MB"),
+                QgsProcessingParameterNumber.Integer,
+                defaultValue=2048,
+                minValue=0
+            )
+        )
+
+        # Parameter sweep (one layer per combination of window size and spacing, sharing the stages they have in common)
+        self.addParameter(
+            QgsProcessingParameterString(
+                self.SWEEP_WINDOW_SIZES,
+                self.tr("Sweep: sizes of analysis window, meters (comma separated)"),
+                optional=True
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterString(
+                self.SWEEP_SPACINGS,
+                self.tr("Sweep: minimum distances between distinct peaks, meters (comma separated)"),
+                optional=True
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterFolderDestination(
+                self.SWEEP_OUTPUT,
+                self.tr("Sweep Output Folder"),
+                optional=True,
+                createByDefault=False
+            )
+        )
+
+        # Profiling trace (time and memory of every stage, and of every call to it)
+        self.addParameter(
+            QgsProcessingParameterFileDestination(
+                self.PROFILE_TRACE,
+                self.tr("Profiling Trace Output"),
+                fileFilter="JSON files (*.json)",
+                optional=True,
+                createByDefault=False
+            )
+        )
+
         self.addParameter(
             QgsProcessingParameterFeatureSink(
                 self.OUTPUT,
@@ -112,66 +273,141 @@ class PeakExtractorAlgorithm(QgsProcessingAlgorithm):
         """
         Here is where the processing itself takes place.
         """
+        profiler = instrumentation.Profiler()
+        stages = self.peak_stages(parameters, context, profiler)
+        results = self.extract_peaks(parameters, context, feedback, profiler, stages)
+
+        sweep_dir = self.parameterAsFileOutput(parameters, self.SWEEP_OUTPUT, context)
+        if sweep_dir and results:
+            self.sweep_peaks(parameters, context, feedback, profiler, stages, sweep_dir)
+            results[self.SWEEP_OUTPUT] = sweep_dir
+        stages.evict()
+
+        trace_path = self.parameterAsFileOutput(parameters, self.PROFILE_TRACE, context)
+        instrumentation.report(profiler, feedback.pushInfo, trace_path)
+        if trace_path:
+            results[self.PROFILE_TRACE] = trace_path
+        return results
+
+    def run_child(self, profiler, algorithm_id, parameters, context, feedback):
+        """run a child processing algorithm, timed as a stage of its own"""
+        with profiler.stage(algorithm_id):
+            return processing.run(algorithm_id, parameters, context=context, feedback=feedback, is_child_algorithm=True)
+
+    def peak_stages(self, parameters, context, profiler):
+        """the peak extraction stages of the DEM, cached in the stage cache folder selected by the user (if any)"""
+        dem = self.parameterAsRasterLayer(parameters, self.INPUT, context)
+        cache_dir = self.parameterAsFile(parameters, self.STAGE_CACHE_DIR, context)
+        cache = None
+        if cache_dir:
+            cache = peak_stages.StageCache(cache_dir, self.parameterAsInt(parameters, self.STAGE_CACHE_SIZE, context) * 2**20)
+        return peak_stages.PeakStages(dem.source(), cache=cache, profiler=profiler)
+
+    def classifier(self, parameters, context, feedback, profiler, engine):
+        """
+        the engine classifying the peak pixels, as keyword arguments of `PeakStages.peak_pixels`: the built-in
+        morphometric features, or GRASS r.param.scale (only run if its classes are not cached)
+        """
+        if engine != self.ENGINE_GRASS:
+            return {"engine": "features", "classify": None}
+
+        def classify(window_size_pixels):
+            morpho_param_layer_name = self.run_child(
+                profiler, "grass7:r.param.scale",
+                {
+                    "input": parameters[self.INPUT],
+                    "size": window_size_pixels,
+                    'method' : 9,       # 'feature'
+                    "output": QgsProcessing.TEMPORARY_OUTPUT,
+                    # --- defaults ---
+                    '-c' : False,
+                    'GRASS_RASTER_FORMAT_META': '',
+                    'GRASS_RASTER_FORMAT_OPT': '',
+                    'GRASS_REGION_CELLSIZE_PARAMETER': 0,
+                    'GRASS_REGION_PARAMETER': None,
+                    'curvature_tolerance' : 0.0001,
+                    'exponent' : 0,
+                    'slope_tolerance': 1,
+                    'zscale': 1
+                },
+                context, feedback
+            )["output"]
+            with profiler.stage("read_features"):
+                features, _ = viewshed_analysis.read_dem(morpho_param_layer_name)
+            return features
+
+        return {"engine": "r.param.scale", "classify": classify}
+
+    def extract_peaks(self, parameters, context, feedback, profiler, stages):
+        """extract the peaks, recording the time and memory of each stage with the given profiler"""
 
         dem = self.parameterAsRasterLayer(parameters, self.INPUT, context)
         x_size, y_size = dem.rasterUnitsPerPixelX(), dem.rasterUnitsPerPixelY()
 
         window_size_meters = self.parameterAsDouble(parameters, self.ANALYSIS_WINDOW_SIZE, context)
-        window_size_pixels = round_up_to_odd(window_size_meters / x_size)       # grass requires a "center" pixel
+        window_size_pixels = peak_extraction.window_size_in_pixels(window_size_meters, x_size, y_size)     # grass requires a "center" pixel
 
         feedback.pushInfo(f"Using analysis window of size {window_size_pixels}px")
 
-        if window_size_pixels <= 1:
-            raise ValueError(f"Analysis window must be >1px per side (given DEM has pixel size {x_size}m x {y_size}m)")
-        
+        engine = self.parameterAsEnum(parameters, self.ENGINE, context)
+        tile_size = self.parameterAsInt(parameters, self.TILE_SIZE, context)
+        if tile_size > 0:
+            if engine != self.ENGINE_GRASS:
+                return self.extract_peaks_tiled(parameters, context, feedback, profiler, stages, dem, window_size_pixels, engine, tile_size)
+            feedback.pushInfo("WARNING: the GRASS engine processes the whole DEM at once, ignoring the tile size.")
+        if engine == self.ENGINE_LOCAL_MAXIMA:
+            return self.extract_peaks_builtin(parameters, context, feedback, stages, dem, window_size_pixels)
+
         dem_size = dem.width() * dem.height()
-        if window_size_pixels >= 50 and dem_size >= 10**6:
+        if engine == self.ENGINE_GRASS and window_size_pixels >= 50 and dem_size >= 10**6:
             feedback.pushInfo("WARNING: large raster + large analysis window can be extremely slow. Consider downsampling the DEM first.")
 
 
         feedback.pushInfo("Classifying terrain. . .")
-        morpho_param_layer_name = processing.run(
-            "grass7:r.param.scale",
-            {
-                "input": parameters[self.INPUT],
-                "size": window_size_pixels,
-                'method' : 9,       # 'feature'
-                "output": QgsProcessing.TEMPORARY_OUTPUT,
-                # --- defaults ---
-                '-c' : False,
-                'GRASS_RASTER_FORMAT_META': '',
-                'GRASS_RASTER_FORMAT_OPT': '',
-                'GRASS_REGION_CELLSIZE_PARAMETER': 0,
-                'GRASS_REGION_PARAMETER': None,
-                'curvature_tolerance' : 0.0001,
-                'exponent' : 0,
-                'slope_tolerance': 1,
-                'zscale': 1
-            },
-            context=context, feedback=feedback, is_child_algorithm=True
-        )["output"]
+        classifier = self.classifier(parameters, context, feedback, profiler, engine)
+        rows, cols = stages.peak_pixels(window_size_pixels, **classifier)
 
         if feedback.isCanceled(): return {}
 
 
+        peak_spacing = self.parameterAsDouble(parameters, self.PEAK_SPACING, context)
+        if self.parameterAsBoolean(parameters, self.RASTER_CLUSTERING, context):
+            feedback.pushInfo("Clustering peaks. . .")
+            points = stages.feature_peaks(window_size_pixels, peak_spacing, **classifier)
+            return self.write_peaks(parameters, context, feedback, stages, dem, points)
+
+        points = self.vectorized_peaks(context, feedback, profiler, dem, rows, cols, peak_spacing)
+        if points is None: return {}
+
+        return self.write_peaks(parameters, context, feedback, stages, dem, points)
+
+    def vectorized_peaks(self, context, feedback, profiler, dem, rows, cols, peak_spacing):
+        """
+        group the given peak pixels into peaks by vectorizing them, buffering them by half the peak spacing and
+        dissolving the overlapping buffers; returns the (n, 2) map coordinates of the peak centers, or None if canceled
+        """
+        with profiler.stage("write_peak_pixels"):
+            peak_pixels_layer_name = self.write_peak_pixels(dem, rows, cols)
+
+
         feedback.pushInfo("Vectorizing. . .")
-        polygons_layer_name = processing.run(
-            "native:pixelstopolygons",
+        polygons_layer_name = self.run_child(
+            profiler, "native:pixelstopolygons",
             {
-                "INPUT_RASTER": morpho_param_layer_name,
+                "INPUT_RASTER": peak_pixels_layer_name,
                 "FIELD_NAME" : "VALUE",
                 "RASTER_BAND": 1,
                 "OUTPUT": QgsProcessing.TEMPORARY_OUTPUT
             },
-            context=context, feedback=feedback, is_child_algorithm=True
+            context, feedback
         )["OUTPUT"]
 
-        if feedback.isCanceled(): return {}
+        if feedback.isCanceled(): return None
 
 
         feedback.pushInfo("Extracting peak pixels. . .")
-        filtered_polygons_layer_name = processing.run(
-            "native:extractbyattribute",
+        filtered_polygons_layer_name = self.run_child(
+            profiler, "native:extractbyattribute",
             {
                 "INPUT": polygons_layer_name,
                 "FIELD": "VALUE",
@@ -179,77 +415,195 @@ class PeakExtractorAlgorithm(QgsProcessingAlgorithm):
                 "VALUE": 6,         # peaks
                 "OUTPUT": QgsProcessing.TEMPORARY_OUTPUT
             },
-            context=context, feedback=feedback, is_child_algorithm=True
+            context, feedback
         )["OUTPUT"]
 
-        if feedback.isCanceled(): return {}
+        if feedback.isCanceled(): return None
 
 
-        buffer_distance = self.parameterAsDouble(parameters, self.PEAK_SPACING, context) / 2.0
+        buffer_distance = peak_spacing / 2.0
         feedback.pushInfo("Buffering peaks. . .")
-        buffered_polygons_layer_name = processing.run(
-            "native:buffer",
+        buffered_polygons_layer_name = self.run_child(
+            profiler, "native:buffer",
             {
                 "INPUT": filtered_polygons_layer_name,
                 "DISTANCE": buffer_distance,
                 "DISSOLVE": True,
                 "OUTPUT": QgsProcessing.TEMPORARY_OUTPUT
             },
-            context=context, feedback=feedback, is_child_algorithm=True
+            context, feedback
         )["OUTPUT"]
 
 
         feedback.pushInfo("Dissolving peaks. . .")
-        dissolved_polygons_layer_name = processing.run(
-            "native:dissolve",
+        dissolved_polygons_layer_name = self.run_child(
+            profiler, "native:dissolve",
             {
                 "INPUT": buffered_polygons_layer_name,
                 "OUTPUT": QgsProcessing.TEMPORARY_OUTPUT
             },
-            context=context, feedback=feedback, is_child_algorithm=True
+            context, feedback
         )["OUTPUT"]
 
-        if feedback.isCanceled(): return {}
+        if feedback.isCanceled(): return None
 
 
         feedback.pushInfo("Computing peak centers. . .")
-        centroids_layer_name = processing.run(
-            "native:centroids",
+        centroids_layer_name = self.run_child(
+            profiler, "native:centroids",
             {
                 "INPUT": dissolved_polygons_layer_name,
                 "ALL_PARTS": True,
                 "OUTPUT": QgsProcessing.TEMPORARY_OUTPUT
             },
-            context=context, feedback=feedback, is_child_algorithm=True
+            context, feedback
         )["OUTPUT"]
         centroids_layer = context.takeResultLayer(centroids_layer_name)
 
+        if feedback.isCanceled(): return None
+
+
+        return np.array([
+            [point.x(), point.y()] for point in (p.geometry().asPoint() for p in centroids_layer.getFeatures())
+        ]).reshape(-1, 2)
+
+    def write_peak_pixels(self, dem, rows, cols):
+        """
+        write a raster of only the given peak pixels (value 6, everything else nodata), so that just those are
+        vectorized; returns the raster's path
+        """
+        peaks = np.zeros((dem.height(), dem.width()), dtype=np.uint8)
+        peaks[rows, cols] = peak_extraction.PEAK
+
+        filename = QgsProcessingUtils.generateTempFilename("peak_features.tif")
+        quality_analysis.write_raster(filename, peaks[np.newaxis], dem.source(), dtype=gdal.GDT_Byte, nodata=0)
+        return filename
+
+    def extract_peaks_builtin(self, parameters, context, feedback, stages, dem, window_size_pixels):
+        """find peaks directly on the DEM array, and write them straight to the output sink (no per-pixel polygons)"""
+        feedback.pushInfo("Finding peaks. . .")
+        peak_spacing = self.parameterAsDouble(parameters, self.PEAK_SPACING, context)
+        points, _ = stages.local_maxima_peaks(window_size_pixels, peak_spacing)
+
         if feedback.isCanceled(): return {}
 
+        return self.write_peaks(parameters, context, feedback, stages, dem, points)
+
+    def extract_peaks_tiled(self, parameters, context, feedback, profiler, stages, dem, window_size_pixels, engine, tile_size):
+        """
+        find peaks tile by tile with worker processes (see `tiled_peaks`; peak pixels are grouped on the raster), and
+        write them straight to the output sink
+        """
+        def report_progress(fraction):
+            # the worker processes are stopped before this is passed on
+            if feedback.isCanceled():
+                raise QgsProcessingException(self.tr("Canceled"))
+            feedback.setProgress(int(100 * fraction))
+
+        feedback.pushInfo(f"Finding peaks in tiles of {tile_size}px. . .")
+        peak_spacing = self.parameterAsDouble(parameters, self.PEAK_SPACING, context)
+        options = dict(
+            tile_size=tile_size, num_workers=self.parameterAsInt(parameters, self.NUM_WORKERS, context),
+            progress_callback=report_progress
+        )
+        with profiler.stage("extract_peaks"):
+            if engine == self.ENGINE_LOCAL_MAXIMA:
+                points, _ = tiled_peaks.tiled_extract_peaks(dem.source(), window_size_pixels, peak_spacing, **options)
+            else:
+                points = tiled_peaks.tiled_feature_peaks(dem.source(), window_size_pixels, peak_spacing, **options)
+
+        return self.write_peaks(parameters, context, feedback, stages, dem, points, tiled=True)
+
+    def prominent_peaks(self, parameters, context, feedback, stages, points, tiled=False):
+        """
+        the given (n, 2) peak map coordinates and their attributes: with their prominence and isolation if asked for
+        (only keeping the most prominent), or none; never for peaks found in tiles, as it would read the whole DEM
+        """
+        if not self.parameterAsBoolean(parameters, self.PROMINENCE, context):
+            return points, {}
+        if tiled:
+            feedback.pushInfo("WARNING: the prominence needs the whole DEM in memory, so it is not computed for peaks found in tiles.")
+            return points, {}
+
+        feedback.pushInfo("Computing peak prominences. . .")
+        peak_prominence, peak_isolation = stages.peak_prominence(points)
+        keep = prominence.select_prominent(
+            peak_prominence,
+            self.parameterAsInt(parameters, self.MAX_PEAKS, context),
+            self.parameterAsDouble(parameters, self.MIN_PROMINENCE, context)
+        )
+        if len(keep) < len(points):
+            feedback.pushInfo(f"Keeping the {len(keep)} most prominent of {len(points)} peaks")
+        return points[keep], {"prominence": peak_prominence[keep], "isolation": peak_isolation[keep]}
+
+    def write_peaks(self, parameters, context, feedback, stages, dem, points, tiled=False):
+        """write the given (n, 2) peak map coordinates straight to the output sink (see `prominent_peaks`)"""
+        points, attributes = self.prominent_peaks(parameters, context, feedback, stages, points, tiled)
+        fields = QgsFields()
+        for name in attributes:
+            fields.append(QgsField(name, QVariant.Double))
 
         (sink, dest_id) = self.parameterAsSink(
             parameters,
             self.OUTPUT,
             context,
-            QgsFields(),        # no fields
+            fields,
             QgsWkbTypes.Point,
             dem.crs()
         )
 
-        n = 0
-        for p in centroids_layer.getFeatures():
+        for i, (x, y) in enumerate(points):
             if feedback.isCanceled(): return {}
-            sink.addFeature(p)
-            n += 1
+            feature = QgsFeature(fields)
+            feature.setGeometry(QgsGeometry.fromPointXY(QgsPointXY(x, y)))
+            feature.setAttributes([float(values[i]) for values in attributes.values()])
+            sink.addFeature(feature)
 
-        feedback.pushInfo(f"Number of peaks detected: {n}")
+        feedback.pushInfo(f"Number of peaks detected: {len(points)}")
 
 
         return {
             self.OUTPUT: dest_id
         }
 
-    
+    def sweep_peaks(self, parameters, context, feedback, profiler, stages, sweep_dir):
+        """
+        write the peaks of every combination of the sweep window sizes and spacings (the main ones if not given) to
+        a GeoPackage each in the given folder, computing the stages they share once
+        """
+        dem = self.parameterAsRasterLayer(parameters, self.INPUT, context)
+        window_sizes = self.parameter_list(parameters, self.SWEEP_WINDOW_SIZES, self.ANALYSIS_WINDOW_SIZE, context)
+        spacings = self.parameter_list(parameters, self.SWEEP_SPACINGS, self.PEAK_SPACING, context)
+        engine = self.parameterAsEnum(parameters, self.ENGINE, context)
+        method = "local-maxima" if engine == self.ENGINE_LOCAL_MAXIMA else "features"
+        classifier = self.classifier(parameters, context, feedback, profiler, engine)
+        group_peaks = None
+        if method == "features" and not self.parameterAsBoolean(parameters, self.RASTER_CLUSTERING, context):
+            def group_peaks(rows, cols, spacing):
+                return self.vectorized_peaks(context, feedback, profiler, dem, rows, cols, spacing)
+
+        os.makedirs(sweep_dir, exist_ok=True)
+        combinations = peak_stages.sweep(stages, window_sizes, spacings, method=method, group_peaks=group_peaks, **classifier)
+        for n, (window_size, spacing, points) in enumerate(combinations):
+            if feedback.isCanceled(): return
+            feedback.pushInfo(f"Sweep: window size {window_size:g}, spacing {spacing:g}")
+            points, attributes = self.prominent_peaks(parameters, context, feedback, stages, points)
+            filename = peak_stages.sweep_filename(sweep_dir, window_size, spacing)
+            with profiler.stage("write_peaks"):
+                vector_io.write_vector(filename, ogr.wkbPoint, vector_io.point_wkbs(points), dem.crs().toWkt(), attributes)
+            feedback.pushInfo(f"Number of peaks detected: {len(points)}")
+            feedback.setProgress(int(100 * (n + 1) / (len(window_sizes) * len(spacings))))
+
+    def parameter_list(self, parameters, name, default_name, context):
+        """the comma separated numbers of a string parameter, or the single value of the default parameter if empty"""
+        text = self.parameterAsString(parameters, name, context)
+        if not text or not text.strip():
+            return [self.parameterAsDouble(parameters, default_name, context)]
+        try:
+            return [float(value) for value in text.replace(",", " ").split()]
+        except ValueError:
+            raise QgsProcessingException(self.tr("Expected comma separated numbers, got {}").format(repr(text)))
+
     def name(self):
         """
         Returns the algorithm name, used for identifying the algorithm. This
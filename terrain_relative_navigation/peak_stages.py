@@ -0,0 +1,192 @@
+"""
+The intermediate stages of the peak extraction, cached so that tuning the parameters doesn't redo the stages they
+don't affect: the peak pixels (or candidate peaks) only depend on the DEM and the analysis window, and the summit
+prominences only on the DEM, while grouping the pixels into peaks at a given spacing is cheap.
+
+Each stage's result is kept in memory for the rest of the run (so a parameter sweep computes every stage once), and,
+with a `StageCache`, on disk across runs, keyed by the hash of the DEM contents and the parameters of the stage.
+"""
+
+import hashlib
+import json
+import os
+
+import numpy as np
+
+from . import peak_extraction
+from . import prominence
+from .instrumentation import Profiler
+from .quality_analysis import read_raster_geometry
+from .viewshed_analysis import read_dem
+from .viewshed_cache import FileCache, file_hash
+
+
+class StageCache(FileCache):
+    """
+    Persistent, content-addressed store of the results of the peak extraction stages (named arrays, one file per
+    entry; see `FileCache` for the eviction, which leaves the entries of a viewshed cache in the same directory alone).
+    """
+
+    SUFFIX = ".stage"
+
+    def key(self, dem_hash, stage, params):
+        """cache key of the result of a stage with the given parameters, on the DEM with the given hash"""
+        return hashlib.sha256(json.dumps([dem_hash, stage, params], sort_keys=True).encode()).hexdigest()
+
+    def get(self, key):
+        """return the cached arrays (a dict) for the given key, or None on a miss"""
+        return self.read_entry(key)
+
+    def put(self, key, arrays):
+        """store the given named arrays (a dict) under the given key"""
+        self.write_entry(key, arrays)
+
+
+class PeakStages:
+    """
+    The stages of the peak extraction of one DEM file, each computed on first use (reading the DEM only if needed),
+    then kept in memory and, if given a `StageCache`, on disk.
+    """
+
+    def __init__(self, dem_path, cache=None, profiler=None, slope_tolerance=1.0, curvature_tolerance=0.0001):
+        self.dem_path = dem_path
+        self.cache = cache
+        self.profiler = profiler if profiler is not None else Profiler(events=False)
+        self.tolerances = {"slope_tolerance": slope_tolerance, "curvature_tolerance": curvature_tolerance}
+        self.geotransform, self.shape = read_raster_geometry(dem_path)
+        self._dem = None
+        self._dem_hash = None
+        self.results = {}
+
+    def dem(self):
+        """the DEM array (NaN for nodata), read on first use"""
+        if self._dem is None:
+            with self.profiler.stage("read_dem"):
+                self._dem, _ = read_dem(self.dem_path)
+        return self._dem
+
+    def dem_hash(self):
+        if self._dem_hash is None:
+            with self.profiler.stage("dem_hash"):
+                self._dem_hash = file_hash(self.dem_path)
+        return self._dem_hash
+
+    def stage(self, name, params, compute):
+        """
+        the named arrays of the given stage with the given (JSON) parameters: from memory, else from the cache, else
+        from `compute()` (timed as a stage of the profiler), which are then kept in both
+        """
+        memory_key = (name, json.dumps(params, sort_keys=True))
+        if memory_key in self.results:
+            return self.results[memory_key]
+
+        arrays = None
+        if self.cache is not None:
+            cache_key = self.cache.key(self.dem_hash(), name, params)
+            with self.profiler.stage("stage_cache"):
+                arrays = self.cache.get(cache_key)
+        if arrays is None:
+            with self.profiler.stage(name):
+                arrays = compute()
+            if self.cache is not None:
+                self.cache.put(cache_key, arrays)
+
+        self.results[memory_key] = arrays
+        return arrays
+
+    def evict(self):
+        """bring the cache (if any) back within its size limit, once done with the stages"""
+        if self.cache is not None:
+            with self.profiler.stage("stage_cache"):
+                self.cache.evict()
+
+    def peak_pixels(self, size, engine="features", classify=None):
+        """
+        (rows, cols) of the pixels classified as peaks with a (size, size) analysis window, in row-major order; they
+        are classified by `classify(size)` (e.g. another engine, named by `engine`) if given, or else by
+        `peak_extraction.classify_features`
+        """
+        def compute():
+            if classify is not None:
+                features = classify(size)
+            else:
+                features = peak_extraction.classify_features(
+                    self.dem(), size, self.geotransform[1], -self.geotransform[5], **self.tolerances
+                )
+            rows, cols = np.nonzero(features == peak_extraction.PEAK)
+            return {"rows": rows, "cols": cols}
+
+        arrays = self.stage("peak_pixels", dict(self.tolerances, size=size, engine=engine), compute)
+        return arrays["rows"], arrays["cols"]
+
+    def peak_candidates(self, size):
+        """
+        (rows, cols, elevations) of the candidate peaks with a (size, size) analysis window, in row-major order (see
+        `peak_extraction.peak_candidates`)
+        """
+        def compute():
+            dem = self.dem()
+            rows, cols = peak_extraction.peak_candidates(
+                dem, size, self.geotransform[1], -self.geotransform[5], **self.tolerances
+            )
+            return {"rows": rows, "cols": cols, "elevations": dem[rows, cols]}
+
+        arrays = self.stage("peak_candidates", dict(self.tolerances, size=size), compute)
+        return arrays["rows"], arrays["cols"], arrays["elevations"]
+
+    def summits(self):
+        """the summit of every pixel, and the summits and their prominences (see `prominence.summit_prominence`)"""
+        def compute():
+            summit, summits, summit_prominences = prominence.summit_prominence(self.dem())
+            return {"summit": summit, "summits": summits, "prominence": summit_prominences}
+
+        arrays = self.stage("summits", {}, compute)
+        return arrays["summit"], arrays["summits"], arrays["prominence"]
+
+    def feature_peaks(self, size, spacing, engine="features", classify=None):
+        """the (n, 2) map coordinates of the peaks (see `peak_extraction.feature_peaks`), from the cached peak pixels"""
+        rows, cols = self.peak_pixels(size, engine, classify)
+        with self.profiler.stage("cluster_peaks"):
+            points, _ = peak_extraction.cluster_peak_pixels(rows, cols, self.shape, self.geotransform, spacing)
+        return points
+
+    def local_maxima_peaks(self, size, spacing):
+        """
+        the (n, 2) map coordinates of the peaks and their elevations (see `peak_extraction.extract_peaks`), from the
+        cached candidate peaks
+        """
+        rows, cols, elevations = self.peak_candidates(size)
+        with self.profiler.stage("thin_peaks"):
+            return peak_extraction.thin_peaks(rows, cols, elevations, self.geotransform, spacing)
+
+    def peak_prominence(self, points):
+        """the prominence and isolation of the given (n, 2) peak map coordinates (see `prominence.peak_prominence`)"""
+        summits = self.summits()
+        with self.profiler.stage("prominence"):
+            return prominence.peak_prominence(self.dem(), self.geotransform, points, summits=summits)
+
+
+def sweep(stages, window_sizes, spacings, method="features", engine="features", classify=None, group_peaks=None):
+    """
+    lazily yield (window size, spacing, peak map coordinates) for every combination of the given window sizes (map
+    units) and spacings, extracted with the given `PeakStages` by the morphometric features (classified by the given
+    engine, see `PeakStages.peak_pixels`) or "local-maxima" method; the stages of each window size are computed once,
+    and only the grouping of the peaks is redone for each spacing. The peak pixels of the features method are grouped
+    on the raster (see `PeakStages.feature_peaks`), or by `group_peaks(rows, cols, spacing) -> points` if given.
+    """
+    gt = stages.geotransform
+    for window_size in window_sizes:
+        size = peak_extraction.window_size_in_pixels(window_size, gt[1], -gt[5])
+        for spacing in spacings:
+            if method == "local-maxima":
+                points, _ = stages.local_maxima_peaks(size, spacing)
+            elif group_peaks is not None:
+                points = group_peaks(*stages.peak_pixels(size, engine, classify), spacing)
+            else:
+                points = stages.feature_peaks(size, spacing, engine, classify)
+            yield window_size, spacing, points
+
+
+def sweep_filename(output_dir, window_size, spacing, extension=".gpkg"):
+    """the file of the peaks of one combination of a sweep"""
+    return os.path.join(output_dir, f"peaks_w{window_size:g}_s{spacing:g}{extension}")
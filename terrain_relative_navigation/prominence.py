@@ -0,0 +1,237 @@
+"""
+Topographic prominence and isolation of peaks, computed in-process from the DEM, so that landmarks can be ranked (and
+the insignificant bumps dropped) before the viewshed analysis.
+
+The prominence of a summit is the height it rises above the highest col connecting it to higher terrain. It comes
+from one sweep over the DEM pixels from the highest down, where each pixel joins the regions of its already swept
+neighbors (union-find): when two regions meet at a pixel, the one with the lower summit ends there, and its
+prominence is the height of its summit above that pixel. The sweep is contracted first: a pixel always ends up in the
+region of its highest neighbor (if that is higher), so the regions of steepest ascent to each summit are labeled at
+once, and only the joins between those regions (the maximum spanning forest of their borders, found with Boruvka's
+algorithm) are swept one by one.
+"""
+
+import numpy as np
+
+from .peak_extraction import connected_labels
+
+
+# 8-connected neighbor offsets, and the half of them that visits each pair of neighbors once
+NEIGHBORS = [(-1, -1), (-1, 0), (-1, 1), (0, -1), (0, 1), (1, -1), (1, 0), (1, 1)]
+HALF_NEIGHBORS = [(0, 1), (1, -1), (1, 0), (1, 1)]
+
+
+def sweep_ranks(dem):
+    """
+    the flat indices of the valid (not NaN) pixels of a DEM array from the highest down (ties in row-major order),
+    and the (h, w) rank of each pixel in that order (the number of valid pixels for nodata)
+    """
+    z = dem.ravel()
+    valid = np.flatnonzero(~np.isnan(z))
+    order = valid[np.argsort(-z[valid], kind="stable")]
+    rank = np.full(z.shape, len(order), dtype=np.int64)
+    rank[order] = np.arange(len(order))
+    return order, rank.reshape(dem.shape)
+
+
+def ascent_summits(rank, order):
+    """
+    for every pixel, the flat index of the summit its steepest ascent leads to: each pixel follows its highest
+    8-connected neighbor while that is higher than itself (nodata pixels are their own summits)
+    """
+    h, w = rank.shape
+    padded = np.pad(rank, 1, constant_values=len(order))
+    highest = rank.copy()
+    for dr, dc in NEIGHBORS:
+        np.minimum(highest, padded[1 + dr:h + 1 + dr, 1 + dc:w + 1 + dc], out=highest)
+    highest = highest.ravel()
+
+    summit = np.arange(h * w)
+    ascends = highest < rank.ravel()
+    summit[ascends] = order[highest[ascends]]
+    while True:
+        jumped = summit[summit]
+        if np.array_equal(jumped, summit):
+            return summit
+        summit = jumped
+
+
+def border_edges(summit, rank, num_valid):
+    """
+    the (i, j, rank) of the lowest-ranked (i.e. highest) pair of neighbors on the border of each pair of adjacent
+    ascent regions i and j (flat indices of their summits): the sweep joins the two regions at the lower pixel of the
+    pair, i.e. at the larger rank of the two, sorted by that rank
+    """
+    h, w = rank.shape
+    summit = summit.reshape(h, w)
+    i, j, ranks = [], [], []
+    for dr, dc in HALF_NEIGHBORS:
+        a = (slice(0, h - dr), slice(max(-dc, 0), w - max(dc, 0)))
+        b = (slice(dr, h), slice(max(dc, 0), w + min(dc, 0)))
+        joined = np.maximum(rank[a], rank[b])
+        border = (summit[a] != summit[b]) & (joined < num_valid)
+        i.append(summit[a][border])
+        j.append(summit[b][border])
+        ranks.append(joined[border])
+    i, j, ranks = np.concatenate(i), np.concatenate(j), np.concatenate(ranks)
+
+    # the highest pair of each border
+    lo, hi = np.minimum(i, j), np.maximum(i, j)
+    order = np.lexsort((ranks, hi, lo))
+    lo, hi, ranks = lo[order], hi[order], ranks[order]
+    first = np.ones(len(lo), dtype=bool)
+    first[1:] = (lo[1:] != lo[:-1]) | (hi[1:] != hi[:-1])
+    lo, hi, ranks = lo[first], hi[first], ranks[first]
+
+    order = np.argsort(ranks, kind="stable")
+    return lo[order], hi[order], ranks[order]
+
+
+def spanning_forest(n, i, j):
+    """
+    indices (ascending) of the edges of the minimum spanning forest of the graph with nodes 0..n-1 and edges
+    (i[k], j[k]) weighted by k. Boruvka's algorithm, vectorized: every component picks its lightest outgoing edge,
+    and the components they join are merged, until no edge leaves a component.
+    """
+    labels = np.arange(n)
+    edges = np.arange(len(i))
+    forest = []
+    while True:
+        li, lj = labels[i[edges]], labels[j[edges]]
+        outgoing = li != lj
+        edges, li, lj = edges[outgoing], li[outgoing], lj[outgoing]
+        if len(edges) == 0:
+            break
+
+        # lightest edge of each component, from either end
+        components = np.concatenate([li, lj])
+        candidates = np.concatenate([edges, edges])
+        order = np.lexsort((candidates, components))
+        components, candidates = components[order], candidates[order]
+        first = np.ones(len(components), dtype=bool)
+        first[1:] = components[1:] != components[:-1]
+        picked = np.unique(candidates[first])
+
+        forest.append(picked)
+        labels = connected_labels(n, labels[i[picked]], labels[j[picked]])[labels]
+    return np.sort(np.concatenate(forest)) if forest else np.zeros(0, dtype=np.int64)
+
+
+def summit_prominence(dem):
+    """
+    the topographic prominence of every summit of a DEM array (NaN for nodata). Returns, for every pixel, the flat
+    index of its summit (that of its steepest ascent, -1 for nodata), and the flat indices of the summits and their
+    prominences. The highest summit of each region of valid pixels has no higher terrain to join: its prominence is
+    its height above the lowest pixel of the region.
+    """
+    z = dem.ravel()
+    order, rank = sweep_ranks(dem)
+    summit = ascent_summits(rank, order)
+    valid = rank.ravel() < len(order)
+    summits = np.flatnonzero(valid & (summit == np.arange(len(z))))
+
+    # regions are numbered like their summits, and joined from the highest cols down
+    i, j, cols = border_edges(summit, rank, len(order))
+    i, j = np.searchsorted(summits, i), np.searchsorted(summits, j)
+    forest = spanning_forest(len(summits), i, j)
+
+    summit_rank = rank.ravel()[summits]
+    prominence = np.full(len(summits), np.nan)
+    parent = np.arange(len(summits))
+
+    def find(k):
+        while parent[k] != k:
+            parent[k] = parent[parent[k]]
+            k = parent[k]
+        return k
+
+    for a, b, col in zip(i[forest].tolist(), j[forest].tolist(), cols[forest].tolist()):
+        a, b = find(a), find(b)        # each region's root is its highest summit
+        if summit_rank[a] > summit_rank[b]:
+            a, b = b, a
+        prominence[b] = z[summits[b]] - z[order[col]]
+        parent[b] = a
+
+    # highest summits of their regions
+    while True:
+        jumped = parent[parent]
+        if np.array_equal(jumped, parent):
+            break
+        parent = jumped
+    roots = np.flatnonzero(np.isnan(prominence))
+    lowest = np.full(len(summits), np.inf)
+    np.minimum.at(lowest, parent[np.searchsorted(summits, summit[valid])], z[valid])
+    prominence[roots] = z[summits[roots]] - lowest[roots]
+
+    summit[~valid] = -1
+    return summit, summits, prominence
+
+
+def isolation(dem, geotransform, rows, cols):
+    """
+    distance (map units, between pixel centers) from each of the given pixels of a DEM array to the nearest pixel
+    higher than it, searched in growing windows around it; the highest pixels get the diagonal of the DEM
+    """
+    h, w = dem.shape
+    pixelSizeX, pixelSizeY = abs(geotransform[1]), abs(geotransform[5])
+    diagonal = np.hypot(w * pixelSizeX, h * pixelSizeY)
+    distances = np.full(len(rows), diagonal)
+
+    for k, (r, c) in enumerate(zip(rows, cols)):
+        radius = 8
+        while True:
+            r0, r1 = max(r - radius, 0), min(r + radius + 1, h)
+            c0, c1 = max(c - radius, 0), min(c + radius + 1, w)
+            higher_rows, higher_cols = np.nonzero(dem[r0:r1, c0:c1] > dem[r, c])      # never NaN
+            if len(higher_rows) > 0:
+                nearest = np.hypot((higher_cols + c0 - c) * pixelSizeX, (higher_rows + r0 - r) * pixelSizeY).min()
+                # anything closer is in the window
+                if nearest <= radius * min(pixelSizeX, pixelSizeY):
+                    distances[k] = nearest
+                    break
+            if (r0, r1, c0, c1) == (0, h, 0, w):
+                if len(higher_rows) > 0:
+                    distances[k] = nearest
+                break
+            radius *= 2
+    return distances
+
+
+def peak_prominence(dem, geotransform, points, summits=None):
+    """
+    the prominence and isolation (map units) of the given (n, 2) peak map coordinates on a DEM array: those of the
+    summit each peak's pixel ascends to (see `summit_prominence`, whose result can be given if already computed); NaN
+    for peaks off the DEM or on nodata
+    """
+    h, w = dem.shape
+    prominence = np.full(len(points), np.nan)
+    distances = np.full(len(points), np.nan)
+    if len(points) == 0:
+        return prominence, distances
+
+    inverse = np.linalg.inv([[geotransform[1], geotransform[2]], [geotransform[4], geotransform[5]]])
+    cols, rows = np.floor(inverse @ (points - [geotransform[0], geotransform[3]]).T).astype(np.int64)
+    on_dem = (rows >= 0) & (rows < h) & (cols >= 0) & (cols < w)
+
+    summit, summits, summit_prominences = summit_prominence(dem) if summits is None else summits
+    peak_summits = np.full(len(points), -1)
+    peak_summits[on_dem] = summit[rows[on_dem] * w + cols[on_dem]]
+    found = peak_summits >= 0
+
+    prominence[found] = summit_prominences[np.searchsorted(summits, peak_summits[found])]
+    summit_rows, summit_cols = np.divmod(peak_summits[found], w)
+    distances[found] = isolation(dem, geotransform, summit_rows, summit_cols)
+    return prominence, distances
+
+
+def select_prominent(prominence, max_peaks=0, min_prominence=0.0):
+    """
+    indices (in their original order) of the peaks at least `min_prominence` prominent (if positive; peaks of unknown
+    prominence are then dropped), and of those, of the `max_peaks` most prominent (0 = all)
+    """
+    keep = np.arange(len(prominence))
+    if min_prominence > 0:
+        keep = np.flatnonzero(prominence >= min_prominence)
+    if 0 < max_peaks < len(keep):
+        keep = np.sort(keep[np.argsort(-prominence[keep], kind="stable")[:max_peaks]])
+    return keep
@@ -1,140 +1,479 @@
+import functools
+import logging
+import os
+
 import numpy as np
 from numpy.lib import math
 
 from osgeo import gdal
 from affine import Affine
 
-from qgis.core import QgsVectorLayer, QgsRasterLayer
+
+# per-landmark debug messages; only built when enabled (see `instrumentation.debug_messages`)
+logger = logging.getLogger(__name__)
+
+# bands of `quality_bands`, in order (the first two are also the metrics of `compute_quality`)
+QUALITY_BANDS = ("GDOP", "Worst-Case", "Minor SD", "Orientation", "Visible Landmarks")
+GDOP, WORST_CASE, MINOR_SD, ORIENTATION, VISIBLE_COUNT = range(len(QUALITY_BANDS))
+
+# temporaries budget of `quality_bands`, and its approximate bytes of temporaries per pixel of a chunk
+QUALITY_CHUNK_BYTES = 32 * 2**20
+QUALITY_BYTES_PER_PIXEL = 96
+
+# this module (and everything built on it, see `cli.py`) must not need QGIS: rasters are given either as filenames,
+# read with GDAL, or as QgsRasterLayers, and QGIS is only imported when reading one of the latter
+
+
+@functools.lru_cache(maxsize=None)
+def qgis_dtypes():
+    """numpy dtypes of the QGIS raster data types that providers return blocks of"""
+    from qgis.core import Qgis
+    return {
+        Qgis.Byte: np.uint8,
+        Qgis.UInt16: np.uint16,
+        Qgis.Int16: np.int16,
+        Qgis.UInt32: np.uint32,
+        Qgis.Int32: np.int32,
+        Qgis.Float32: np.float32,
+        Qgis.Float64: np.float64,
+    }
+
+
+def is_filename(source):
+    """whether the given raster source is a filename, rather than a QgsRasterLayer"""
+    return isinstance(source, (str, os.PathLike))
+
+
+def is_provider_layer(source):
+    """whether the given raster source is a layer that GDAL cannot read directly"""
+    return not is_filename(source) and source.providerType() != "gdal"
+
+
+def raster_filename(source):
+    """the filename of the given raster source (a filename or a GDAL-backed QgsRasterLayer)"""
+    return source if is_filename(source) else source.source()
+
+
+def read_raster_geometry(source):
+    """return the geotransform and (h, w) shape of the given raster (a filename or a QgsRasterLayer)"""
+    if not is_filename(source):
+        extent = source.extent()
+        gt = (extent.xMinimum(), source.rasterUnitsPerPixelX(), 0.0, extent.yMaximum(), 0.0, -source.rasterUnitsPerPixelY())
+        return gt, (source.height(), source.width())
+    ds = gdal.OpenShared(source)
+    return ds.GetGeoTransform(), (ds.RasterYSize, ds.RasterXSize)
+
+
+def read_raster_projection(source):
+    """return the projection (WKT, empty if unknown) of the given raster (a filename or a QgsRasterLayer)"""
+    if not is_filename(source):
+        return source.crs().toWkt()
+    return gdal.OpenShared(source).GetProjection()
+
+
+def read_provider_raster(layer, window, band_list):
+    """read the (rows, cols) window of the given bands of a (non-GDAL) raster layer from its provider's block buffers"""
+    from qgis.core import QgsRectangle
+
+    rows, cols = window
+    h, w = rows.stop - rows.start, cols.stop - cols.start
+    gt, _ = read_raster_geometry(layer)
+    extent = QgsRectangle(
+        gt[0] + cols.start * gt[1], gt[3] + rows.stop * gt[5],
+        gt[0] + cols.stop * gt[1], gt[3] + rows.start * gt[5]
+    )
+
+    provider = layer.dataProvider()
+    bands = []
+    for band in band_list:
+        block = provider.block(band, extent, w, h)
+        array = np.frombuffer(bytes(block.data()), dtype=qgis_dtypes()[block.dataType()]).reshape(h, w)
+        bands.append(array)
+    return np.stack(bands)
+
+
+def raster_nodata(source, band=1):
+    """the nodata value of a band of the given raster (a filename or a QgsRasterLayer), or None"""
+    if is_provider_layer(source):
+        provider = source.dataProvider()
+        return provider.sourceNoDataValue(band) if provider.sourceHasNoDataValue(band) else None
+    return gdal.OpenShared(raster_filename(source)).GetRasterBand(band).GetNoDataValue()
 
 
+def read_raster(source, window=None, bands=1, nan_nodata=False):
+    """
+    read a raster (a filename, or a QgsRasterLayer) straight into a numpy array, without any per-pixel calls:
+    GDAL-backed rasters are read with GDAL, and other layers from their provider's block buffers.
+    `bands` is either a single (1-based) band number, giving an (h, w) array, or a list of them, giving a
+    (len(bands), h, w) array; if a (rows, cols) `window` is given, only that part of the raster is read (an empty
+    window gives an empty array). With `nan_nodata`, the result is float64 with NaN for nodata pixels.
+    """
+    band_list = [bands] if isinstance(bands, int) else list(bands)
+    if window is None:
+        _, (h, w) = read_raster_geometry(source)
+        window = (slice(0, h), slice(0, w))
+    rows, cols = window
+    h, w = rows.stop - rows.start, cols.stop - cols.start
+
+    if h <= 0 or w <= 0:
+        array = np.zeros((len(band_list), max(h, 0), max(w, 0)))
+    elif is_provider_layer(source):
+        array = read_provider_raster(source, window, band_list)
+    else:
+        ds = gdal.OpenShared(raster_filename(source))
+        array = ds.ReadAsArray(cols.start, rows.start, w, h, band_list=band_list).reshape(len(band_list), h, w)
+
+    if nan_nodata:
+        array = array.astype(np.float64)
+        for i, band in enumerate(band_list):
+            nodata = raster_nodata(source, band)
+            if nodata is not None:
+                array[i][array[i] == nodata] = np.nan
+    return array[0] if isinstance(bands, int) else array
+
+
+def read_viewshed(filename, window=None):
+    """read the given viewshed raster (or only the given (rows, cols) window of it) as a uint8 array"""
+    return read_raster(filename, window).astype(np.uint8)
+
+
+def create_raster(filename, template_raster_filename, bands, dtype=None, nodata=None, tiled=False, band_names=None):
+    """
+    create a new, empty GeoTIFF with the extent and projection of the template, to be written to (e.g. block by block);
+    the datatype defaults to that of the template, and the nodata value and band descriptions are only set if given.
+    Large outputs should be `tiled`, so that blocks can be written (and later read) efficiently.
+    """
+    template_ds = gdal.OpenShared(template_raster_filename)
+
+    driver = gdal.GetDriverByName("GTiff")
+    if dtype is None:
+        dtype = template_ds.GetRasterBand(1).DataType   # use same datatype as template
+    options = ["TILED=YES", "BIGTIFF=IF_SAFER"] if tiled else []
+    out_ds = driver.Create(filename, template_ds.RasterXSize, template_ds.RasterYSize, bands, dtype, options=options)
+
+    out_ds.SetGeoTransform(template_ds.GetGeoTransform())
+    out_ds.SetProjection(template_ds.GetProjection())
+    if nodata is not None:
+        for i in range(bands):
+            out_ds.GetRasterBand(i + 1).SetNoDataValue(nodata)
+    for i, name in enumerate(band_names or []):
+        out_ds.GetRasterBand(i + 1).SetDescription(name)
+    return out_ds
+
+
+def write_raster(filename, array, template_raster_filename, offset=(0, 0), dtype=None, nodata=None, band_names=None):
+    """
+    write the given (bands, h, w) array to a new GeoTIFF with the extent and projection of the template, at the given
+    (x, y) pixel offset; the datatype defaults to that of the template, and the nodata value and band descriptions are
+    only set if given
+    """
+    out_ds = create_raster(filename, template_raster_filename, array.shape[0], dtype=dtype, nodata=nodata, band_names=band_names)
+
+    if array.size == 0:
+        return      # nothing to write; the raster is left empty
+    for i in range(array.shape[0]):
+        out_ds.GetRasterBand(i + 1).WriteArray(array[i], offset[0], offset[1])
+
+
+def radius_in_pixels(radius, pixelSizeX, pixelSizeY):
+    """convert a radius in map units to a (rx, ry) radius in whole pixels along each axis"""
+    return math.ceil(radius / pixelSizeX), math.ceil(radius / pixelSizeY)
+
+
+def landmark_window(viewpoint, radius_px, shape):
+    """
+    return the (rows, cols) slices of the bounding box of the given (rx, ry) pixel radius around the viewpoint,
+    clipped to a raster of the given shape
+    """
+    h, w = shape
+    (px, py), (rx, ry) = viewpoint, radius_px
+    rows = slice(min(max(py - ry, 0), h), max(min(py + ry + 1, h), 0))
+    cols = slice(min(max(px - rx, 0), w), max(min(px + rx + 1, w), 0))
+    return rows, cols
 
-def convertRasterToNumpyArray(lyr): #Input: QgsRasterLayer
-    values=[]
-    provider= lyr.dataProvider()
-    block = provider.block(1,lyr.extent(),lyr.width(),lyr.height())
-    for i in range(lyr.width()):
-        for j in range(lyr.height()):
-            values.append(block.value(i,j))
-    return np.array(values)
 
+def viewpoint_pixel_locations(viewpoints_layer, geotransform):
+    """convert the point features of the given layer to (px, py) pixel indices under the given geotransform"""
+    points = (feature.geometry().asPoint() for feature in viewpoints_layer.getFeatures())
+    return pixel_locations([(point.x(), point.y()) for point in points], geotransform)
 
 
-def compute_fims(viewpoints_layer, viewshed_paths):
-    """given a list of viewpoints and viewsheds, compute a list of FIM arrays of the same shapes"""
-    reverse_transform = None
-    viewshed_arrays = []
-    for filename in viewshed_paths:
-        ds = gdal.Open(filename)
-        if reverse_transform is None:
-            gt = ds.GetGeoTransform()
-            reverse_transform = ~Affine.from_gdal(*gt)
-            pixelSizeX = gt[1]
-            pixelSizeY =-gt[5]
-        array = ds.GetRasterBand(1).ReadAsArray().astype(np.uint8)
-        viewshed_arrays.append(array)
-    
+def pixel_locations(points, geotransform):
+    """convert the given (x, y) map coordinates to (px, py) pixel indices under the given geotransform"""
+    reverse_transform = ~Affine.from_gdal(*geotransform)
     viewpoint_pixel_locs = []
-    for feature in viewpoints_layer.getFeatures():
-        point = feature.geometry().asPoint()
-        x, y = point.x(), point.y()
+    for x, y in points:
         px, py = reverse_transform * (x, y)
         px, py = int(px + 0.5), int(py + 0.5)
         viewpoint_pixel_locs.append((px, py))
+    return viewpoint_pixel_locs
+
 
+@functools.lru_cache(maxsize=8)
+def fim_kernel(pixelSizeX, pixelSizeY, rx, ry):
+    """
+    compute the (2*ry+1, 2*rx+1, 3) FIM of a landmark at the center pixel that is visible from everywhere;
+    it only depends on the pixel offset from the landmark, so it is built once and shared by all landmarks
+    """
+    # distance components, dx, dy, for each pixel offset
+    xmat = np.arange(-rx, rx + 1)[np.newaxis,:] * pixelSizeX
+    ymat = np.arange(-ry, ry + 1)[:,np.newaxis] * pixelSizeY
 
-    h, w = viewshed_arrays[0].shape
-    fims = [np.zeros((h, w, 3), dtype=np.float32) for _ in viewshed_arrays]
+    x2mat = np.multiply(xmat,xmat)
+    y2mat = np.multiply(ymat,ymat)
+    r2mat = x2mat+y2mat+.01
+    r4mat = np.multiply(r2mat,r2mat)
 
-    for i, (viewshed, viewpoint) in enumerate(zip(viewshed_arrays, viewpoint_pixel_locs)):
-        if np.isnan(viewshed).all():
-            # raise ValueError("EMPTY VIEWSHED")
-            continue
+    kernel = np.empty((2*ry + 1, 2*rx + 1, 3), dtype=np.float32)
+    kernel[:,:,0] = np.divide(y2mat,r4mat)                      # sin^2 / r^2
+    kernel[:,:,1] = -np.divide(np.multiply(xmat,ymat),r4mat)    # -sin*cos / r^2
+    kernel[:,:,2] = np.divide(x2mat,r4mat)                      # cos^2 / r^2
+    kernel.flags.writeable = False      # shared between all callers
+    return kernel
 
-        eastsize = viewshed.shape[1]
-        northsize = viewshed.shape[0]
 
-        # Find pixel distances from that peak
-        xarange = np.arange(eastsize) - viewpoint[0]
-        yarange = np.arange(northsize) - viewpoint[1]
+def landmark_fim(viewshed, viewpoint, window, kernel, out=None, subtract=False):
+    """
+    compute the FIM contributed by a single landmark over its (rows, cols) window, by masking the shared kernel
+    with the landmark's viewshed (of the same window); if `out` is given, the FIM is added into it (or subtracted from
+    it) in-place instead
+    """
+    (px, py), (rows, cols) = viewpoint, window
+    ry, rx = kernel.shape[0] // 2, kernel.shape[1] // 2
+    kernel_window = kernel[rows.start - py + ry : rows.stop - py + ry, cols.start - px + rx : cols.stop - px + rx]
 
-        # create matrices of distance components, dx, dy, for each pixel
-        xmat = np.reshape(xarange,(eastsize,1))
-        xmat = np.repeat(xmat,(northsize),axis=1).transpose()
-        xmat = np.multiply(xmat,pixelSizeX)
-        minval = np.min(xmat)
-        maxval = np.max(xmat)
-        print("X min:{}, X max:{}".format(minval,maxval))
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("Landmark @ (%d, %d): %d visible pixels", px, py, np.count_nonzero(viewshed))
 
-        ymat = np.reshape(yarange,(northsize,1))
-        ymat = np.repeat(ymat.transpose(),(eastsize),axis=0).transpose()
-        ymat = np.multiply(ymat,pixelSizeY)
-        minval = np.min(ymat)
-        maxval = np.max(ymat)
-        print("Y min:{}, Y max:{}".format(minval,maxval))
+    if out is None:
+        return kernel_window * viewshed[:,:,np.newaxis]
+    if subtract:
+        out -= kernel_window * viewshed[:,:,np.newaxis]
+    else:
+        out += kernel_window * viewshed[:,:,np.newaxis]
+    return out
 
-        x2mat = np.multiply(xmat,xmat)
-        y2mat = np.multiply(ymat,ymat)
-        r2mat = x2mat+y2mat+.01
-        r1mat = np.sqrt(r2mat)
-        minval = np.min(r1mat)
-        maxval = np.max(r1mat)
-        print("R min:{}, R max:{}".format(minval,maxval))
 
-        cosmat = np.divide(xmat,r1mat)
-        sinmat = np.divide(ymat,r1mat)
-        cos2mat = np.divide(x2mat,r2mat)
-        sin2mat = np.divide(y2mat,r2mat)
+def read_viewsheds(viewshed_paths, viewpoints, radius_px, shape):
+    """lazily read the (rx, ry) pixel radius window of each viewshed raster around its viewpoint, as (viewpoint, window, viewshed) tuples"""
+    for viewpoint, filename in zip(viewpoints, viewshed_paths):
+        window = landmark_window(viewpoint, radius_px, shape)
+        yield viewpoint, window, read_viewshed(filename, window)
 
-        fims[i][:,:,0] += viewshed * np.divide(sin2mat,r2mat)
-        fims[i][:,:,1] -= viewshed * np.divide( np.multiply(sinmat,cosmat) , r2mat)
-        fims[i][:,:,2] += viewshed * np.divide(cos2mat,r2mat)
 
-        x2mat=None
-        y2mat=None
-        r2mat=None
-        r1mat=None
-        cosmat=None
-        sinmat=None
-        cos2mat=None
-        sin2mat=None
+def covering_radius(viewpoints, shape):
+    """the smallest (rx, ry) pixel radius that covers every offset between any of the viewpoints and any pixel of the raster"""
+    h, w = shape
+    return (
+        max(max(abs(px), abs(w - 1 - px)) for px, _ in viewpoints),
+        max(max(abs(py), abs(h - 1 - py)) for _, py in viewpoints)
+    )
 
-    return fims
-    
 
-def compute_quality(fims, pointing, metric=0, nodata_value=1_000_000):
+def accumulate_viewshed_fims(viewsheds, shape, pixelSizeX, pixelSizeY, radius_px, fim_callback=None,
+                             fim_sum=None, visible_count=None, subtract=False, dtype=np.float32):
     """
-    given a list of viewpoints and viewsheds, compute the quality metrix array of the same shape;
-    0 = GDOP, 1 = Worst-Case
+    given an iterable of (viewpoint, window, viewshed) tuples, where each viewshed covers the (rows, cols) window of the
+    (rx, ry) pixel radius around its (px, py) viewpoint, compute the sum of all their FIMs as a single (h, w, 3) array;
+    viewsheds are consumed and added in one at a time, so peak memory does not depend on the number of landmarks.
+    If given, `fim_callback(i, fim, window)` is called with each individual landmark FIM (covering only its window of
+    the full raster) before it is discarded.
+
+    To update an existing running sum instead of starting from zero, pass it as `fim_sum` (and optionally the matching
+    per-pixel count of visible landmarks as `visible_count`); with `subtract`, the landmarks are removed from them.
     """
-    fim = np.sum(np.array(fims), axis=0)    # add up components
-    fim /= math.pow(pointing, 2)
+    kernel = fim_kernel(pixelSizeX, pixelSizeY, *radius_px)
 
-    # Compute largest eigenvalue of covariance matrix
-    determ = fim[:,:,0]*fim[:,:,2] - fim[:,:,1]*fim[:,:,1]
+    if fim_sum is None:
+        fim_sum = np.zeros(shape + (3,), dtype=dtype)
+    for i, (viewpoint, window, viewshed) in enumerate(viewsheds):
+        if fim_callback is None:
+            # add directly into the running sum; no per-landmark FIM array is kept
+            if viewshed.any():
+                landmark_fim(viewshed, viewpoint, window, kernel, out=fim_sum[window], subtract=subtract)
+        else:
+            if viewshed.any():
+                fim = landmark_fim(viewshed, viewpoint, window, kernel)
+                if subtract:
+                    fim_sum[window] -= fim
+                else:
+                    fim_sum[window] += fim
+            else:
+                fim = np.zeros(viewshed.shape + (3,), dtype=np.float32)      # nothing visible
+            fim_callback(i, fim, window)
 
-    determ[determ<1e-9]=1e-9    # determ is zero some places
+        if visible_count is not None:
+            if subtract:
+                visible_count[window] -= viewshed
+            else:
+                visible_count[window] += viewshed
 
-    covs = np.zeros(fim.shape)
-    covs[:,:,0] = np.divide(fim[:,:,2], determ)
-    covs[:,:,1] = -np.divide(fim[:,:,1], determ)
-    covs[:,:,2] = np.divide(fim[:,:,0], determ)
+    return fim_sum
 
-    tracecovs = covs[:,:,0] + covs[:,:,2]
-    detcovs = 1.0/determ
 
-    # https://en.wikipedia.org/wiki/Eigenvalue_algorithm#2.C3.972_matrices
-    max_eigen = (tracecovs + np.sqrt(np.square(tracecovs) - detcovs*4)) / 2
+def accumulate_fims(viewpoints_layer, viewshed_paths, radius=None, fim_callback=None):
+    """
+    given a list of viewpoints and viewshed rasters, compute the sum of all their FIMs as a single (h, w, 3) array
+    (see `accumulate_viewshed_fims`).
+    If a radius of analysis (map units) is given, each landmark only reads and computes over the bounding box of
+    that radius, since its viewshed is empty outside of it.
+    """
+    gt, shape = read_raster_geometry(viewshed_paths[0])
+    pixelSizeX = gt[1]
+    pixelSizeY =-gt[5]
+    viewpoint_pixel_locs = viewpoint_pixel_locations(viewpoints_layer, gt)
 
-    if metric == 0:
-        # GDOP
-        quality = np.sqrt(tracecovs)    # same as `np.sqrt(min_eigen + max_eigen)`
+    if radius is None:
+        radius_px = covering_radius(viewpoint_pixel_locs, shape)
     else:
-        # Worst-Case
-        quality = np.sqrt(max_eigen)
+        radius_px = radius_in_pixels(radius, pixelSizeX, pixelSizeY)
+
+    viewsheds = read_viewsheds(viewshed_paths, viewpoint_pixel_locs, radius_px, shape)
+    return accumulate_viewshed_fims(viewsheds, shape, pixelSizeX, pixelSizeY, radius_px, fim_callback=fim_callback)
+
+
+def sample_raster(source, rows, cols, bands):
+    """
+    the (len(bands), n) values of the given bands of a raster (a filename or a QgsRasterLayer) at the given pixel rows
+    and columns (all inside it); only the span of the pixels in each row is read, so that sampling a long path costs
+    about as much as its number of pixels, not the area around it
+    """
+    order = np.argsort(rows, kind="stable")
+    unique_rows, starts = np.unique(rows[order], return_index=True)
+    samples = np.zeros((len(bands), len(rows)))
+    for row, group in zip(unique_rows.tolist(), np.split(order, starts[1:])):
+        c0, c1 = int(cols[group].min()), int(cols[group].max()) + 1
+        span = read_raster(source, (slice(row, row + 1), slice(c0, c1)), bands=list(bands))
+        samples[:, group] = span[:, 0, cols[group] - c0]
+    return samples
+
+
+def iter_fim_samples(fim_paths, points):
+    """
+    given a list of FIM rasters (filenames or QgsRasterLayers) and an (n, 2) array of (x, y) map coordinates, lazily yield an (n, 3) array of each
+    FIM's bands sampled at every point (points outside a raster sample as 0); only the pixels under the points are
+    read from each raster (see `sample_raster`)
+    """
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+    for filename in fim_paths:
+        gt, (h, w) = read_raster_geometry(filename)
+        reverse_transform = ~Affine.from_gdal(*gt)
+        px, py = reverse_transform * (points[:,0], points[:,1])
+        px, py = np.floor(px).astype(np.int64), np.floor(py).astype(np.int64)
+        inside = (px >= 0) & (px < w) & (py >= 0) & (py < h)
+
+        samples = np.zeros((len(points), 3), dtype=np.float64)
+        if inside.any():
+            samples[inside] = sample_raster(filename, py[inside], px[inside], [1, 2, 3]).T
+        yield samples
+
+
+def fim_covariances(fims):
+    """
+    given an (n, 3) array of 2x2 FIMs (xx, xy, yy), invert them and eigen-decompose the resulting covariances in
+    closed form; returns the (n, 3) covariances, their (n,) major and minor eigenvalues, and a mask of the FIMs that
+    could not be inverted (all outputs are NaN there)
+    """
+    a, b, c = fims[:,0], fims[:,1], fims[:,2]
+    determ = a*c - b*b
+    singular = ~np.isfinite(determ) | (determ == 0)
+    determ = np.where(singular, np.nan, determ)
+
+    covs = np.stack([c, -b, a], axis=1) / determ[:,np.newaxis]
+
+    # https://en.wikipedia.org/wiki/Eigenvalue_algorithm#2.C3.972_matrices
+    half_trace = (covs[:,0] + covs[:,2]) / 2
+    spread = np.sqrt(np.maximum(np.square(half_trace) - 1.0/determ, 0))     # det(C) = 1/det(FIM)
+    return covs, half_trace + spread, half_trace - spread, singular
+
 
-    # set all points with FIM 0 to nodata (corresponds to no observations)
-    fim_zeros = np.logical_and(np.logical_and(fim[:,:,0] == 0, fim[:,:,1] == 0), fim[:,:,2] == 0)
-    quality[fim_zeros] = nodata_value
-    quality[np.isnan(quality)] = nodata_value
+def quality_chunks(shape, chunk_bytes=QUALITY_CHUNK_BYTES):
+    """row slices of the chunks of a raster of the given (h, w) shape whose quality temporaries fit in `chunk_bytes`"""
+    h, w = shape
+    chunk_rows = max(1, chunk_bytes // (QUALITY_BYTES_PER_PIXEL * max(w, 1)))
+    for r0 in range(0, h, chunk_rows):
+        yield slice(r0, min(r0 + chunk_rows, h))
 
-    return quality
+
+def major_axis_azimuth(a, b, c):
+    """
+    azimuth (degrees clockwise from north, in [0, 180)) of the major axis of the covariance ellipses of the given
+    2x2 FIMs (xx, xy, yy arrays), which are in pixel row order (y pointing south); the major covariance axis is the
+    minor FIM axis, whose angle from the east axis towards the south is half that of (c - a, -2b)
+    """
+    azimuth = np.degrees(np.arctan2(-2 * b, c - a)) / 2 + 90
+    azimuth[azimuth >= 180] -= 180
+    return azimuth
+
+
+def quality_bands(fim_sum, pointing, visible_count=None, bands=None, nodata_value=1_000_000,
+                  chunk_bytes=QUALITY_CHUNK_BYTES, out=None):
+    """
+    given the (h, w, 3) sum of all landmark FIMs (see `accumulate_fims`), compute the given quality metric bands (by
+    default all of `QUALITY_BANDS`; VISIBLE_COUNT needs the (h, w) `visible_count` of the FIM sum) in a single pass, as
+    a (len(bands), h, w) float32 array (or into `out`):
+
+     - GDOP and WORST_CASE (the SD along the major axis of the covariance ellipse) are nodata where no landmark is visible
+     - MINOR_SD is the SD along the minor axis, and ORIENTATION the azimuth of the major axis (degrees clockwise from
+       north, in [0, 180)), both also nodata where no landmark is visible
+     - VISIBLE_COUNT is the number of landmarks visible from each pixel
+
+    The FIM sum is processed a few rows at a time, in float32, so that temporaries never take more than about
+    `chunk_bytes` whatever the size of the raster.
+    """
+    bands = tuple(range(len(QUALITY_BANDS))) if bands is None else tuple(bands)
+    if VISIBLE_COUNT in bands and visible_count is None:
+        raise ValueError("The visible landmark count band needs the visible landmark count of the FIM sum")
+    h, w = fim_sum.shape[:2]
+    if out is None:
+        out = np.empty((len(bands), h, w), dtype=np.float32)
+    scale = np.float32(1.0 / math.pow(pointing, 2))
+
+    for rows in quality_chunks((h, w), chunk_bytes):
+        chunk = fim_sum[rows]
+        # a*c - b*b cancels when the landmarks are (nearly) aligned, so only it is formed in double precision, from
+        # the FIM sum as given
+        determ = chunk[:,:,0].astype(np.float64) * chunk[:,:,2]
+        determ -= np.square(chunk[:,:,1], dtype=np.float64)
+        determ = (determ * (float(scale) ** 2)).astype(np.float32)
+
+        fim = chunk.astype(np.float32)      # a copy: the caller's running sum is never modified
+        fim *= scale
+        a, b, c = fim[:,:,0], fim[:,:,1], fim[:,:,2]
+        unobserved = ((a == 0) & (b == 0) & (c == 0)) | np.isnan(determ)
+        determ[determ < 1e-9] = 1e-9    # determ is zero some places
+
+        # https://en.wikipedia.org/wiki/Eigenvalue_algorithm#2.C3.972_matrices: the eigenvalues of the covariance are
+        # the inverses of those of the FIM, and the major FIM eigenvalue is computed without cancellation
+        trace = a + c
+        fim_major = trace / 2 + np.hypot((a - c) / 2, b)
+
+        for i, band in enumerate(bands):
+            with np.errstate(invalid="ignore", divide="ignore"):
+                if band == GDOP:
+                    values = np.sqrt(trace / determ)
+                elif band == WORST_CASE:
+                    values = np.sqrt(fim_major / determ)
+                elif band == MINOR_SD:
+                    values = np.sqrt(1 / fim_major)
+                elif band == ORIENTATION:
+                    values = major_axis_azimuth(a, b, c)
+                elif band == VISIBLE_COUNT:
+                    out[i, rows] = visible_count[rows]
+                    continue
+                else:
+                    raise ValueError(f"Unknown quality band: {band}")
+            values[unobserved | ~np.isfinite(values)] = nodata_value
+            out[i, rows] = values
+    return out
+
+
+def compute_quality(fim_sum, pointing, metric=0, nodata_value=1_000_000):
+    """
+    given the (h, w, 3) sum of all landmark FIMs (see `accumulate_fims`), compute the quality metrix array of the same shape;
+    0 = GDOP, 1 = Worst-Case (see `quality_bands`).
+    This takes the FIM sum, not a list of per-landmark (h, w, 3) FIMs as it used to: the FIMs are streamed into a single
+    sum instead of being kept for every landmark, so `compute_quality(compute_fims(...), ...)` is now
+    `compute_quality(accumulate_fims(...), ...)`.
+    """
+    return quality_bands(fim_sum, pointing, bands=(metric,), nodata_value=nodata_value)[0]
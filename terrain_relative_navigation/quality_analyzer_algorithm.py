@@ -24,16 +24,21 @@ from qgis.PyQt.QtCore import QCoreApplication
 from qgis.core import (QgsProcessing,
                        QgsFeatureSink,
                        QgsProcessingAlgorithm,
+                       QgsProcessingException,
                        QgsProcessingParameterRasterLayer,
                        QgsProcessingParameterFeatureSource,
+                       QgsProcessingParameterFile,
                        QgsProcessingParameterFolderDestination,
+                       QgsProcessingParameterFileDestination,
                        QgsProcessingParameterRasterDestination,
                        QgsProcessingParameterNumber,
                        QgsProcessingParameterEnum,
+                       QgsProcessingParameterBoolean,
                        QgsProcessingOutputRasterLayer,
                        QgsProcessingOutputNumber,
                        QgsProcessingOutputMultipleLayers,
                        QgsProcessingFeatureSourceDefinition,
+                       QgsProcessingUtils,
                        QgsProject,
                        QgsVectorLayer,
                        QgsRasterFileWriter,
@@ -41,7 +46,9 @@ from qgis.core import (QgsProcessing,
                        Qgis,
                        QgsRasterLayer,
                        QgsLayerTreeGroup,
-                       QgsRasterBlock)
+                       QgsRasterBlock,
+                       QgsCoordinateTransform,
+                       QgsGeometry)
 
 # from QgsProcessingFeatureSourceDefinition import FlagCreateIndividualOutputPerInputFeature
 
@@ -49,9 +56,14 @@ import processing
 from osgeo import gdal
 import osr
 import os
+import contextlib
 import numpy as np
 
+from . import instrumentation
+from . import masking
 from . import quality_analysis
+from . import quality_pipeline
+from .viewshed_cache import ViewshedCache
 
 
 
@@ -78,12 +90,28 @@ class QualityAnalyzerAlgorithm(QgsProcessingAlgorithm):
 
     LANDMARKS_LAYER = "INPUT_LANDMARKS"
     VIEWSHEDS_DIR = "OUTPUT_VIEWSHEDS"
+    VISIBILITY_STORE = "VISIBILITY_STORE"
+    FIM_SUM = "FIM_SUM"
+    QUALITY_BANDS = "QUALITY_BANDS"
+    AOI_LAYER = "AOI_LAYER"
+    TRAVERSABILITY_MASK = "TRAVERSABILITY_MASK"
+    MAX_SLOPE = "MAX_SLOPE"
     FIMS_DIR = "FIMS_DIR"
     RADIUS_OF_ANALYSIS = "RADIUS_OF_ANALYSIS"
     LANDMARK_HEIGHT = "LANDMARK_HEIGHT"
     ROBOT_HEIGHT = "ROBOT_HEIGHT"
     POINTING_ACCURACY = "POINTING_ACCURACY"
     QUALITY_METRIC = "QUALITY_METRIC"
+    VIEWSHED_ENGINE = "VIEWSHED_ENGINE"
+    NUM_WORKERS = "NUM_WORKERS"
+    BLOCK_SIZE = "BLOCK_SIZE"
+    VIEWSHED_CACHE_DIR = "VIEWSHED_CACHE_DIR"
+    VIEWSHED_CACHE_SIZE = "VIEWSHED_CACHE_SIZE"
+    LANDMARK_DEBUG = "LANDMARK_DEBUG"
+    PROFILE_TRACE = "PROFILE_TRACE"
+
+    ENGINE_BUILTIN = 0
+    ENGINE_VIEWSHED_PLUGIN = 1
 
     NUM_LANDMARKS = "NUM_LANDMARKS"
     INDIVIDUAL_VIEWSHEDS = "INDIVIDUAL_VIEWSHEDS"
@@ -111,6 +139,35 @@ class QualityAnalyzerAlgorithm(QgsProcessingAlgorithm):
             )
         )
 
+        # Analysis mask: the quality is only computed inside the AOI, on traversable pixels (nodata elsewhere)
+        self.addParameter(
+            QgsProcessingParameterFeatureSource(
+                self.AOI_LAYER,
+                self.tr("Area of interest (quality is only computed inside these polygons)"),
+                [QgsProcessing.TypeVectorPolygon],
+                optional=True
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterRasterLayer(
+                self.TRAVERSABILITY_MASK,
+                self.tr("Traversability mask, aligned with the DEM (quality is only computed on its nonzero pixels)"),
+                optional=True
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterNumber(
+                self.MAX_SLOPE,
+                self.tr("Maximum traversable slope, degrees (quality is only computed on pixels at most this steep)"),
+                QgsProcessingParameterNumber.Double,
+                optional=True,
+                minValue=0,
+                maxValue=90
+            )
+        )
+
         self.addParameter(
             QgsProcessingParameterNumber(
                 self.RADIUS_OF_ANALYSIS,
@@ -157,21 +214,121 @@ class QualityAnalyzerAlgorithm(QgsProcessingAlgorithm):
             )
         )
 
-        # Viewsheds Folder
+        self.addParameter(
+            QgsProcessingParameterEnum(
+                self.VIEWSHED_ENGINE,
+                self.tr("Viewshed engine"),
+                ["Built-in (NumPy radial sweep)", "Viewshed Analysis plugin"],
+                defaultValue=self.ENGINE_BUILTIN
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterNumber(
+                self.NUM_WORKERS,
+                self.tr("Number of worker processes for the built-in viewshed engine (0 = one per core)"),
+                QgsProcessingParameterNumber.Integer,
+                defaultValue=1,
+                minValue=0
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterNumber(
+                self.BLOCK_SIZE,
+                self.tr("Process the raster in blocks of this many pixels per side, for DEMs larger than memory (0 = whole raster at once)"),
+                QgsProcessingParameterNumber.Integer,
+                defaultValue=0,
+                minValue=0
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterFile(
+                self.VIEWSHED_CACHE_DIR,
+                self.tr("Viewshed cache folder (reused across runs)"),
+                behavior=QgsProcessingParameterFile.Folder,
+                optional=True
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterNumber(
+                self.VIEWSHED_CACHE_SIZE,
+                self.tr("Viewshed cache size limit, MB"),
+                QgsProcessingParameterNumber.Integer,
+                defaultValue=2048,
+                minValue=0
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterBoolean(
+                self.LANDMARK_DEBUG,
+                self.tr("Log per-landmark debug messages"),
+                defaultValue=False
+            )
+        )
+
+        # Profiling trace (time and memory of every stage, and of every call to it)
+        self.addParameter(
+            QgsProcessingParameterFileDestination(
+                self.PROFILE_TRACE,
+                self.tr("Profiling Trace Output"),
+                fileFilter="JSON files (*.json)",
+                optional=True,
+                createByDefault=False
+            )
+        )
+
+        # Visibility store (all viewsheds, bit-packed into a single file)
+        self.addParameter(
+            QgsProcessingParameterFileDestination(
+                self.VISIBILITY_STORE,
+                self.tr("Visibility Store Output"),
+                fileFilter="Visibility stores (*.trnvis)",
+                optional=True,
+                createByDefault=True
+            )
+        )
+
+        # Viewsheds Folder (optional side output of one raster per landmark for the built-in engine)
         self.addParameter(
             QgsProcessingParameterFolderDestination(
                 self.VIEWSHEDS_DIR,
                 self.tr("Viewsheds Output Folder"),
-                optional=False
+                optional=True,
+                createByDefault=False
             )
         )
 
-        # FIM's Folder
+        # FIM's Folder (optional side output, e.g. for the path animation; by default only the summed FIM is accumulated in memory)
         self.addParameter(
             QgsProcessingParameterFolderDestination(
                 self.FIMS_DIR,
                 self.tr("FIMs Output Folder"),
-                optional=False
+                optional=True,
+                createByDefault=False
+            )
+        )
+
+        # Running FIM sum (for incrementally adding/removing landmarks later)
+        self.addParameter(
+            QgsProcessingParameterRasterDestination(
+                self.FIM_SUM,
+                self.tr("Running FIM Sum Output"),
+                optional=True,
+                createByDefault=False
+            )
+        )
+
+        # All quality metrics, as the bands of a single raster (computed in the same pass as the quality layer)
+        self.addParameter(
+            QgsProcessingParameterRasterDestination(
+                self.QUALITY_BANDS,
+                self.tr("All Quality Metrics Output (GDOP, Worst-Case, Minor SD, Orientation, Visible Landmarks)"),
+                optional=True,
+                createByDefault=False
             )
         )
 
@@ -198,10 +355,10 @@ class QualityAnalyzerAlgorithm(QgsProcessingAlgorithm):
         )
     
     def viewshed_filename(self, i):
-        return f"viewshed_{i}.tif"
+        return quality_pipeline.viewshed_filename(i)
     
     def fim_filename(self, i):
-        return f"FIM_{i}.tif"
+        return quality_pipeline.fim_filename(i)
     
     def write_raster_layer_to_file(self, raster_layer, filename):
         file_writer = QgsRasterFileWriter(filename)
@@ -219,62 +376,79 @@ class QualityAnalyzerAlgorithm(QgsProcessingAlgorithm):
             provider.crs()
         )
 
-    def write_raster_data_to_layer(self, filename, array, template_raster_filename, bands=1):
+    def write_raster_data_to_layer(self, filename, array, template_raster_filename, bands=1, offset=(0, 0), dtype=None):
+        """write the given (bands, h, w) array to a new raster with the extent of the template, at the given (x, y) pixel offset"""
         if array.shape[0] != bands:
             raise ValueError("given array size does not match given number of bands")
-        
-        template_ds = gdal.OpenShared(template_raster_filename)
-        
-        driver = gdal.GetDriverByName("GTiff")
-        dtype = template_ds.GetRasterBand(1).DataType   # use same datatype as template
-        out_ds = driver.Create(filename, array.shape[2], array.shape[1], bands, dtype)
-
-        out_ds.SetGeoTransform(template_ds.GetGeoTransform())
-        out_ds.SetProjection(template_ds.GetProjection())
-
-        for i in range(bands):
-            out_ds.GetRasterBand(i + 1).WriteArray(array[i])
-
-    def processAlgorithm(self, parameters, context, feedback):
+        quality_analysis.write_raster(filename, array, template_raster_filename, offset=offset, dtype=dtype)
+
+    def viewshed_cache(self, parameters, context):
+        """the viewshed cache selected by the user, or None"""
+        cache_dir = self.parameterAsFile(parameters, self.VIEWSHED_CACHE_DIR, context)
+        if not cache_dir:
+            return None
+        max_bytes = self.parameterAsInt(parameters, self.VIEWSHED_CACHE_SIZE, context) * 2**20
+        return ViewshedCache(cache_dir, max_bytes)
+
+    def viewshed_cache_keys(self, parameters, context, cache, dem_path, viewpoint_pixel_locs, engine):
+        """cache keys of the viewsheds of the given landmark pixel locations"""
+        landmark_height = self.parameterAsDouble(parameters, self.LANDMARK_HEIGHT, context)
+        robot_height = self.parameterAsDouble(parameters, self.ROBOT_HEIGHT, context)
+        radius = self.parameterAsInt(parameters, self.RADIUS_OF_ANALYSIS, context)
+        return quality_pipeline.viewshed_cache_keys(cache, dem_path, viewpoint_pixel_locs, landmark_height, robot_height, radius, engine)
+
+    def run_plugin_viewsheds(self, parameters, context, feedback, profiler, viewsheds_dir, num_landmarks, cache=None):
         """
-        Here is where the processing itself takes place.
+        run the Viewshed Analysis plugin once per landmark, writing each viewshed to the given folder;
+        viewsheds found in the given cache skip the plugin and are written from there instead.
+        Returns the viewpoints layer and the list of viewshed raster paths
         """
-        landmarks_layer = self.parameterAsSource(parameters, self.LANDMARKS_LAYER, context)
-        num_landmarks = landmarks_layer.featureCount()
-
         # Generate viewpoints vector layer
-        viewpoints_layer_path = processing.run(
-            "visibility:create_viewpoints",
-            {
-                "OBSERVER_POINTS": parameters[self.LANDMARKS_LAYER],
-                "DEM": parameters[self.INPUT],
-                "RADIUS": parameters[self.RADIUS_OF_ANALYSIS],
-                "OBS_HEIGHT":  parameters[self.LANDMARK_HEIGHT],
-                "TARGET_HEIGHT": parameters[self.ROBOT_HEIGHT],
-                "OUTPUT": QgsProcessing.TEMPORARY_OUTPUT
-            },
-            is_child_algorithm=True,
-            context=context,
-            feedback=feedback
-        )["OUTPUT"]
+        with profiler.stage("visibility:create_viewpoints"):
+            viewpoints_layer_path = processing.run(
+                "visibility:create_viewpoints",
+                {
+                    "OBSERVER_POINTS": parameters[self.LANDMARKS_LAYER],
+                    "DEM": parameters[self.INPUT],
+                    "RADIUS": parameters[self.RADIUS_OF_ANALYSIS],
+                    "OBS_HEIGHT":  parameters[self.LANDMARK_HEIGHT],
+                    "TARGET_HEIGHT": parameters[self.ROBOT_HEIGHT],
+                    "OUTPUT": QgsProcessing.TEMPORARY_OUTPUT
+                },
+                is_child_algorithm=True,
+                context=context,
+                feedback=feedback
+            )["OUTPUT"]
 
         # print(viewpoints_layer_name)
         viewpoints_layer = context.takeResultLayer(viewpoints_layer_path)
 
-        # Run viewshed analysis
-        viewsheds_dir = self.parameterAsFileOutput(parameters, self.VIEWSHEDS_DIR, context)
-
-        if not os.path.isdir(viewsheds_dir):
-            os.mkdir(viewsheds_dir)        
+        if cache is not None:
+            dem_path = self.parameterAsRasterLayer(parameters, self.INPUT, context).source()
+            gt, shape = quality_analysis.read_raster_geometry(dem_path)
+            viewpoint_pixel_locs = quality_analysis.viewpoint_pixel_locations(viewpoints_layer, gt)
+            radius_px = quality_analysis.radius_in_pixels(parameters[self.RADIUS_OF_ANALYSIS], gt[1], -gt[5])
+            cache_keys = self.viewshed_cache_keys(parameters, context, cache, dem_path, viewpoint_pixel_locs, self.ENGINE_VIEWSHED_PLUGIN)
 
         viewsheds_paths = []
-        viewsheds = []
         for i, viewpoint in enumerate(viewpoints_layer.getFeatures()):
             # stop execution if canceled
             if feedback.isCanceled():
                 break
             feedback.setProgress(int(100 * i / num_landmarks))
 
+            filename = os.path.join(viewsheds_dir, self.viewshed_filename(i))
+
+            with profiler.stage("viewshed_cache"):
+                cached = None if cache is None else cache.get(cache_keys[i])
+            if cached is not None:
+                window, viewshed = cached
+                rows, cols = window
+                with profiler.stage("write_viewsheds"):
+                    self.write_raster_data_to_layer(filename, np.array([viewshed]), dem_path, offset=(cols.start, rows.start), dtype=gdal.GDT_Float32)
+                viewsheds_paths.append(filename)
+                continue
+
             scratch_layer = QgsVectorLayer("Point", "temporary_points", "memory")
             scratch_provider = scratch_layer.dataProvider()
 
@@ -282,72 +456,170 @@ class QualityAnalyzerAlgorithm(QgsProcessingAlgorithm):
             scratch_provider.addAttributes(viewpoints_layer.fields())
             scratch_layer.updateFields()
             scratch_provider.addFeatures([viewpoint])
-            
-            filename = os.path.join(viewsheds_dir, self.viewshed_filename(i))
 
-            viewshed_path = processing.run(
-                "visibility:Viewshed",
-                {
-                    "OBSERVER_POINTS": scratch_layer,
-                    "DEM": parameters[self.INPUT],
-                    "OUTPUT": filename
-                },
-                is_child_algorithm=True,
-                context=context,
-                feedback=feedback
-            )["OUTPUT"]
+            with profiler.stage("visibility:Viewshed"):
+                viewshed_path = processing.run(
+                    "visibility:Viewshed",
+                    {
+                        "OBSERVER_POINTS": scratch_layer,
+                        "DEM": parameters[self.INPUT],
+                        "OUTPUT": filename
+                    },
+                    is_child_algorithm=True,
+                    context=context,
+                    feedback=feedback
+                )["OUTPUT"]
             viewsheds_paths.append(viewshed_path)
-            viewsheds.append(
-                QgsRasterLayer(viewshed_path, f"viewshed_{i}", "gdal")
-            )
 
+            if cache is not None:
+                window = quality_analysis.landmark_window(viewpoint_pixel_locs[i], radius_px, shape)
+                with profiler.stage("viewshed_cache"):
+                    cache.put(cache_keys[i], window, quality_analysis.read_viewshed(viewshed_path, window))
 
-        # Run quality analysis on the computed viewsheds (now written to disk) and write results to the new rasters
-        fims_dir = self.parameterAsFileOutput(parameters, self.FIMS_DIR, context)
-        if not os.path.isdir(fims_dir):
-            os.mkdir(fims_dir)
+        return viewpoints_layer, viewsheds_paths
 
-        pointing = self.parameterAsDouble(parameters, self.POINTING_ACCURACY, context) * 1e-3
-        fim_arrays = quality_analysis.compute_fims(viewpoints_layer, viewsheds_paths)
+    def processAlgorithm(self, parameters, context, feedback):
+        """
+        Here is where the processing itself takes place.
+        """
+        profiler = instrumentation.Profiler()
+        debug = self.parameterAsBoolean(parameters, self.LANDMARK_DEBUG, context)
+        with instrumentation.debug_messages(feedback.pushDebugInfo) if debug else contextlib.nullcontext():
+            results = self.analyze_quality(parameters, context, feedback, profiler)
+
+        trace_path = self.parameterAsFileOutput(parameters, self.PROFILE_TRACE, context)
+        instrumentation.report(profiler, feedback.pushInfo, trace_path)
+        if trace_path:
+            results[self.PROFILE_TRACE] = trace_path
+        return results
+
+    def analysis_mask(self, parameters, context):
+        """the mask of the DEM pixels to compute the quality of (see `masking.analysis_mask`), or None for all of them"""
+        dem_layer = self.parameterAsRasterLayer(parameters, self.INPUT, context)
+        aoi_wkbs = None
+        aoi_source = self.parameterAsSource(parameters, self.AOI_LAYER, context)
+        if aoi_source is not None:
+            transform = QgsCoordinateTransform(aoi_source.sourceCrs(), dem_layer.crs(), context.transformContext())
+            aoi_wkbs = []
+            for feature in aoi_source.getFeatures():
+                geometry = QgsGeometry(feature.geometry())
+                geometry.transform(transform)
+                aoi_wkbs.append(bytes(geometry.asWkb()))
+
+        mask_layer = self.parameterAsRasterLayer(parameters, self.TRAVERSABILITY_MASK, context)
+        max_slope = None
+        if parameters.get(self.MAX_SLOPE) is not None:
+            max_slope = self.parameterAsDouble(parameters, self.MAX_SLOPE, context)
+        return masking.analysis_mask(dem_layer, aoi_wkbs=aoi_wkbs, mask_raster=mask_layer, max_slope=max_slope)
+
+    def analyze_quality(self, parameters, context, feedback, profiler):
+        """run the analysis, recording the time and memory of each stage with the given profiler"""
+        landmarks_layer = self.parameterAsSource(parameters, self.LANDMARKS_LAYER, context)
+        num_landmarks = landmarks_layer.featureCount()
 
-        metric_id = self.parameterAsEnum(parameters, self.QUALITY_METRIC, context)
-        quality_array = quality_analysis.compute_quality(fim_arrays, pointing, metric=metric_id)
+        radius = self.parameterAsInt(parameters, self.RADIUS_OF_ANALYSIS, context)
+        engine = self.parameterAsEnum(parameters, self.VIEWSHED_ENGINE, context)
+
+        viewsheds_dir = self.parameterAsFileOutput(parameters, self.VIEWSHEDS_DIR, context)
+        if not viewsheds_dir and engine == self.ENGINE_VIEWSHED_PLUGIN:
+            viewsheds_dir = QgsProcessingUtils.tempFolder()     # the plugin always writes its viewsheds to disk
+        if viewsheds_dir and not os.path.isdir(viewsheds_dir):
+            os.mkdir(viewsheds_dir)
+
+        cache = self.viewshed_cache(parameters, context)
 
-        # write resulting arrays to layers
+        # in tiled mode, nothing the size of the whole raster is ever held in memory
+        block_size = self.parameterAsInt(parameters, self.BLOCK_SIZE, context)
+        store_path = self.parameterAsFileOutput(parameters, self.VISIBILITY_STORE, context)
+        if block_size > 0 and not store_path:
+            store_path = QgsProcessingUtils.generateTempFilename("viewsheds.trnvis")     # blocks read their viewsheds from it
+
+        landmark_height = self.parameterAsDouble(parameters, self.LANDMARK_HEIGHT, context)
+        robot_height = self.parameterAsDouble(parameters, self.ROBOT_HEIGHT, context)
+        pointing = self.parameterAsDouble(parameters, self.POINTING_ACCURACY, context) * 1e-3
+        metric_id = self.parameterAsEnum(parameters, self.QUALITY_METRIC, context)
         quality_raster_path = self.parameterAsFileOutput(parameters, self.OUTPUT, context)
-        self.write_raster_data_to_layer(quality_raster_path, np.array([quality_array]), viewsheds_paths[0])
+        fim_sum_path = self.parameterAsOutputLayer(parameters, self.FIM_SUM, context)
+        fims_dir = self.parameterAsFileOutput(parameters, self.FIMS_DIR, context)
+        bands_path = self.parameterAsOutputLayer(parameters, self.QUALITY_BANDS, context)
 
-        quality_raster = QgsRasterLayer(quality_raster_path, "GDOP" if metric_id == 0 else "Worst-Case")      # reload and name layer
+        def report_progress(fraction):
+            # the pipeline removes the outputs it has written so far before passing this on
+            if feedback.isCanceled():
+                raise QgsProcessingException(self.tr("Canceled"))
+            feedback.setProgress(int(100 * fraction))
 
+        with profiler.stage("analysis_mask"):
+            mask = self.analysis_mask(parameters, context)
 
-        # Add Viewsheds, FIM's, and Quality layer to map and index
-        project_instance = QgsProject.instance()
-        root = project_instance.layerTreeRoot()
+        options = dict(
+            metric=metric_id, block_size=block_size, store_path=store_path, fim_sum_path=fim_sum_path, fims_dir=fims_dir,
+            bands_path=bands_path, mask=mask, progress_callback=report_progress, log=feedback.pushInfo
+        )
+        if engine == self.ENGINE_BUILTIN:
+            # Compute viewsheds in memory, straight from the DEM
+            dem_layer = self.parameterAsRasterLayer(parameters, self.INPUT, context)
+            landmark_points = (feature.geometry().asPoint() for feature in landmarks_layer.getFeatures())
+            outputs = quality_pipeline.run_quality_analysis(
+                dem_layer, [(point.x(), point.y()) for point in landmark_points], quality_raster_path, radius,
+                landmark_height, robot_height, pointing, num_workers=self.parameterAsInt(parameters, self.NUM_WORKERS, context),
+                viewsheds_dir=viewsheds_dir, cache=cache, profiler=profiler, **options
+            )
+            viewsheds_paths = outputs["viewsheds"]
+        else:
+            # Run viewshed analysis
+            viewpoints_layer, viewsheds_paths = self.run_plugin_viewsheds(parameters, context, feedback, profiler, viewsheds_dir, num_landmarks, cache=cache)
+            if feedback.isCanceled():
+                raise QgsProcessingException(self.tr("Canceled"))
+            gt, shape = quality_analysis.read_raster_geometry(viewsheds_paths[0])
+            viewpoint_pixel_locs = quality_analysis.viewpoint_pixel_locations(viewpoints_layer, gt)
+            radius_px = quality_analysis.radius_in_pixels(radius, gt[1], -gt[5])
+            viewsheds = quality_analysis.read_viewsheds(viewsheds_paths, viewpoint_pixel_locs, radius_px, shape)
+
+            dem_path = self.parameterAsRasterLayer(parameters, self.INPUT, context).source()
+            manifest = quality_pipeline.fim_sum_manifest(dem_path, engine, radius, landmark_height, robot_height) if fim_sum_path else None
+            outputs = quality_pipeline.analyze_viewsheds(
+                viewsheds, num_landmarks, viewsheds_paths[0], radius_px, quality_raster_path, pointing, manifest=manifest,
+                profiler=profiler, **options
+            )
+            if cache is not None:
+                with profiler.stage("viewshed_cache"):
+                    cache.evict()
+        fims_paths = outputs["fims"]
+
+        with profiler.stage("load_layers"):
+            quality_raster = QgsRasterLayer(quality_raster_path, "GDOP" if metric_id == 0 else "Worst-Case")      # reload and name layer
 
-        viewshed_node_group = QgsLayerTreeGroup("Viewsheds")
-        root.addChildNode(viewshed_node_group)
-        for viewshed in viewsheds:
-            project_instance.addMapLayer(viewshed)
-            viewshed_node_group.addLayer(viewshed)
+
+            # Add Viewsheds, FIM's, and Quality layer to map and index
+            project_instance = QgsProject.instance()
+            root = project_instance.layerTreeRoot()
+
+            viewshed_node_group = QgsLayerTreeGroup("Viewsheds")
+            root.addChildNode(viewshed_node_group)
+            for i, viewshed_path in enumerate(viewsheds_paths):
+                viewshed = QgsRasterLayer(viewshed_path, f"viewshed_{i}", "gdal")
+                project_instance.addMapLayer(viewshed)
+                viewshed_node_group.addLayer(viewshed)
         
-        fims_node_group = QgsLayerTreeGroup("FIMs")
-        root.addChildNode(fims_node_group)
-        for i, fim_array in enumerate(fim_arrays):
-            name = self.fim_filename(i)
-            full_name = os.path.join(fims_dir, name)
-            fixed_array = np.moveaxis(fim_array, -1, 0)
-            self.write_raster_data_to_layer(full_name, fixed_array, viewsheds_paths[0], bands=3)
-            fim_layer = QgsRasterLayer(full_name, name)
-            project_instance.addMapLayer(fim_layer)
-            fims_node_group.addLayer(fim_layer)
-
-        project_instance.addMapLayer(quality_raster)
-        root.addLayer(quality_raster)
+            if fims_paths:
+                fims_node_group = QgsLayerTreeGroup("FIMs")
+                root.addChildNode(fims_node_group)
+                for full_name in fims_paths:
+                    fim_layer = QgsRasterLayer(full_name, os.path.basename(full_name))
+                    project_instance.addMapLayer(fim_layer)
+                    fims_node_group.addLayer(fim_layer)
+
+            project_instance.addMapLayer(quality_raster)
+            root.addLayer(quality_raster)
 
         return {
             self.OUTPUT: quality_raster_path,
             self.NUM_LANDMARKS: num_landmarks,
-            self.INDIVIDUAL_VIEWSHEDS: viewsheds_paths
+            self.INDIVIDUAL_VIEWSHEDS: viewsheds_paths,
+            self.VISIBILITY_STORE: store_path,
+            self.FIM_SUM: fim_sum_path,
+            self.QUALITY_BANDS: bands_path
         }
 
 
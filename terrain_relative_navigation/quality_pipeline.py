@@ -0,0 +1,341 @@
+import os
+import traceback
+
+import numpy as np
+
+from osgeo import gdal
+
+from . import masking
+from . import quality_analysis
+from . import running_fim_sum
+from . import tiled_quality
+from . import viewshed_analysis
+from .instrumentation import Profiler
+from .viewshed_cache import cached_viewsheds, file_hash
+from .visibility_store import VisibilityStore, VisibilityStoreWriter
+
+
+# viewshed engine id of the built-in viewsheds, as recorded in viewshed cache keys and FIM sum manifests
+ENGINE_BUILTIN = 0
+
+
+def viewshed_filename(i):
+    return f"viewshed_{i}.tif"
+
+
+def fim_filename(i):
+    return f"FIM_{i}.tif"
+
+
+def viewshed_cache_keys(cache, dem_path, viewpoints, landmark_height, robot_height, radius, engine):
+    """cache keys of the viewsheds of the given landmark pixel locations"""
+    dem_hash = file_hash(dem_path)
+    return [cache.key(dem_hash, viewpoint, landmark_height, robot_height, radius, engine) for viewpoint in viewpoints]
+
+
+def fim_sum_manifest(dem_path, engine, radius, landmark_height, robot_height):
+    """the parameters a running FIM sum was computed with (see `running_fim_sum.write_manifest`), except its landmarks"""
+    return {
+        "dem_hash": file_hash(dem_path),
+        "engine": engine,
+        "radius": radius,
+        "landmark_height": landmark_height,
+        "robot_height": robot_height,
+    }
+
+
+def create_bands_raster(filename, template_path, tiled=False):
+    """create the multi-band raster of all quality metrics (see `quality_analysis.QUALITY_BANDS`), to be written block by block"""
+    return quality_analysis.create_raster(
+        filename, template_path, len(quality_analysis.QUALITY_BANDS), dtype=gdal.GDT_Float32, tiled=tiled,
+        band_names=quality_analysis.QUALITY_BANDS
+    )
+
+
+def analyze_viewsheds(viewsheds, num_landmarks, template_path, radius_px, quality_path, pointing, metric=0,
+                      block_size=0, store_path=None, fim_sum_path=None, manifest=None, fims_dir=None,
+                      viewsheds_dir=None, bands_path=None, mask=None, progress_callback=None, log=None, profiler=None):
+    """
+    compute the quality raster of the given (viewpoint, window, viewshed) tuples of `num_landmarks` landmarks, where
+    each viewshed covers the (rows, cols) window of the (rx, ry) pixel radius around its viewpoint, and write it to
+    `quality_path` (if any: e.g. only the FIM sum may be needed) with the extent and projection of the template
+    raster (the DEM).
+
+    Optionally, each viewshed is written to `viewsheds_dir` and each landmark FIM to `fims_dir`, the viewsheds are
+    stored in a visibility store at `store_path`, and the running FIM sum is written to `fim_sum_path` along with the
+    given manifest (see `fim_sum_manifest`). All quality metrics (see `quality_analysis.quality_bands`) are written as
+    the bands of `bands_path`, if given, from the same pass as the quality. With a positive `block_size`, the quality
+    is computed block by block from the visibility store (see `tiled_quality`), which is then required.
+
+    With a (h, w) analysis `mask` (see `masking.analysis_mask`), FIMs are only summed and the quality only computed
+    on its valid pixels (see `masking.ValidPixels`); everything else is written as nodata (and 0 in the FIM sum).
+
+    `progress_callback(fraction)` is called before each landmark and after each block, with a fraction that only grows
+    (in blocks, the landmarks take the first half and the blocks the second); it may raise to cancel, which removes the
+    outputs written so far. `log(message)` is called with progress messages. The time and memory of each stage
+    are recorded by the given profiler, if any. Returns a dict of the written viewshed and FIM paths, and the landmark
+    pixel locations in the order they were processed.
+    """
+    outputs = {"viewsheds": [], "fims": [], "landmarks": []}
+    created_fims_dir = bool(fims_dir) and not os.path.isdir(fims_dir)
+    try:
+        _analyze_viewsheds(
+            outputs, viewsheds, num_landmarks, template_path, radius_px, quality_path, pointing, metric, block_size,
+            store_path, fim_sum_path, manifest, fims_dir, viewsheds_dir, bands_path, mask, progress_callback, log,
+            profiler
+        )
+    except BaseException as error:
+        traceback.clear_frames(error.__traceback__)     # closes the rasters and the store still open in them
+        remove_outputs(
+            outputs["viewsheds"] + outputs["fims"] + [store_path, fim_sum_path, quality_path, bands_path],
+            [fims_dir] if created_fims_dir else []
+        )
+        if fim_sum_path:
+            remove_outputs([running_fim_sum.manifest_path(fim_sum_path)])
+        raise
+    return outputs
+
+
+def remove_outputs(paths, directories=()):
+    """remove those of the given output files that exist, then the given directories if they are left empty"""
+    for path in paths:
+        if path and os.path.isfile(path):
+            os.remove(path)
+    for directory in directories:
+        if os.path.isdir(directory) and not os.listdir(directory):
+            os.rmdir(directory)
+
+
+def _analyze_viewsheds(outputs, viewsheds, num_landmarks, template_path, radius_px, quality_path, pointing, metric,
+                       block_size, store_path, fim_sum_path, manifest, fims_dir, viewsheds_dir, bands_path, mask,
+                       progress_callback, log, profiler):
+    """`analyze_viewsheds`, adding the paths it writes and the landmarks it processes to the lists of `outputs`"""
+    if profiler is None:
+        profiler = Profiler(events=False)
+    tiled = block_size > 0
+    if tiled and not store_path:
+        raise ValueError("Computing the quality in blocks requires a visibility store")
+
+    gt, shape = quality_analysis.read_raster_geometry(template_path)
+    pixelSizeX = gt[1]
+    pixelSizeY =-gt[5]
+    dtype = gdal.GDT_Float32
+
+    store_writer = VisibilityStoreWriter(store_path, shape, gt) if store_path else None
+    viewsheds_share = 0.5 if tiled else 1.0     # of the progress, the rest being the blocks
+    viewsheds_paths = outputs["viewsheds"]
+    processed_viewpoints = outputs["landmarks"]
+
+    def report_viewsheds():
+        try:
+            for i, (viewpoint, window, viewshed) in enumerate(profiler.iterate("viewsheds", viewsheds)):
+                if progress_callback is not None:
+                    progress_callback(viewsheds_share * i / num_landmarks)
+
+                if viewsheds_dir:
+                    filename = os.path.join(viewsheds_dir, viewshed_filename(i))
+                    rows, cols = window
+                    with profiler.stage("write_viewsheds"):
+                        quality_analysis.write_raster(filename, np.array([viewshed]), template_path, offset=(cols.start, rows.start), dtype=gdal.GDT_Byte)
+                    viewsheds_paths.append(filename)
+                if store_writer is not None:
+                    with profiler.stage("visibility_store"):
+                        store_writer.add(viewpoint, window, viewshed)
+                processed_viewpoints.append(viewpoint)
+                yield viewpoint, window, viewshed
+        finally:
+            if hasattr(viewsheds, "close"):
+                viewsheds.close()       # shuts down any worker processes
+
+    # Run quality analysis on the computed viewsheds and write results to the new rasters
+    fims_paths = outputs["fims"]
+    fim_callback = None
+    if fims_dir:
+        if not os.path.isdir(fims_dir):
+            os.mkdir(fims_dir)
+
+        def fim_callback(i, fim_array, window):
+            full_name = os.path.join(fims_dir, fim_filename(i))
+            rows, cols = window
+            with profiler.stage("write_fims"):
+                quality_analysis.write_raster(full_name, np.moveaxis(fim_array, -1, 0), template_path, offset=(cols.start, rows.start), dtype=dtype)
+            fims_paths.append(full_name)
+
+    if tiled:
+        # first stream all viewsheds to the visibility store, then compute the outputs block by block from it
+        kernel = quality_analysis.fim_kernel(pixelSizeX, pixelSizeY, *radius_px)
+        for i, (viewpoint, window, viewshed) in enumerate(report_viewsheds()):
+            if fim_callback is not None:
+                with profiler.stage("fims"):
+                    fim = quality_analysis.landmark_fim(viewshed, viewpoint, window, kernel)
+                fim_callback(i, fim, window)
+        with profiler.stage("visibility_store"):
+            store_writer.close()
+
+        write_fim_sum_block = write_quality_block = write_bands_block = None
+        if fim_sum_path:
+            projection = gdal.Open(template_path).GetProjection()
+            fim_sum_ds = running_fim_sum.create_fim_sum(fim_sum_path, shape, gt, projection, tiled=True)
+
+            def write_fim_sum_block(fim_sum, visible_count, block):
+                rows, cols = block
+                with profiler.stage("write_fim_sum"):
+                    running_fim_sum.write_fim_sum_block(fim_sum_ds, fim_sum, visible_count, offset=(cols.start, rows.start))
+
+        if quality_path:
+            quality_ds = quality_analysis.create_raster(quality_path, template_path, 1, dtype=dtype, tiled=True)
+
+            def write_quality_block(quality, block):
+                rows, cols = block
+                with profiler.stage("write_quality"):
+                    quality_ds.GetRasterBand(1).WriteArray(quality, cols.start, rows.start)
+
+        if bands_path:
+            bands_ds = create_bands_raster(bands_path, template_path, tiled=True)
+
+            def write_bands_block(bands, block):
+                rows, cols = block
+                with profiler.stage("write_quality"):
+                    for i, band in enumerate(bands):
+                        bands_ds.GetRasterBand(i + 1).WriteArray(band, cols.start, rows.start)
+
+        blocks_callback = None
+        if progress_callback is not None:
+            def blocks_callback(fraction):
+                progress_callback(viewsheds_share + (1 - viewsheds_share) * fraction)
+
+        if log is not None:
+            log(f"Computing quality in blocks of {block_size}x{block_size} pixels")
+        with profiler.stage("tiled_quality"):
+            tiled_quality.tiled_quality(
+                VisibilityStore(store_path), pointing, write_quality_block, metric=metric, block_size=block_size,
+                write_fim_sum_block=write_fim_sum_block, write_bands_block=write_bands_block, mask=mask,
+                progress_callback=blocks_callback
+            )
+            quality_ds = fim_sum_ds = bands_ds = None       # flush to disk
+    elif mask is not None:
+        # only the valid pixels are summed, in compact (n, ...) arrays
+        valid = masking.ValidPixels(mask)
+        if log is not None:
+            log(f"Computing the quality of {len(valid)} of {mask.size} pixels ({100 * len(valid) / mask.size:.1f}%)")
+        compact_count = np.zeros(len(valid), dtype=np.int32) if fim_sum_path or bands_path else None
+        with profiler.stage("fims"):
+            compact_sum = masking.accumulate_masked_fims(
+                report_viewsheds(), valid, pixelSizeX, pixelSizeY, radius_px, fim_callback=fim_callback,
+                visible_count=compact_count, dtype=np.float64 if fim_sum_path else np.float32
+            )
+        if store_writer is not None:
+            with profiler.stage("visibility_store"):
+                store_writer.close()
+        if fim_sum_path:
+            fim_sum, visible_count = valid.scatter(compact_sum, 0), valid.scatter(compact_count, 0)
+    else:
+        # a persisted running sum is kept in float64, so landmarks can be subtracted from it again later
+        visible_count = np.zeros(shape, dtype=np.int32) if fim_sum_path or bands_path else None
+        with profiler.stage("fims"):
+            fim_sum = quality_analysis.accumulate_viewshed_fims(
+                report_viewsheds(), shape, pixelSizeX, pixelSizeY, radius_px, fim_callback=fim_callback,
+                visible_count=visible_count, dtype=np.float64 if fim_sum_path else np.float32
+            )
+        if store_writer is not None:
+            with profiler.stage("visibility_store"):
+                store_writer.close()
+
+    if fim_sum_path:
+        manifest = dict(manifest or {}, landmarks=[list(viewpoint) for viewpoint in processed_viewpoints])
+        if mask is not None:
+            manifest["mask_hash"] = masking.mask_hash(mask)     # only summed over the valid pixels
+        with profiler.stage("write_fim_sum"):
+            if tiled:
+                running_fim_sum.write_manifest(fim_sum_path, manifest)
+            else:
+                projection = gdal.Open(template_path).GetProjection()
+                running_fim_sum.write_fim_sum(fim_sum_path, fim_sum, visible_count, gt, projection, manifest)
+
+    if not tiled and (quality_path or bands_path):
+        with profiler.stage("quality"):
+            if mask is not None:
+                bands = masking.masked_quality_bands(
+                    compact_sum, pointing, valid, compact_count, bands=None if bands_path else (metric,)
+                )
+                quality_array = bands[metric if bands_path else 0]
+            elif bands_path:
+                bands = quality_analysis.quality_bands(fim_sum, pointing, visible_count)
+                quality_array = bands[metric]
+            else:
+                quality_array = quality_analysis.compute_quality(fim_sum, pointing, metric=metric)
+        with profiler.stage("write_quality"):
+            if quality_path:
+                quality_analysis.write_raster(quality_path, np.array([quality_array]), template_path, dtype=dtype)
+            if bands_path:
+                quality_analysis.write_raster(
+                    bands_path, bands, template_path, dtype=dtype, band_names=quality_analysis.QUALITY_BANDS
+                )
+
+
+def run_quality_analysis(dem, landmarks, quality_path, radius, landmark_height, robot_height, pointing, metric=0,
+                         num_workers=1, block_size=0, store_path=None, fim_sum_path=None, fims_dir=None,
+                         viewsheds_dir=None, bands_path=None, mask=None, cache=None, progress_callback=None,
+                         log=None, profiler=None):
+    """
+    compute the localization quality raster of the given (n, 2) landmark map coordinates on a DEM (a filename or a
+    GDAL-backed QgsRasterLayer), with the built-in viewshed engine, and write it to `quality_path`; `pointing` is the
+    pointing accuracy in radians and `metric` is 0 = GDOP or 1 = Worst-Case.
+
+    Viewsheds are computed by `num_workers` processes (0 = one per core), and loaded from and added to the given
+    viewshed cache if any. With a positive `block_size`, the DEM is never read whole, and the quality is computed block
+    by block (see `analyze_viewsheds`, which also describes the optional outputs, analysis mask, callbacks and
+    profiler). With a mask, the viewsheds of landmarks out of range of all its valid pixels are not computed at all,
+    unless the individual viewsheds or FIMs are written out.
+    """
+    if profiler is None:
+        profiler = Profiler(events=False)
+    dem_path = quality_analysis.raster_filename(dem)
+    gt, shape = quality_analysis.read_raster_geometry(dem_path)
+    pixelSizeX = gt[1]
+    pixelSizeY =-gt[5]
+    viewpoint_pixel_locs = quality_analysis.pixel_locations(landmarks, gt)
+    radius_px = quality_analysis.radius_in_pixels(radius, pixelSizeX, pixelSizeY)
+    if mask is not None and not (viewsheds_dir or fims_dir):
+        relevant = [
+            viewpoint for viewpoint in viewpoint_pixel_locs
+            if mask[quality_analysis.landmark_window(viewpoint, radius_px, shape)].any()
+        ]
+        if log is not None and len(relevant) < len(viewpoint_pixel_locs):
+            log(f"Skipping {len(viewpoint_pixel_locs) - len(relevant)} landmarks out of range of the analysis mask")
+        viewpoint_pixel_locs = relevant
+
+    # in tiled mode, each landmark reads its own window of the DEM
+    dem_array = None
+    if block_size <= 0:
+        with profiler.stage("read_dem"):
+            dem_array = viewshed_analysis.read_dem(dem)[0]
+
+    def compute_viewsheds(viewpoints):
+        return viewshed_analysis.landmark_viewsheds(
+            dem_path, dem_array, viewpoints, radius_px, pixelSizeX, pixelSizeY, landmark_height, robot_height,
+            radius=radius, num_workers=num_workers
+        )
+
+    if num_workers != 1 and log is not None:
+        log(f"Computing viewsheds with {num_workers or os.cpu_count()} worker processes")
+
+    if cache is None:
+        viewsheds = compute_viewsheds(viewpoint_pixel_locs)
+    else:
+        cache_keys = viewshed_cache_keys(cache, dem_path, viewpoint_pixel_locs, landmark_height, robot_height, radius, ENGINE_BUILTIN)
+        viewsheds = cached_viewsheds(cache, cache_keys, viewpoint_pixel_locs, compute_viewsheds)
+
+    if viewsheds_dir and not os.path.isdir(viewsheds_dir):
+        os.mkdir(viewsheds_dir)
+    manifest = fim_sum_manifest(dem_path, ENGINE_BUILTIN, radius, landmark_height, robot_height) if fim_sum_path else None
+    outputs = analyze_viewsheds(
+        viewsheds, len(viewpoint_pixel_locs), dem_path, radius_px, quality_path, pointing, metric=metric,
+        block_size=block_size, store_path=store_path, fim_sum_path=fim_sum_path, manifest=manifest, fims_dir=fims_dir,
+        viewsheds_dir=viewsheds_dir, bands_path=bands_path, mask=mask, progress_callback=progress_callback, log=log,
+        profiler=profiler
+    )
+    if cache is not None:
+        with profiler.stage("viewshed_cache"):
+            cache.evict()
+    return outputs
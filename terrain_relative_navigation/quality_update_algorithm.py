@@ -0,0 +1,290 @@
+# -*- coding: utf-8 -*-
+
+"""
+/***************************************************************************
+ QualityUpdater
+                                 A QGIS plugin
+ This plugin incrementally updates a localization quality raster when
+ landmarks are added to or removed from the landmark catalog.
+                              -------------------
+        begin                : 2021-03-10
+        copyright            : (C) 2021 by NASA JPL
+        email                : russells@jpl.nasa.gov
+ ***************************************************************************/
+"""
+
+__author__ = "NASA JPL"
+__date__ = "2021-03-10"
+__copyright__ = "(C) 2021 by NASA JPL"
+
+# This will get replaced with a git SHA1 when you do a git archive
+
+__revision__ = "$Format:%H$"
+
+from qgis.PyQt.QtCore import QCoreApplication
+from qgis.core import (QgsProcessing,
+                       QgsProcessingAlgorithm,
+                       QgsProcessingException,
+                       QgsProcessingParameterRasterLayer,
+                       QgsProcessingParameterFeatureSource,
+                       QgsProcessingParameterRasterDestination,
+                       QgsProcessingParameterNumber,
+                       QgsProcessingParameterEnum,
+                       QgsProcessingParameterFile,
+                       QgsProcessingOutputNumber,
+                       QgsProject,
+                       QgsRasterLayer)
+
+from osgeo import gdal
+import numpy as np
+
+from . import quality_analysis
+from . import viewshed_analysis
+from . import running_fim_sum
+from .viewshed_cache import ViewshedCache, cached_viewsheds, file_hash
+
+
+class QualityUpdateAlgorithm(QgsProcessingAlgorithm):
+    """
+    Updates the running FIM sum written by the Localization Quality algorithm
+    to match a new landmark catalog, by only computing the viewsheds of the
+    landmarks that were added or removed, and re-derives the quality raster.
+    """
+
+    INPUT = "INPUT"
+    OUTPUT = "OUTPUT"
+
+    FIM_SUM = "FIM_SUM"
+    LANDMARKS_LAYER = "INPUT_LANDMARKS"
+    POINTING_ACCURACY = "POINTING_ACCURACY"
+    QUALITY_METRIC = "QUALITY_METRIC"
+    NUM_WORKERS = "NUM_WORKERS"
+    VIEWSHED_CACHE_DIR = "VIEWSHED_CACHE_DIR"
+    OUTPUT_FIM_SUM = "OUTPUT_FIM_SUM"
+
+    NUM_ADDED = "NUM_ADDED"
+    NUM_REMOVED = "NUM_REMOVED"
+
+    def initAlgorithm(self, config):
+        """
+        Here we define the inputs and output of the algorithm, along
+        with some other properties.
+        """
+
+        # Elevation Map
+        self.addParameter(
+            QgsProcessingParameterRasterLayer(
+                self.INPUT,
+                self.tr("DEM"),
+            )
+        )
+
+        # Existing running FIM sum (with its manifest next to it)
+        self.addParameter(
+            QgsProcessingParameterRasterLayer(
+                self.FIM_SUM,
+                self.tr("Running FIM Sum"),
+            )
+        )
+
+        # New landmark catalog
+        self.addParameter(
+            QgsProcessingParameterFeatureSource(
+                self.LANDMARKS_LAYER,
+                self.tr("Landmarks"),
+                [QgsProcessing.TypeVectorPoint]
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterNumber(
+                self.POINTING_ACCURACY,
+                self.tr("Pointing accuracy, milliradians"),
+                QgsProcessingParameterNumber.Double,
+                defaultValue=1.75
+            ),
+        )
+
+        self.addParameter(
+            QgsProcessingParameterEnum(
+                self.QUALITY_METRIC,
+                self.tr("Quality metric"),
+                ["GDOP = sqrt(trace(C))", "Worst-Case = sqrt(max_eigenvalue(C))"],
+                defaultValue=0
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterNumber(
+                self.NUM_WORKERS,
+                self.tr("Number of worker processes for the built-in viewshed engine (0 = one per core)"),
+                QgsProcessingParameterNumber.Integer,
+                defaultValue=1,
+                minValue=0
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterFile(
+                self.VIEWSHED_CACHE_DIR,
+                self.tr("Viewshed cache folder (reused across runs)"),
+                behavior=QgsProcessingParameterFile.Folder,
+                optional=True
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterRasterDestination(
+                self.OUTPUT_FIM_SUM,
+                self.tr("Updated Running FIM Sum Output")
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterRasterDestination(
+                self.OUTPUT,
+                self.tr("Quality Layer Output Destination")
+            )
+        )
+
+        self.addOutput(
+            QgsProcessingOutputNumber(
+                self.NUM_ADDED,
+                self.tr("Number of landmarks added")
+            )
+        )
+
+        self.addOutput(
+            QgsProcessingOutputNumber(
+                self.NUM_REMOVED,
+                self.tr("Number of landmarks removed")
+            )
+        )
+
+    def processAlgorithm(self, parameters, context, feedback):
+        """
+        Here is where the processing itself takes place.
+        """
+        dem_path = self.parameterAsRasterLayer(parameters, self.INPUT, context).source()
+        fim_sum_layer = self.parameterAsRasterLayer(parameters, self.FIM_SUM, context)
+        fim_sum, visible_count, manifest, gt, projection = running_fim_sum.read_fim_sum(fim_sum_layer.source())
+
+        dem_hash = file_hash(dem_path)
+        if manifest["dem_hash"] != dem_hash:
+            raise QgsProcessingException(self.tr("The running FIM sum was computed on a different DEM"))
+        if manifest["engine"] != 0:
+            raise QgsProcessingException(self.tr("Only running FIM sums computed with the built-in viewshed engine can be updated"))
+        if "mask_hash" in manifest:
+            raise QgsProcessingException(self.tr("Running FIM sums computed on an analysis mask cannot be updated"))
+
+        landmarks_layer = self.parameterAsSource(parameters, self.LANDMARKS_LAYER, context)
+        landmarks = quality_analysis.viewpoint_pixel_locations(landmarks_layer, gt)
+        added, removed = running_fim_sum.landmark_changes(manifest["landmarks"], landmarks)
+        feedback.pushInfo(f"Adding {len(added)} landmarks, removing {len(removed)} landmarks")
+
+        # compute the viewsheds of the changed landmarks only, with the same parameters as the running sum; each one only
+        # reads its own window of the DEM, so an update costs as much as the landmarks it changes
+        pixelSizeX = gt[1]
+        pixelSizeY =-gt[5]
+        radius = manifest["radius"]
+        radius_px = quality_analysis.radius_in_pixels(radius, pixelSizeX, pixelSizeY)
+        num_workers = self.parameterAsInt(parameters, self.NUM_WORKERS, context)
+
+        def compute_viewsheds(viewpoints):
+            return viewshed_analysis.landmark_viewsheds(
+                dem_path, None, viewpoints, radius_px, pixelSizeX, pixelSizeY,
+                manifest["landmark_height"], manifest["robot_height"], radius=radius, num_workers=num_workers
+            )
+
+        cache_dir = self.parameterAsFile(parameters, self.VIEWSHED_CACHE_DIR, context)
+        cache = ViewshedCache(cache_dir, float("inf")) if cache_dir else None
+
+        def changed_viewsheds(viewpoints, done):
+            if cache is None:
+                viewsheds = compute_viewsheds(viewpoints)
+            else:
+                keys = [
+                    cache.key(dem_hash, viewpoint, manifest["landmark_height"], manifest["robot_height"], radius, manifest["engine"])
+                    for viewpoint in viewpoints
+                ]
+                viewsheds = cached_viewsheds(cache, keys, viewpoints, compute_viewsheds)
+
+            num_changed = len(added) + len(removed)
+            try:
+                for i, result in enumerate(viewsheds):
+                    if feedback.isCanceled():
+                        # nothing is written before all the viewsheds are summed
+                        raise QgsProcessingException(self.tr("Canceled; the running FIM sum was not updated"))
+                    feedback.setProgress(int(100 * (done + i) / num_changed))
+                    yield result
+            finally:
+                viewsheds.close()       # shuts down any worker processes
+
+        running_fim_sum.update_fim_sum(
+            fim_sum, visible_count, changed_viewsheds(added, len(removed)), changed_viewsheds(removed, 0),
+            pixelSizeX, pixelSizeY, radius_px
+        )
+
+        manifest["landmarks"] = [list(landmark) for landmark in landmarks]
+        output_fim_sum_path = self.parameterAsOutputLayer(parameters, self.OUTPUT_FIM_SUM, context)
+        running_fim_sum.write_fim_sum(output_fim_sum_path, fim_sum, visible_count, gt, projection, manifest)
+
+        # re-derive the quality raster from the updated sum
+        pointing = self.parameterAsDouble(parameters, self.POINTING_ACCURACY, context) * 1e-3
+        metric_id = self.parameterAsEnum(parameters, self.QUALITY_METRIC, context)
+        quality_array = quality_analysis.compute_quality(fim_sum, pointing, metric=metric_id)
+
+        quality_raster_path = self.parameterAsOutputLayer(parameters, self.OUTPUT, context)
+        quality_analysis.write_raster(quality_raster_path, np.array([quality_array]), dem_path, dtype=gdal.GDT_Float32)
+
+        quality_raster = QgsRasterLayer(quality_raster_path, "GDOP" if metric_id == 0 else "Worst-Case")      # reload and name layer
+        project_instance = QgsProject.instance()
+        project_instance.addMapLayer(quality_raster)
+
+        return {
+            self.OUTPUT: quality_raster_path,
+            self.OUTPUT_FIM_SUM: output_fim_sum_path,
+            self.NUM_ADDED: len(added),
+            self.NUM_REMOVED: len(removed)
+        }
+
+
+    def name(self):
+        """
+        Returns the algorithm name, used for identifying the algorithm. This
+        string should be fixed for the algorithm, and must not be localised.
+        The name should be unique within each provider. Names should contain
+        lowercase alphanumeric characters only and no spaces or other
+        formatting characters.
+        """
+        return "update_localization_quality"
+
+    def displayName(self):
+        """
+        Returns the translated algorithm name, which should be used for any
+        user-visible display of the algorithm name.
+        """
+        return "Update Localization Quality"
+
+    def group(self):
+        """
+        Returns the name of the group this algorithm belongs to. This string
+        should be localised.
+        """
+        return self.tr(self.groupId())
+
+    def groupId(self):
+        """
+        Returns the unique ID of the group this algorithm belongs to. This
+        string should be fixed for the algorithm, and must not be localised.
+        The group id should be unique within each provider. Group id should
+        contain lowercase alphanumeric characters only and no spaces or other
+        formatting characters.
+        """
+        return ""
+
+    def tr(self, string):
+        return QCoreApplication.translate("Processing", string)
+
+    def createInstance(self):
+        return QualityUpdateAlgorithm()
@@ -0,0 +1,94 @@
+import collections
+import json
+
+import numpy as np
+from osgeo import gdal
+
+from . import quality_analysis
+
+
+# A running FIM sum is persisted as a GeoTIFF whose bands 1-3 hold the summed FIM (xx, xy, yy) of all landmarks, and
+# whose band 4 holds the number of landmarks visible from each pixel; it is stored in float64 so that landmarks can be
+# subtracted again without accumulating float32 rounding error. The landmarks it contains (as (px, py) pixels), and
+# the parameters their viewsheds were computed with, are listed in a JSON manifest next to it.
+MANIFEST_SUFFIX = ".manifest.json"
+
+
+def manifest_path(fim_sum_path):
+    return fim_sum_path + MANIFEST_SUFFIX
+
+
+def create_fim_sum(path, shape, geotransform, projection, tiled=False):
+    """create an empty running FIM sum raster (see above), to be written block by block with `write_fim_sum_block`"""
+    h, w = shape
+    options = ["TILED=YES", "BIGTIFF=IF_SAFER"] if tiled else []
+    ds = gdal.GetDriverByName("GTiff").Create(path, w, h, 4, gdal.GDT_Float64, options=options)
+    ds.SetGeoTransform(geotransform)
+    ds.SetProjection(projection)
+    for i, description in enumerate(["FIM xx", "FIM xy", "FIM yy", "Visible landmarks"]):
+        ds.GetRasterBand(i + 1).SetDescription(description)
+    return ds
+
+
+def write_fim_sum_block(ds, fim_sum, visible_count, offset=(0, 0)):
+    """write an (h, w, 3) block of a running FIM sum, and its visible landmark counts, at the given (x, y) pixel offset"""
+    for i in range(3):
+        ds.GetRasterBand(i + 1).WriteArray(fim_sum[:,:,i], offset[0], offset[1])
+    ds.GetRasterBand(4).WriteArray(visible_count, offset[0], offset[1])
+
+
+def write_manifest(path, manifest):
+    with open(manifest_path(path), "w") as f:
+        json.dump(manifest, f, indent=1)
+
+
+def read_manifest(path):
+    with open(manifest_path(path)) as f:
+        return json.load(f)
+
+
+def write_fim_sum(path, fim_sum, visible_count, geotransform, projection, manifest):
+    """write a running FIM sum raster (see above) and its manifest"""
+    ds = create_fim_sum(path, visible_count.shape, geotransform, projection)
+    write_fim_sum_block(ds, fim_sum, visible_count)
+    ds = None   # flush to disk
+    write_manifest(path, manifest)
+
+
+def read_fim_sum(path):
+    """read a running FIM sum raster and its manifest; returns (fim_sum, visible_count, manifest, geotransform, projection)"""
+    ds = gdal.Open(path)
+    bands = quality_analysis.read_raster(path, bands=[1, 2, 3, 4])
+    fim_sum = np.ascontiguousarray(np.moveaxis(bands[:3], 0, -1), dtype=np.float64)
+    visible_count = bands[3].astype(np.int32)
+
+    return fim_sum, visible_count, read_manifest(path), ds.GetGeoTransform(), ds.GetProjection()
+
+
+def landmark_changes(old_landmarks, new_landmarks):
+    """
+    the (px, py) landmarks that have to be added and removed to go from the old landmarks to the new ones
+    (duplicate landmarks are counted separately)
+    """
+    old_counts = collections.Counter(tuple(landmark) for landmark in old_landmarks)
+    new_counts = collections.Counter(tuple(landmark) for landmark in new_landmarks)
+    added = list((new_counts - old_counts).elements())
+    removed = list((old_counts - new_counts).elements())
+    return added, removed
+
+
+def update_fim_sum(fim_sum, visible_count, added_viewsheds, removed_viewsheds, pixelSizeX, pixelSizeY, radius_px):
+    """
+    update a running FIM sum (and its visible landmark counts) in-place, given iterables of the
+    (viewpoint, window, viewshed) tuples of the landmarks to add and to remove
+    """
+    shape = visible_count.shape
+    quality_analysis.accumulate_viewshed_fims(
+        removed_viewsheds, shape, pixelSizeX, pixelSizeY, radius_px,
+        fim_sum=fim_sum, visible_count=visible_count, subtract=True
+    )
+    quality_analysis.accumulate_viewshed_fims(
+        added_viewsheds, shape, pixelSizeX, pixelSizeY, radius_px,
+        fim_sum=fim_sum, visible_count=visible_count
+    )
+    fim_sum[visible_count <= 0] = 0     # clear rounding residue where no landmark is visible anymore
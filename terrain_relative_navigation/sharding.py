@@ -0,0 +1,308 @@
+"""
+Quality analysis of a landmark catalog split into shards by landmark, so that it can be spread over many machines
+(e.g. the nodes of a batch cluster) that only share a filesystem.
+
+A job directory holds the job description (`job.json`: the DEM, the landmarks and the viewshed parameters), and,
+for every shard, the partial running FIM sum of its landmarks (see `running_fim_sum`). Any number of processes, on
+any number of nodes, run shards of the job (`run_shards` claims the shards no other process has claimed yet, and
+`run_shard` runs a given one, e.g. as the array index of a batch job); once all are done, `merge_shards` reduces the
+partial sums into the quality raster, block by block.
+
+A claim records the host and process id of its process. The claim of a process that died on the same host is stale,
+and taken over by the next process that looks for shards; a process on another host cannot be checked, so the claims
+of processes killed on other nodes are only taken over when explicitly reclaimed (see `job_claims`).
+
+A shard is done once the manifest of its partial sum exists: both are written under temporary names, and renamed
+into place (manifest last), so that an interrupted shard is never mistaken for a finished one.
+"""
+
+import json
+import os
+import socket
+
+import numpy as np
+
+from osgeo import gdal
+
+from . import quality_analysis
+from . import quality_pipeline
+from . import running_fim_sum
+from .instrumentation import Profiler
+from .tiled_quality import iter_blocks
+from .viewshed_analysis import pool_context
+
+
+JOB_FILENAME = "job.json"
+
+
+def job_path(job_dir):
+    return os.path.join(job_dir, JOB_FILENAME)
+
+
+def shard_path(job_dir, shard):
+    return os.path.join(job_dir, f"shard_{shard}.tif")
+
+
+def claim_path(job_dir, shard):
+    return os.path.join(job_dir, f"shard_{shard}.claim")
+
+
+def create_job(job_dir, dem_path, landmarks, num_shards, radius, landmark_height, robot_height, pointing, metric=0):
+    """
+    create a job directory for the quality analysis of the given (n, 2) landmark map coordinates on a DEM file, split
+    into `num_shards` shards of consecutive landmarks; the DEM must be at the same path on every node. `pointing` and
+    `metric` are the defaults of `merge_shards`. Returns the job description.
+    """
+    if num_shards < 1:
+        raise ValueError("A job needs at least one shard")
+    if os.path.exists(job_path(job_dir)):
+        raise ValueError(f"There already is a job in {job_dir}")
+    os.makedirs(job_dir, exist_ok=True)
+
+    dem_path = os.path.abspath(dem_path)
+    job = {
+        "dem": dem_path,
+        "landmarks": [[float(x), float(y)] for x, y in landmarks],
+        "num_shards": min(num_shards, max(len(landmarks), 1)),
+        "pointing": pointing,
+        "metric": metric,
+        # what every partial sum must have been computed with (see `quality_pipeline.fim_sum_manifest`)
+        "manifest": quality_pipeline.fim_sum_manifest(
+            dem_path, quality_pipeline.ENGINE_BUILTIN, radius, landmark_height, robot_height
+        ),
+    }
+    with open(job_path(job_dir), "w") as f:
+        json.dump(job, f, indent=1)
+    return job
+
+
+def read_job(job_dir):
+    with open(job_path(job_dir)) as f:
+        return json.load(f)
+
+
+def shard_landmarks(job, shard):
+    """the landmark map coordinates of the given shard of a job"""
+    if not 0 <= shard < job["num_shards"]:
+        raise ValueError(f"Shard {shard} is not part of the job (it has {job['num_shards']} shards)")
+    bounds = np.linspace(0, len(job["landmarks"]), job["num_shards"] + 1).astype(int)
+    return job["landmarks"][bounds[shard]:bounds[shard + 1]]
+
+
+def shard_done(job_dir, shard):
+    return os.path.exists(running_fim_sum.manifest_path(shard_path(job_dir, shard)))
+
+
+def job_status(job_dir):
+    """the shards of a job that are done, claimed by a process (running, or whose process died) and pending"""
+    status = {"done": [], "claimed": [], "pending": []}
+    for shard in range(read_job(job_dir)["num_shards"]):
+        if shard_done(job_dir, shard):
+            status["done"].append(shard)
+        elif os.path.exists(claim_path(job_dir, shard)):
+            status["claimed"].append(shard)
+        else:
+            status["pending"].append(shard)
+    return status
+
+
+def read_claim(path):
+    """the (host, pid) of the process that made the claim at the given path, or None if there is none (or unreadable)"""
+    try:
+        with open(path) as f:
+            host, pid = f.read().split()
+        return host, int(pid)
+    except (OSError, ValueError):
+        return None
+
+
+def process_alive(host, pid):
+    """whether the given process may be running: only processes of this host (and not on Windows) can be checked"""
+    if host != socket.gethostname() or os.name == "nt":     # os.kill would terminate the process on Windows
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass        # running, as another user
+    return True
+
+
+def job_claims(job_dir):
+    """the (host, pid) of the claim of each claimed shard of a job, as a dict"""
+    claims = {}
+    for shard in range(read_job(job_dir)["num_shards"]):
+        owner = read_claim(claim_path(job_dir, shard))
+        if owner is not None:
+            claims[shard] = owner
+    return claims
+
+
+def claim_is_stale(owner, reclaimed=None):
+    """whether a claim by the given (host, pid) is stale: its process died on this host, or it is the claim to reclaim"""
+    return owner == reclaimed or not process_alive(*owner)
+
+
+def claim_shard(job_dir, shard, reclaim=None):
+    """
+    atomically claim a shard for this process; returns whether it was claimed (or was already claimed by another).
+    A stale claim (see `claim_is_stale`) is taken over, as well as the claim of `reclaim` (a dict of claims, see
+    `job_claims`) for the shard, if it is still the same.
+    """
+    path = claim_path(job_dir, shard)
+    try:
+        fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+    except FileExistsError:
+        owner = read_claim(path)
+        if owner is None or not claim_is_stale(owner, (reclaim or {}).get(shard)):
+            return False
+        # move the stale claim away: if another process took it over first, what was moved is its new claim
+        stale_path = f"{path}.{socket.gethostname()}.{os.getpid()}.stale"
+        try:
+            os.rename(path, stale_path)
+        except FileNotFoundError:
+            return False
+        if read_claim(stale_path) != owner:
+            os.rename(stale_path, path)
+            return False
+        os.remove(stale_path)
+        try:
+            fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            return False
+    with os.fdopen(fd, "w") as f:
+        f.write(f"{socket.gethostname()} {os.getpid()}\n")
+    return True
+
+
+def run_shard(job_dir, shard, num_workers=1, block_size=0, cache=None, progress_callback=None, log=None, profiler=None):
+    """
+    compute the partial running FIM sum of the landmarks of a shard, and write it (and its manifest) to the job
+    directory, whether or not the shard was claimed or already done; `num_workers`, `block_size` and `cache` are as
+    for `quality_pipeline.run_quality_analysis`. Returns the path of the partial sum.
+    """
+    job = read_job(job_dir)
+    landmarks = shard_landmarks(job, shard)
+    manifest = job["manifest"]
+    path = shard_path(job_dir, shard)
+
+    # unique per process, in case a shard is (re-)run by several processes at once
+    temp_path = os.path.join(job_dir, f"shard_{shard}.{socket.gethostname()}.{os.getpid()}.tmp.tif")
+    store_path = temp_path + ".trnvis" if block_size > 0 else None
+    if log is not None:
+        log(f"Shard {shard}: computing the FIM sum of {len(landmarks)} landmarks. . .")
+    try:
+        quality_pipeline.run_quality_analysis(
+            job["dem"], landmarks, None, manifest["radius"], manifest["landmark_height"], manifest["robot_height"],
+            job["pointing"], num_workers=num_workers, block_size=block_size, store_path=store_path,
+            fim_sum_path=temp_path, cache=cache, progress_callback=progress_callback, log=log, profiler=profiler
+        )
+        if dict(running_fim_sum.read_manifest(temp_path), landmarks=None) != dict(manifest, landmarks=None):
+            raise ValueError(f"The DEM {job['dem']} changed since the job was created")
+
+        os.replace(temp_path, path)
+        os.replace(running_fim_sum.manifest_path(temp_path), running_fim_sum.manifest_path(path))
+    finally:
+        for leftover in (temp_path, running_fim_sum.manifest_path(temp_path), store_path):
+            if leftover and os.path.exists(leftover):
+                os.remove(leftover)
+    return path
+
+
+def run_shards(job_dir, log=None, reclaim=None, **options):
+    """
+    run the shards of a job that no other process has claimed, one after the other, until none are left (see
+    `run_shard` for the options), taking over stale claims and those of `reclaim` (see `claim_shard`); a shard that
+    fails is unclaimed again. Returns the shards that were run.
+    """
+    done = []
+    for shard in range(read_job(job_dir)["num_shards"]):
+        if shard_done(job_dir, shard) or not claim_shard(job_dir, shard, reclaim):
+            continue
+        try:
+            run_shard(job_dir, shard, log=log, **options)
+        except BaseException:
+            os.remove(claim_path(job_dir, shard))
+            raise
+        done.append(shard)
+        if log is not None:
+            log(f"Shard {shard} done")
+    return done
+
+
+def run_local(job_dir, num_processes, **options):
+    """run all the shards of a job with `num_processes` local processes, as separate nodes would (see `run_shards`)"""
+    processes = [pool_context().Process(target=run_shards, args=(job_dir,), kwargs=options) for _ in range(num_processes)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+    if any(process.exitcode != 0 for process in processes):
+        raise RuntimeError(f"Some shards of the job failed: {job_status(job_dir)}")
+
+
+def merge_shards(job_dir, quality_path, pointing=None, metric=None, fim_sum_path=None, bands_path=None,
+                 block_size=1024, progress_callback=None, log=None, profiler=None):
+    """
+    once all the shards of a job are done, reduce their partial FIM sums block by block (so that neither the sums nor
+    the outputs have to fit in memory), and write the quality raster of all the landmarks to `quality_path`, with the
+    pointing accuracy and metric of the job unless given. Optionally, the total running FIM sum is written to
+    `fim_sum_path`, and all quality metrics to `bands_path` (see `quality_analysis.quality_bands`).
+    `progress_callback(fraction)` is called after each block.
+    """
+    job = read_job(job_dir)
+    status = job_status(job_dir)
+    if status["claimed"] or status["pending"]:
+        raise RuntimeError(f"Not all shards are done: {len(status['done'])} of {job['num_shards']} (see `job_status`)")
+    pointing = job["pointing"] if pointing is None else pointing
+    metric = job["metric"] if metric is None else metric
+
+    paths = [shard_path(job_dir, shard) for shard in range(job["num_shards"])]
+    landmarks = []
+    for path in paths:
+        manifest = running_fim_sum.read_manifest(path)
+        if dict(manifest, landmarks=None) != dict(job["manifest"], landmarks=None):
+            raise ValueError(f"The partial FIM sum {path} was computed with different parameters than the job")
+        landmarks.extend(manifest["landmarks"])
+
+    template_path = job["dem"]
+    gt, shape = quality_analysis.read_raster_geometry(template_path)
+    projection = gdal.Open(template_path).GetProjection()
+    quality_ds = quality_analysis.create_raster(quality_path, template_path, 1, dtype=gdal.GDT_Float32, tiled=True)
+    fim_sum_ds = running_fim_sum.create_fim_sum(fim_sum_path, shape, gt, projection, tiled=True) if fim_sum_path else None
+    bands_ds = quality_pipeline.create_bands_raster(bands_path, template_path, tiled=True) if bands_path else None
+    if profiler is None:
+        profiler = Profiler(events=False)
+
+    if log is not None:
+        log(f"Merging the FIM sums of {len(paths)} shards ({len(landmarks)} landmarks). . .")
+    blocks = list(iter_blocks(shape, block_size))
+    for n, block in enumerate(blocks):
+        rows, cols = block
+        with profiler.stage("read_fim_sums"):
+            total = sum(quality_analysis.read_raster(path, block, bands=[1, 2, 3, 4]).astype(np.float64) for path in paths)
+        fim_sum = np.ascontiguousarray(np.moveaxis(total[:3], 0, -1))
+        visible_count = total[3].astype(np.int32)
+
+        if fim_sum_ds is not None:
+            with profiler.stage("write_fim_sum"):
+                running_fim_sum.write_fim_sum_block(fim_sum_ds, fim_sum, visible_count, offset=(cols.start, rows.start))
+        with profiler.stage("quality"):
+            if bands_ds is not None:
+                bands = quality_analysis.quality_bands(fim_sum, pointing, visible_count)
+                quality = bands[metric]
+            else:
+                quality = quality_analysis.compute_quality(fim_sum, pointing, metric=metric)
+        with profiler.stage("write_quality"):
+            quality_ds.GetRasterBand(1).WriteArray(quality, cols.start, rows.start)
+            if bands_ds is not None:
+                for i, band in enumerate(bands):
+                    bands_ds.GetRasterBand(i + 1).WriteArray(band, cols.start, rows.start)
+
+        if progress_callback is not None:
+            progress_callback((n + 1) / len(blocks))
+
+    quality_ds = fim_sum_ds = bands_ds = None       # flush to disk
+    if fim_sum_path:
+        running_fim_sum.write_manifest(fim_sum_path, dict(job["manifest"], landmarks=landmarks))
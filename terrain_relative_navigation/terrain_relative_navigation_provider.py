@@ -23,8 +23,10 @@ __revision__ = '$Format:%H$'
 
 from qgis.core import QgsProcessingProvider
 from .quality_analyzer_algorithm import QualityAnalyzerAlgorithm
+from .quality_update_algorithm import QualityUpdateAlgorithm
 from .peak_extractor_algorithm import PeakExtractorAlgorithm
 from .path_animation_algorithm import PathAnimationAlgorithm
+from .landmark_selection_algorithm import LandmarkSelectionAlgorithm
 
 
 class TerrainRelativeNavigationProvider(QgsProcessingProvider):
@@ -47,8 +49,10 @@ class TerrainRelativeNavigationProvider(QgsProcessingProvider):
         Loads all algorithms belonging to this provider.
         """
         self.addAlgorithm(QualityAnalyzerAlgorithm())
+        self.addAlgorithm(QualityUpdateAlgorithm())
         self.addAlgorithm(PeakExtractorAlgorithm())
         self.addAlgorithm(PathAnimationAlgorithm())
+        self.addAlgorithm(LandmarkSelectionAlgorithm())
 
 
     def id(self):
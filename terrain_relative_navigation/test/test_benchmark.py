@@ -0,0 +1,45 @@
+# coding=utf-8
+"""Tests for the benchmark suite."""
+
+import tempfile
+import unittest
+
+import numpy as np
+
+from ..benchmark import compare, fractal_dem, random_landmarks, run_case
+
+
+class BenchmarkTest(unittest.TestCase):
+    """Test the synthetic inputs and the benchmark runs"""
+
+    def test_fractal_dem(self):
+        """DEMs are reproducible from their seed, and rough at every scale."""
+        dem = fractal_dem(128, seed=3)
+        self.assertEqual(dem.shape, (128, 128))
+        np.testing.assert_array_equal(dem, fractal_dem(128, seed=3))
+        self.assertFalse(np.array_equal(dem, fractal_dem(128, seed=4)))
+        self.assertGreater(np.abs(np.diff(dem, axis=0)).mean(), 0)
+        self.assertGreater(dem.std(), 10 * np.abs(np.diff(dem, axis=1)).mean())
+
+    def test_random_landmarks(self):
+        landmarks = random_landmarks((50, 80), 30, seed=1)
+        self.assertEqual(len(landmarks), 30)
+        self.assertTrue(all(0 <= px < 80 and 0 <= py < 50 for px, py in landmarks))
+
+    def test_run_case(self):
+        """Every stage is timed, and a run compares to itself as unchanged."""
+        with tempfile.TemporaryDirectory() as work_dir:
+            case = run_case(96, 4, work_dir, radius=300.0, window_size=9, path_landmarks=2)
+        self.assertEqual(
+            set(case["stages"]),
+            {"generate_dem", "peak_extraction", "peak_extraction_local_maxima", "peak_prominence", "viewsheds", "fims", "quality", "path_animation"}
+        )
+        self.assertTrue(all(stage["seconds"] >= 0 and stage["peak_rss_mb"] > 0 for stage in case["stages"].values()))
+
+        lines = compare({"cases": [case]}, {"cases": [case]})
+        self.assertEqual(len(lines), len(case["stages"]))
+        self.assertTrue(all("(1.00x)" in line for line in lines))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,106 @@
+# coding=utf-8
+"""Tests for the command line interface: path evaluation and peak extraction."""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from osgeo import gdal, ogr
+
+from .. import cli
+from .. import vector_io
+
+
+class PathCommandTest(unittest.TestCase):
+    """Test evaluating a path against the FIM rasters of some of the landmarks"""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.landmarks = np.c_[np.arange(8) * 100.0 + 1000.0, np.full(8, 4000.0)]
+        self.landmarks_path = self.path("landmarks.geojson")
+        vector_io.write_vector(self.landmarks_path, ogr.wkbPoint, vector_io.point_wkbs(self.landmarks))
+        self.path_path = self.path("path.geojson")
+        line = vector_io.segment_wkbs(np.array([[1005.0, 4995.0]]), np.array([[1045.0, 4995.0]]))
+        vector_io.write_vector(self.path_path, ogr.wkbLineString, line)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def path(self, name):
+        return os.path.join(self.directory, name)
+
+    def write_fim(self, index):
+        """a FIM raster of the given landmark, visible everywhere"""
+        filename = self.path(f"FIM_{index}.tif")
+        ds = gdal.GetDriverByName("GTiff").Create(filename, 10, 10, 3, gdal.GDT_Float32)
+        ds.SetGeoTransform((1000.0, 10.0, 0.0, 5000.0, 0.0, -10.0))
+        for band, value in zip(range(1, 4), (1.0, 0.0, 1.0)):
+            ds.GetRasterBand(band).WriteArray(np.full((10, 10), value))
+        ds = None
+        return filename
+
+    def test_fims_of_some_landmarks(self):
+        """The rays of each FIM go to the landmark of its index, whatever the FIMs given."""
+        fims = [self.write_fim(i) for i in (7, 0, 3)]
+        rays_path = self.path("rays.geojson")
+        cli.main(["-q", "path", self.path_path, self.landmarks_path, *fims, "--speed", "10", "--rays", rays_path])
+
+        rays = list(ogr.Open(rays_path).GetLayer())
+        self.assertEqual(len(rays), 5 * 3)
+        for ray in rays:
+            landmark = ray.GetField("landmark")
+            self.assertIn(landmark, (0, 3, 7))
+            end = ray.GetGeometryRef().GetPoint_2D(1)
+            np.testing.assert_array_equal(end, self.landmarks[landmark])
+
+    def test_fim_beyond_landmarks(self):
+        fims = [self.write_fim(i) for i in (0, 8)]
+        with self.assertRaises(ValueError):
+            cli.main(["-q", "path", self.path_path, self.landmarks_path, *fims])
+
+
+
+class PeaksCommandTest(unittest.TestCase):
+    """Test that the prominence of the peaks is only computed when asked for, and never in tiles"""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        rng = np.random.default_rng(5)
+        y, x = np.mgrid[0:60, 0:80]
+        dem = np.zeros((60, 80))
+        for cx, cy, height, width in zip(
+            rng.uniform(0, 80, 25), rng.uniform(0, 60, 25), rng.uniform(1, 5, 25), rng.uniform(4, 10, 25)
+        ):
+            dem += height * np.exp(-((x - cx)**2 + (y - cy)**2) / (2 * width**2))
+
+        self.dem_path = os.path.join(self.directory, "dem.tif")
+        ds = gdal.GetDriverByName("GTiff").Create(self.dem_path, 80, 60, 1, gdal.GDT_Float64)
+        ds.SetGeoTransform((1000.0, 10.0, 0.0, 5000.0, 0.0, -10.0))
+        ds.GetRasterBand(1).WriteArray(dem)
+        ds = None
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def peak_fields(self, *options):
+        """the fields of the peaks extracted with the given options"""
+        output = os.path.join(self.directory, "peaks.geojson")
+        cli.main(["-q", "peaks", self.dem_path, output, "--window-size", "50", "--spacing", "40", *options])
+        layer = ogr.Open(output).GetLayer()
+        self.assertGreater(layer.GetFeatureCount(), 0)
+        definition = layer.GetLayerDefn()
+        return [definition.GetFieldDefn(i).GetName() for i in range(definition.GetFieldCount())]
+
+    def test_prominence_opt_in(self):
+        self.assertEqual(self.peak_fields(), [])
+        self.assertEqual(self.peak_fields("--prominence"), ["prominence", "isolation"])
+        self.assertEqual(self.peak_fields("--prominence", "--tile-size", "32"), [])
+        with self.assertRaises(ValueError):
+            self.peak_fields("--max-peaks", "3")
+
+
+if __name__ == "__main__":
+    unittest.main()
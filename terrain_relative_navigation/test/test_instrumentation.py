@@ -0,0 +1,97 @@
+# coding=utf-8
+"""Tests for the per-stage timing and memory instrumentation."""
+
+import json
+import os
+import tempfile
+import time
+import unittest
+
+import numpy as np
+
+from .. import quality_analysis
+from ..instrumentation import Profiler, debug_messages, report
+
+
+class ProfilerTest(unittest.TestCase):
+    """Test recording the time and memory of nested and repeated stages"""
+
+    def test_nested_self_times(self):
+        """The self times of nested stages add up to the time of the outer stage."""
+        profiler = Profiler()
+        with profiler.stage("outer"):
+            time.sleep(0.01)
+            for _ in range(3):
+                with profiler.stage("inner"):
+                    time.sleep(0.01)
+
+        outer, inner = profiler.stages["outer"], profiler.stages["inner"]
+        self.assertEqual(outer["calls"], 1)
+        self.assertEqual(inner["calls"], 3)
+        self.assertGreaterEqual(inner["wall"], 0.03)
+        self.assertAlmostEqual(outer["self_wall"] + inner["wall"], outer["wall"])
+        self.assertGreater(outer["peak_rss"], 0)
+        self.assertEqual([event["stage"] for event in profiler.events], ["inner"] * 3 + ["outer"])
+
+    def test_stage_recorded_on_error(self):
+        profiler = Profiler(events=False)
+        with self.assertRaises(RuntimeError):
+            with profiler.stage("failing"):
+                raise RuntimeError("Canceled")
+        self.assertEqual(profiler.stages["failing"]["calls"], 1)
+        self.assertIsNone(profiler.events)
+
+    def test_iterate(self):
+        """Producing each item is a call of the stage, but consuming it is not."""
+        def items():
+            for i in range(4):
+                time.sleep(0.01)
+                yield i
+
+        profiler = Profiler()
+        for _ in profiler.iterate("produce", items()):
+            with profiler.stage("consume"):
+                time.sleep(0.01)
+
+        self.assertEqual(profiler.stages["produce"]["calls"], 5)      # including the final, empty one
+        self.assertEqual(profiler.stages["consume"]["calls"], 4)
+        self.assertLess(profiler.stages["produce"]["wall"], 0.04 + profiler.stages["consume"]["wall"])
+
+    def test_report(self):
+        profiler = Profiler()
+        with profiler.stage("quality"):
+            pass
+        lines = []
+        with tempfile.TemporaryDirectory() as temp_dir:
+            trace_path = os.path.join(temp_dir, "trace.json")
+            report(profiler, lines.append, trace_path)
+            with open(trace_path) as f:
+                trace = json.load(f)
+
+        self.assertTrue(lines[1].strip().startswith("quality: "))
+        self.assertTrue(lines[-1].strip().startswith("total: "))
+        self.assertEqual(trace["stages"]["quality"]["calls"], 1)
+        self.assertEqual(len(trace["events"]), 1)
+
+
+class DebugMessagesTest(unittest.TestCase):
+    """Test switching the per-landmark debug messages on and off"""
+
+    def landmark_fim(self):
+        viewshed = np.ones((3, 3), dtype=np.uint8)
+        kernel = quality_analysis.fim_kernel(1.0, 1.0, 1, 1)
+        quality_analysis.landmark_fim(viewshed, (1, 1), (slice(0, 3), slice(0, 3)), kernel)
+
+    def test_debug_messages(self):
+        messages = []
+        with debug_messages(messages.append):
+            self.landmark_fim()
+        self.assertEqual(len(messages), 1)
+        self.assertIn("visible pixels", messages[0])
+
+        self.landmark_fim()
+        self.assertEqual(len(messages), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
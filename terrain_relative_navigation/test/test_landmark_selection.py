@@ -0,0 +1,96 @@
+# coding=utf-8
+"""Tests for greedy landmark selection."""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from ..landmark_selection import capped_quality, replace_sorted, select_landmarks, sorted_percentile
+from ..quality_analysis import accumulate_viewshed_fims
+from ..visibility_store import VisibilityStore, write_visibility_store
+
+
+class LandmarkSelectionTest(unittest.TestCase):
+    """Test lazy greedy selection against exhaustive evaluation"""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.shape = (24, 32)
+        self.radius_px = (8, 8)
+        rng = np.random.default_rng(1)
+        self.viewsheds = []
+        for px, py in rng.integers(0, 24, size=(10, 2)):
+            rows = slice(max(py - 8, 0), min(py + 9, self.shape[0]))
+            cols = slice(max(px - 8, 0), min(px + 9, self.shape[1]))
+            viewshed = (rng.random((rows.stop - rows.start, cols.stop - cols.start)) > 0.4).astype(np.uint8)
+            self.viewsheds.append(((int(px), int(py)), (rows, cols), viewshed))
+
+        path = os.path.join(self.directory, "viewsheds.trnvis")
+        write_visibility_store(path, self.shape, (0.0, 10.0, 0.0, 0.0, 0.0, -10.0), self.viewsheds)
+        self.store = VisibilityStore(path)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def mean_quality(self, indices):
+        fim_sum = accumulate_viewshed_fims(
+            [self.viewsheds[i] for i in indices], self.shape, 10.0, 10.0, self.radius_px
+        )
+        return capped_quality(fim_sum, 1e-3).mean(dtype=np.float64)
+
+    def test_store_radius(self):
+        """The kernel radius covers every window."""
+        rx, ry = self.store.radius_px()
+        self.assertLessEqual(rx, 8)
+        self.assertLessEqual(ry, 8)
+        for (px, py), (rows, cols), _ in self.viewsheds:
+            self.assertLessEqual(px - cols.start, rx)
+            self.assertLessEqual(rows.stop - 1 - py, ry)
+
+    def test_greedy_picks(self):
+        """Each pick is the best next landmark, and its gain is the drop in the mean."""
+        picks = list(select_landmarks(self.store, 4, 1e-3))
+        self.assertEqual(len(picks), 4)
+
+        selected = []
+        previous = self.mean_quality(selected)
+        for i, gain, objective in picks:
+            remaining = [j for j in range(len(self.viewsheds)) if j not in selected]
+            best = min(remaining, key=lambda j: self.mean_quality(selected + [j]))
+            self.assertAlmostEqual(self.mean_quality(selected + [i]), self.mean_quality(selected + [best]), places=6)
+
+            selected.append(i)
+            self.assertAlmostEqual(objective, self.mean_quality(selected), places=6)
+            self.assertAlmostEqual(gain, previous - objective, places=6)
+            previous = objective
+
+    def test_percentile(self):
+        """Percentile objectives are reported, and picks are distinct."""
+        picks = list(select_landmarks(self.store, 20, 1e-3, percentile=90))
+        self.assertEqual(len(picks), len(self.viewsheds))
+        self.assertEqual(len({i for i, _, _ in picks}), len(self.viewsheds))
+
+        # the percentile kept up to date from the windows of the picks is that of the whole raster
+        for n in range(1, len(picks) + 1):
+            fim_sum = accumulate_viewshed_fims(
+                [self.viewsheds[i] for i, _, _ in picks[:n]], self.shape, 10.0, 10.0, self.radius_px
+            )
+            self.assertAlmostEqual(picks[n - 1][2], np.percentile(capped_quality(fim_sum, 1e-3), 90), delta=1e-3)
+
+    def test_replace_sorted(self):
+        rng = np.random.default_rng(2)
+        values = rng.integers(0, 5, size=200).astype(np.float32)     # many equal values
+        window = slice(40, 90)
+        updated = values.copy()
+        updated[window] = rng.integers(0, 5, size=50)
+        actual = replace_sorted(np.sort(values), values[window], updated[window])
+        np.testing.assert_array_equal(actual, np.sort(updated))
+        for percentile in (0, 37.5, 90, 100):
+            self.assertAlmostEqual(sorted_percentile(actual, percentile), np.percentile(updated, percentile))
+
+
+if __name__ == "__main__":
+    unittest.main()
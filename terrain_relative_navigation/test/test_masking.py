@@ -0,0 +1,137 @@
+# coding=utf-8
+"""Tests for computing the quality on the valid pixels of an analysis mask only."""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from osgeo import gdal, ogr, osr
+
+from .. import masking
+from ..masking import ValidPixels, accumulate_masked_fims, masked_quality_bands
+from ..quality_analysis import accumulate_viewshed_fims, quality_bands
+
+
+class MaskingTest(unittest.TestCase):
+    """Test the compact valid-pixel index, and masked FIM sums and quality"""
+
+    def setUp(self):
+        rng = np.random.default_rng(5)
+        self.shape = (40, 50)
+        self.mask = rng.random(self.shape) > 0.6
+        self.radius_px = (8, 8)
+        self.viewsheds = []
+        for px, py in zip(rng.integers(0, 50, 6), rng.integers(0, 40, 6)):
+            rows = slice(max(py - 8, 0), min(py + 9, 40))
+            cols = slice(max(px - 8, 0), min(px + 9, 50))
+            viewshed = (rng.random((rows.stop - rows.start, cols.stop - cols.start)) > 0.3).astype(np.uint8)
+            self.viewsheds.append(((int(px), int(py)), (rows, cols), viewshed))
+
+    def test_window(self):
+        """The positions of a window are those of its valid pixels, in row-major order."""
+        valid = ValidPixels(self.mask)
+        for window in [(slice(3, 17), slice(5, 30)), (slice(0, 40), slice(0, 50)), (slice(10, 10), slice(0, 5))]:
+            rows, cols = np.nonzero(self.mask[window])
+            expected = (rows + window[0].start) * 50 + cols + window[1].start
+            np.testing.assert_array_equal(valid.flat[valid.window(window)], expected)
+
+    def test_scatter(self):
+        valid = ValidPixels(self.mask)
+        full = valid.scatter(np.arange(len(valid)), -1)
+        np.testing.assert_array_equal(full[self.mask], np.arange(len(valid)))
+        self.assertTrue((full[~self.mask] == -1).all())
+
+    def test_masked_sum_matches_full_sum(self):
+        """The compact FIM sum, counts and quality are those of the whole raster, on the valid pixels."""
+        visible_count = np.zeros(self.shape, dtype=np.int32)
+        fim_sum = accumulate_viewshed_fims(
+            self.viewsheds, self.shape, 5.0, 5.0, self.radius_px, visible_count=visible_count, dtype=np.float64
+        )
+        valid = ValidPixels(self.mask)
+        compact_count = np.zeros(len(valid), dtype=np.int32)
+        compact_sum = accumulate_masked_fims(
+            self.viewsheds, valid, 5.0, 5.0, self.radius_px, visible_count=compact_count, dtype=np.float64
+        )
+        np.testing.assert_allclose(compact_sum, fim_sum[self.mask], rtol=1e-12)
+        np.testing.assert_array_equal(compact_count, visible_count[self.mask])
+
+        bands = masked_quality_bands(compact_sum, 1e-3, valid, compact_count)
+        expected = quality_bands(fim_sum, 1e-3, visible_count)
+        np.testing.assert_allclose(bands[:, self.mask], expected[:, self.mask], rtol=1e-5)
+        self.assertTrue((bands[:-1, ~self.mask] == 1_000_000).all())
+        self.assertTrue((bands[-1, ~self.mask] == 0).all())
+
+
+class AnalysisMaskTest(unittest.TestCase):
+    """Test building analysis masks from polygons, mask rasters and slopes"""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.gt = (100.0, 10.0, 0.0, 500.0, 0.0, -10.0)
+        x = np.arange(30) * 10.0
+        self.dem = np.tile(np.where(x < 150, 0.0, (x - 150) * 0.5), (25, 1))      # flat, then a 26.6 degree slope
+        self.dem_path = self.write_raster("dem.tif", self.dem)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write_raster(self, name, array, gt=None, epsg=32633):
+        path = os.path.join(self.directory, name)
+        ds = gdal.GetDriverByName("GTiff").Create(path, array.shape[1], array.shape[0], 1, gdal.GDT_Float32)
+        ds.SetGeoTransform(self.gt if gt is None else gt)
+        srs = osr.SpatialReference()
+        srs.ImportFromEPSG(epsg)
+        ds.SetProjection(srs.ExportToWkt())
+        ds.GetRasterBand(1).WriteArray(array)
+        ds = None
+        return path
+
+    def test_slope_mask(self):
+        """Slopes are the same whether the DEM is read in strips or whole."""
+        mask = masking.analysis_mask(self.dem_path, max_slope=20)
+        self.assertTrue(mask[:, :16].all())     # the central difference at the foot of the slope is only half as steep
+        self.assertFalse(mask[:, 16:].any())
+
+        strip_rows = masking.MAX_STRIP_ROWS
+        masking.MAX_STRIP_ROWS = 4
+        try:
+            np.testing.assert_array_equal(masking.analysis_mask(self.dem_path, max_slope=20), mask)
+        finally:
+            masking.MAX_STRIP_ROWS = strip_rows
+
+    def test_combined_mask(self):
+        """Polygons and mask rasters restrict each other."""
+        traversable = np.ones(self.dem.shape)
+        traversable[:5] = 0
+        mask_path = self.write_raster("mask.tif", traversable)
+        square = "POLYGON ((100 500, 200 500, 200 400, 100 400, 100 500))"      # the top-left 10x10 pixels
+        wkb = bytes(ogr.CreateGeometryFromWkt(square).ExportToWkb())
+
+        mask = masking.analysis_mask(self.dem_path, aoi_wkbs=[wkb], mask_raster=mask_path)
+        expected = np.zeros(self.dem.shape, dtype=bool)
+        expected[5:10, :10] = True
+        np.testing.assert_array_equal(mask, expected)
+
+    def test_misaligned_mask(self):
+        mask_path = self.write_raster("mask.tif", np.ones((5, 5)))
+        with self.assertRaises(ValueError):
+            masking.analysis_mask(self.dem_path, mask_raster=mask_path)
+
+        # same size, but shifted by half a pixel, or in another CRS
+        shifted_gt = (105.0,) + self.gt[1:]
+        for mask_path in [
+            self.write_raster("shifted.tif", np.ones(self.dem.shape), gt=shifted_gt),
+            self.write_raster("reprojected.tif", np.ones(self.dem.shape), epsg=32634),
+        ]:
+            with self.assertRaises(ValueError):
+                masking.analysis_mask(self.dem_path, mask_raster=mask_path)
+
+        mask_path = self.write_raster("aligned.tif", np.ones(self.dem.shape))
+        self.assertTrue(masking.analysis_mask(self.dem_path, mask_raster=mask_path).all())
+
+
+if __name__ == "__main__":
+    unittest.main()
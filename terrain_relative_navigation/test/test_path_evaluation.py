@@ -0,0 +1,104 @@
+# coding=utf-8
+"""Tests for evaluating the localization quality along a robot path."""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from osgeo import gdal
+
+from ..path_evaluation import covariance_ellipses, path_fims, points_along_line
+
+
+class PathEvaluationTest(unittest.TestCase):
+    """Test splitting paths into waypoints and drawing their covariance ellipses"""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write_fims(self, num_landmarks, gt=(0.0, 10.0, 0.0, 300.0, 0.0, -10.0), shape=(30, 40)):
+        """random 3-band FIM rasters, and their arrays"""
+        rng = np.random.default_rng(3)
+        paths, fims = [], []
+        for i in range(num_landmarks):
+            fim = rng.random((3,) + shape) * (rng.random(shape) > 0.5)
+            path = os.path.join(self.directory, f"FIM_{i}.tif")
+            ds = gdal.GetDriverByName("GTiff").Create(path, shape[1], shape[0], 3, gdal.GDT_Float64)
+            ds.SetGeoTransform(gt)
+            for band in range(3):
+                ds.GetRasterBand(band + 1).WriteArray(fim[band])
+            ds = None
+            paths.append(path)
+            fims.append(fim)
+        return paths, fims
+
+    def test_path_fims(self):
+        """Every raster is sampled under the waypoints, and sampling stops when the progress callback says so."""
+        paths, fims = self.write_fims(4)
+        waypoints = np.array([
+            (5.0, 295.0), (123.0, 157.0), (399.0, 1.0), (395.0, 157.0), (15.0, 295.0), (-5.0, 100.0), (200.0, 400.0)
+        ])
+        expected = np.zeros((len(waypoints), 4, 3))
+        for j, fim in enumerate(fims):
+            expected[:5, j] = fim[:, [0, 14, 29, 14, 0], [0, 12, 39, 39, 1]].T      # the last two are off the rasters
+
+        fractions = []
+        total_fims, visible = path_fims(waypoints, paths, progress_callback=fractions.append)
+        np.testing.assert_allclose(total_fims, expected.sum(axis=1))
+        np.testing.assert_array_equal(visible, expected.any(axis=2))
+        self.assertEqual(fractions, [0.25, 0.5, 0.75, 1.0])
+
+        total_fims, _ = path_fims(waypoints, paths, progress_callback=lambda fraction: fraction < 0.5)
+        np.testing.assert_allclose(total_fims, expected[:, :2].sum(axis=1))
+
+    def test_points_along_line(self):
+        """Points are evenly spaced along the whole polyline, across vertices."""
+        points = points_along_line([(0, 0), (3, 4), (3, 10)], 2.5)
+        np.testing.assert_allclose(points, [(0, 0), (1.5, 2), (3, 4), (3, 6.5), (3, 9)])
+
+    def test_points_along_line_end(self):
+        """The last vertex is only included if the length is a multiple of the spacing."""
+        self.assertEqual(len(points_along_line([(0, 0), (10, 0)], 5)), 3)
+        self.assertEqual(len(points_along_line([(0, 0), (10, 0)], 4)), 3)
+
+    def test_invalid_spacing(self):
+        with self.assertRaises(ValueError):
+            points_along_line([(0, 0), (10, 0)], 0)
+
+    def test_covariance_ellipses(self):
+        """Ellipses are centered on their waypoints, and only drawn where the FIM is invertible."""
+        waypoints = np.array([(10.0, 20.0), (30.0, 40.0)])
+        fims = np.array([(4.0, 0.0, 1.0), (0.0, 0.0, 0.0)])
+        drawn, rings, singular = covariance_ellipses(waypoints, fims, 1.0, 1.0)
+
+        np.testing.assert_array_equal(drawn, [True, False])
+        np.testing.assert_array_equal(singular, [False, True])
+        self.assertEqual(rings.shape, (1, 37, 2))
+        np.testing.assert_allclose(rings[0].mean(axis=0), (10, 20), atol=0.1)
+        # covariance is diag(1/4, 1): semi-axes of 1/2 along x and 1 along y
+        np.testing.assert_allclose(np.ptp(rings[0], axis=0), (1, 2), atol=0.02)
+
+    def test_rotated_covariance_ellipse(self):
+        """The major axis of the ellipse follows that of the covariance, in map coordinates (y pointing north)."""
+        # in pixel row order (x east, y south): variance 4 along (1, -1), i.e. towards the north east, and 1 across
+        major, minor = np.array([1.0, -1.0]) / np.sqrt(2), np.array([1.0, 1.0]) / np.sqrt(2)
+        fim = np.linalg.inv(4 * np.outer(major, major) + np.outer(minor, minor))
+        waypoints = np.array([(100.0, 200.0)])
+        drawn, rings, _ = covariance_ellipses(waypoints, np.array([(fim[0, 0], fim[0, 1], fim[1, 1])]), 1.0, 1.0)
+
+        self.assertTrue(drawn[0])
+        offsets = rings[0] - waypoints[0]
+        farthest = offsets[np.argmax(np.hypot(*offsets.T))]
+        np.testing.assert_allclose(np.abs(farthest), (np.sqrt(2), np.sqrt(2)), atol=1e-9)
+        self.assertGreater(farthest[0] * farthest[1], 0)        # north east or south west
+        np.testing.assert_allclose(np.hypot(*offsets.T).min(), 1.0, atol=0.02)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,105 @@
+# coding=utf-8
+"""Tests for the raster peak extractor."""
+
+import unittest
+
+import numpy as np
+
+from ..peak_extraction import (PEAK, PIT, PLANAR, classify_features, cluster_peaks, connected_labels, extract_peaks,
+                               maximum_filter, quadratic_fit_matrix, quadratic_surface, suppress_non_maxima)
+
+
+class PeakExtractionTest(unittest.TestCase):
+    """Test local maxima, peak shapes and spacing"""
+
+    def test_maximum_filter(self):
+        """The running max matches a brute-force window max, also at the edges."""
+        dem = np.random.default_rng(0).random((13, 17))
+        for size in (1, 3, 7, 21):
+            r = size // 2
+            expected = np.array([
+                [dem[max(i - r, 0):i + r + 1, max(j - r, 0):j + r + 1].max() for j in range(17)] for i in range(13)
+            ])
+            np.testing.assert_array_equal(maximum_filter(dem, size), expected)
+
+    def test_suppress_non_maxima(self):
+        """Points closer than the spacing to a higher point are dropped."""
+        xs = np.array([0.0, 5.0, 20.0, 24.0])
+        ys = np.array([0.0, 0.0, 0.0, 0.0])
+        keep = suppress_non_maxima(xs, ys, np.array([1.0, 2.0, 3.0, 0.0]), 10.0)
+        self.assertEqual(list(keep), [2, 1])
+
+    def test_extract_peaks(self):
+        """Gaussian hills are found at their summits; nearby summits are merged."""
+        y, x = np.mgrid[0:200, 0:200]
+        dem = np.zeros((200, 200))
+        for cx, cy, height in [(50, 50, 100), (150, 60, 80), (100, 150, 120), (104, 150, 119)]:
+            dem += height * np.exp(-((x - cx)**2 + (y - cy)**2) / (2 * 15**2))
+        dem[:5, :5] = np.nan
+
+        points, elevations = extract_peaks(dem, (1000.0, 10.0, 0.0, 5000.0, 0.0, -10.0), 11, 100.0)
+        self.assertEqual(len(points), 3)
+        self.assertTrue(np.all(np.diff(elevations) < 0))
+        np.testing.assert_allclose(points[1], [1505.0, 4495.0])       # pixel (50, 50)
+        np.testing.assert_allclose(points[2], [2505.0, 4395.0])       # pixel (150, 60)
+
+    def test_flat(self):
+        """Flat and sloped terrain has no peaks."""
+        y, x = np.mgrid[0:50, 0:50]
+        gt = (0.0, 1.0, 0.0, 0.0, 0.0, -1.0)
+        self.assertEqual(len(extract_peaks(np.zeros((50, 50)), gt, 5, 10.0)[0]), 0)
+        self.assertEqual(len(extract_peaks(0.5 * x + 0.2 * y, gt, 5, 10.0)[0]), 0)
+
+    def test_quadratic_surface(self):
+        """Window moments give the same fit as a least-squares fit of each window."""
+        rng = np.random.default_rng(0)
+        dem = np.cumsum(np.cumsum(rng.normal(size=(30, 40)), 0), 1) + 1000.0
+        dem[12, 20] = np.nan
+        size = 5
+        coefficients = quadratic_surface(dem, size, 2.0, 3.0)
+        fit = quadratic_fit_matrix(size, 2.0, 3.0)
+
+        for i in range(30):
+            for j in range(40):
+                window = dem[i - 2:i + 3, j - 2:j + 3]
+                if 2 <= i < 28 and 2 <= j < 38 and not np.isnan(window).any():
+                    np.testing.assert_allclose(coefficients[:, i, j], (fit @ window.ravel())[:5], rtol=1e-6, atol=1e-9)
+                else:
+                    self.assertTrue(np.isnan(coefficients[:, i, j]).all())
+
+    def test_classify_features(self):
+        """A dome is a peak at its top, a bowl a pit, and a gentle plane is planar."""
+        y, x = np.mgrid[-20:21, -20:21].astype(np.float64)
+        dome = -0.01 * (x**2 + y**2)
+        self.assertEqual(classify_features(dome, 7, 1.0, 1.0)[20, 20], PEAK)
+        self.assertEqual(classify_features(-dome, 7, 1.0, 1.0)[20, 20], PIT)
+        self.assertEqual(classify_features(0.001 * x, 7, 1.0, 1.0)[20, 20], PLANAR)
+        self.assertEqual(classify_features(dome, 7, 1.0, 1.0)[0, 0], 0)     # window off the raster
+
+    def test_connected_labels(self):
+        """Every node is labeled with the smallest node of its component."""
+        labels = connected_labels(7, [5, 1, 3, 6], [4, 2, 1, 5])
+        self.assertEqual(list(labels), [0, 1, 1, 1, 4, 4, 4])
+
+    def test_cluster_peaks(self):
+        """Touching pixels form one peak, and regions within the spacing are merged."""
+        mask = np.zeros((20, 30), dtype=bool)
+        mask[2, 2] = mask[3, 3] = True          # diagonal neighbors
+        mask[2, 6] = True                       # 2 empty pixels (20 m) from the first region
+        mask[15, 20:23] = True                  # far away
+        gt = (100.0, 10.0, 0.0, 500.0, 0.0, -10.0)
+
+        points, counts = cluster_peaks(mask, gt, 0.0)
+        self.assertEqual(sorted(counts), [1, 2, 3])
+
+        points, counts = cluster_peaks(mask, gt, 25.0)
+        self.assertEqual(list(counts), [3, 3])
+        np.testing.assert_allclose(points[0], [100.0 + 10.0 * (2.5 + 3.5 + 6.5) / 3, 500.0 - 10.0 * (2.5 + 3.5 + 2.5) / 3])
+        np.testing.assert_allclose(points[1], [100.0 + 215.0, 500.0 - 155.0])
+
+        points, counts = cluster_peaks(mask, gt, 15.0)
+        self.assertEqual(len(points), 3)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,134 @@
+# coding=utf-8
+"""Tests for the cached stages of the peak extraction, and parameter sweeps."""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from osgeo import gdal
+
+from .. import peak_extraction
+from ..instrumentation import Profiler
+from ..peak_stages import PeakStages, StageCache, sweep, sweep_filename
+from ..prominence import peak_prominence
+from ..viewshed_cache import ViewshedCache
+
+
+class PeakStagesTest(unittest.TestCase):
+    """Test that the cached stages give the peaks of the plain extraction, and are computed once"""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        rng = np.random.default_rng(5)
+        y, x = np.mgrid[0:60, 0:80]
+        self.dem = np.zeros((60, 80))
+        for cx, cy, height, width in zip(
+            rng.uniform(0, 80, 25), rng.uniform(0, 60, 25), rng.uniform(1, 5, 25), rng.uniform(4, 10, 25)
+        ):
+            self.dem += height * np.exp(-((x - cx)**2 + (y - cy)**2) / (2 * width**2))
+        self.gt = (1000.0, 10.0, 0.0, 5000.0, 0.0, -10.0)
+
+        self.dem_path = os.path.join(self.directory, "dem.tif")
+        ds = gdal.GetDriverByName("GTiff").Create(self.dem_path, 80, 60, 1, gdal.GDT_Float64)
+        ds.SetGeoTransform(self.gt)
+        ds.GetRasterBand(1).WriteArray(self.dem)
+        ds = None
+        self.cache_dir = os.path.join(self.directory, "cache")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_match_plain_extraction(self):
+        stages = PeakStages(self.dem_path)
+        for spacing in (0.0, 40.0, 150.0):
+            expected = peak_extraction.feature_peaks(self.dem, self.gt, 5, spacing)
+            self.assertGreater(len(expected), 0)
+            np.testing.assert_allclose(stages.feature_peaks(5, spacing), expected)
+
+            expected, expected_elevations = peak_extraction.extract_peaks(self.dem, self.gt, 7, spacing)
+            points, elevations = stages.local_maxima_peaks(7, spacing)
+            np.testing.assert_array_equal(points, expected)
+            np.testing.assert_array_equal(elevations, expected_elevations)
+
+        for actual, expected in zip(stages.peak_prominence(points), peak_prominence(self.dem, self.gt, points)):
+            np.testing.assert_array_equal(actual, expected)
+
+    def test_cache_across_runs(self):
+        """A second run on the same DEM reads the stages from the cache instead of classifying again."""
+        calls = []
+
+        def classify(size):
+            calls.append(size)
+            return peak_extraction.classify_features(self.dem, size, self.gt[1], -self.gt[5])
+
+        stages = PeakStages(self.dem_path, StageCache(self.cache_dir, 2**30))
+        expected = stages.feature_peaks(5, 40.0, "counted", classify)
+        profiler = Profiler(events=False)
+        stages = PeakStages(self.dem_path, StageCache(self.cache_dir, 2**30), profiler)
+        np.testing.assert_allclose(stages.feature_peaks(5, 40.0, "counted", classify), expected)
+        self.assertEqual(calls, [5])
+        self.assertNotIn("peak_pixels", profiler.stages)
+        self.assertIsNone(stages._dem)      # never read
+
+        # another window size is a miss
+        stages.feature_peaks(7, 40.0, "counted", classify)
+        self.assertEqual(calls, [5, 7])
+
+    def test_sweep(self):
+        """Every combination is extracted, classifying once per window size."""
+        calls = []
+
+        def classify(size):
+            calls.append(size)
+            return peak_extraction.classify_features(self.dem, size, self.gt[1], -self.gt[5])
+
+        stages = PeakStages(self.dem_path)
+        combinations = list(sweep(stages, [50.0, 70.0], [0.0, 40.0, 150.0], engine="counted", classify=classify))
+        self.assertEqual([(w, s) for w, s, _ in combinations], [
+            (50.0, 0.0), (50.0, 40.0), (50.0, 150.0), (70.0, 0.0), (70.0, 40.0), (70.0, 150.0)
+        ])
+        self.assertEqual(calls, [5, 7])
+        for window_size, spacing, points in combinations:
+            size = peak_extraction.window_size_in_pixels(window_size, self.gt[1], -self.gt[5])
+            np.testing.assert_allclose(points, peak_extraction.feature_peaks(self.dem, self.gt, size, spacing))
+
+        self.assertEqual(sweep_filename("out", 50.0, 12.5), os.path.join("out", "peaks_w50_s12.5.gpkg"))
+
+    def test_sweep_group_peaks(self):
+        """The peak pixels are grouped by the given function instead of on the raster."""
+        grouped = []
+
+        def group_peaks(rows, cols, spacing):
+            grouped.append((len(rows), spacing))
+            return np.zeros((0, 2))
+
+        stages = PeakStages(self.dem_path)
+        combinations = list(sweep(stages, [50.0], [0.0, 40.0], group_peaks=group_peaks))
+        rows, _ = stages.peak_pixels(5)
+        self.assertEqual(grouped, [(len(rows), 0.0), (len(rows), 40.0)])
+        self.assertTrue(all(len(points) == 0 for _, _, points in combinations))
+
+    def test_shared_cache_directory(self):
+        """Stage and viewshed caches in one directory only evict their own entries."""
+        stages = StageCache(self.cache_dir, 2**30)
+        viewsheds = ViewshedCache(self.cache_dir, 2**30)
+        stage_key = stages.key("dem", "peak_pixels", {"size": 5})
+        stages.put(stage_key, {"rows": np.arange(3), "cols": np.arange(3)})
+        viewshed_key = viewsheds.key("dem", (1, 2), 10.0, 2.0, 100.0, "native")
+        viewsheds.put(viewshed_key, (slice(0, 2), slice(0, 2)), np.ones((2, 2), dtype=np.uint8))
+
+        StageCache(self.cache_dir, 0).evict()
+        self.assertFalse(stages.contains(stage_key))
+        self.assertTrue(viewsheds.contains(viewshed_key))
+
+        stages.put(stage_key, {"rows": np.arange(3), "cols": np.arange(3)})
+        ViewshedCache(self.cache_dir, 0).evict()
+        self.assertTrue(stages.contains(stage_key))
+        self.assertFalse(viewsheds.contains(viewshed_key))
+
+
+if __name__ == "__main__":
+    unittest.main()
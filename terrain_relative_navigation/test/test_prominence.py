@@ -0,0 +1,92 @@
+# coding=utf-8
+"""Tests for the topographic prominence and isolation of peaks."""
+
+import unittest
+
+import numpy as np
+
+from ..prominence import isolation, peak_prominence, select_prominent, summit_prominence
+
+
+def swept_prominence(dem):
+    """prominence of every summit, from the plain pixel-by-pixel sweep with union-find"""
+    h, w = dem.shape
+    z = dem.ravel()
+    order = sorted(np.flatnonzero(~np.isnan(z)).tolist(), key=lambda p: (-z[p], p))
+    rank = {p: k for k, p in enumerate(order)}
+    parent, prominence = {}, {}
+
+    def find(p):
+        while parent[p] != p:
+            p = parent[p]
+        return p
+
+    for p in order:
+        r, c = divmod(p, w)
+        neighbors = [
+            q * w + s for q in range(r - 1, r + 2) for s in range(c - 1, c + 2) if 0 <= q < h and 0 <= s < w
+        ]
+        roots = {find(q) for q in neighbors if q in parent}
+        parent[p] = min(roots, key=rank.get) if roots else p
+        for root in roots - {parent[p]}:
+            prominence[root] = z[root] - z[p]
+            parent[root] = parent[p]
+
+    for root in [p for p in order if find(p) == p]:
+        prominence[root] = z[root] - min(z[p] for p in order if find(p) == root)
+    return prominence
+
+
+class ProminenceTest(unittest.TestCase):
+    """Test the contracted sweep against the plain one, and the isolation search"""
+
+    def setUp(self):
+        self.rng = np.random.default_rng(2)
+
+    def test_matches_pixel_sweep(self):
+        """Ties in elevation and nodata barriers give the same summits and prominences."""
+        for _ in range(5):
+            dem = np.round(np.cumsum(np.cumsum(self.rng.normal(size=(23, 31)), axis=0), axis=1))
+            dem[self.rng.random(dem.shape) < 0.05] = np.nan
+            dem[10] = np.nan        # two separate regions
+            summit, summits, prominence = summit_prominence(dem)
+            expected = swept_prominence(dem)
+            self.assertEqual(summits.tolist(), sorted(expected))
+            np.testing.assert_allclose(prominence, [expected[s] for s in summits.tolist()])
+            self.assertTrue((summit[np.isnan(dem.ravel())] == -1).all())
+
+    def test_two_hills(self):
+        """The lower of two hills is as prominent as its height above the col between them."""
+        x = np.arange(100.0)
+        profile = 50 * np.exp(-(x - 30)**2 / 200) + 30 * np.exp(-(x - 70)**2 / 200)
+        dem = np.tile(profile, (5, 1)) - np.abs(np.arange(5) - 2)[:, np.newaxis]
+        gt = (0.0, 1.0, 0.0, 5.0, 0.0, -1.0)
+
+        points = np.array([[30.5, 2.5], [70.5, 2.5], [68.5, 2.5]])      # the last one ascends to the second summit
+        prominence, distances = peak_prominence(dem, gt, points)
+        col = profile[30:71].min()
+        np.testing.assert_allclose(prominence, [profile[30] - dem.min(), profile[70] - col, profile[70] - col])
+        self.assertGreater(distances[1], 20)
+        self.assertEqual(distances[0], np.hypot(100, 5))        # the highest point
+
+    def test_isolation(self):
+        """The nearest higher pixel is found whatever the size of the growing search window."""
+        dem = np.cumsum(np.cumsum(self.rng.normal(size=(60, 90)), axis=0), axis=1)
+        gt = (0.0, 10.0, 0.0, 0.0, 0.0, -7.0)
+        rows, cols = self.rng.integers(0, 60, 30), self.rng.integers(0, 90, 30)
+        y, x = np.mgrid[0:60, 0:90]
+        expected = [
+            np.hypot((x - c)[dem > dem[r, c]] * 10.0, (y - r)[dem > dem[r, c]] * 7.0).min() for r, c in zip(rows, cols)
+        ]
+        np.testing.assert_allclose(isolation(dem, gt, rows, cols), expected)
+
+    def test_select_prominent(self):
+        prominence = np.array([5.0, np.nan, 20.0, 1.0, 12.0])
+        self.assertEqual(select_prominent(prominence).tolist(), [0, 1, 2, 3, 4])
+        self.assertEqual(select_prominent(prominence, min_prominence=5.0).tolist(), [0, 2, 4])
+        self.assertEqual(select_prominent(prominence, max_peaks=2).tolist(), [2, 4])
+        self.assertEqual(select_prominent(prominence, max_peaks=2, min_prominence=15.0).tolist(), [2])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,71 @@
+# coding=utf-8
+"""Tests for computing the quality metrics of a FIM sum."""
+
+import unittest
+
+import numpy as np
+
+from ..quality_analysis import (GDOP, MINOR_SD, ORIENTATION, QUALITY_BANDS, VISIBLE_COUNT, WORST_CASE,
+                                compute_quality, quality_bands)
+
+
+class QualityBandsTest(unittest.TestCase):
+    """Test the single-pass, chunked computation of all quality metrics"""
+
+    def setUp(self):
+        rng = np.random.default_rng(3)
+        self.fim_sum = np.zeros((30, 20, 3))
+        for _ in range(4):
+            dx, dy = rng.normal(size=(2, 30, 20)) * 100
+            r4 = np.square(dx * dx + dy * dy)
+            self.fim_sum += np.stack([dy * dy / r4, -dx * dy / r4, dx * dx / r4], axis=-1)
+        self.fim_sum[:3] = 0.0       # no landmark visible
+        self.visible_count = np.full((30, 20), 4, dtype=np.int32)
+        self.visible_count[:3] = 0
+        self.pointing = 1e-3
+
+    def test_matches_eigen_decomposition(self):
+        """The metrics match those of the explicitly inverted and eigen-decomposed covariances."""
+        bands = quality_bands(self.fim_sum, self.pointing, self.visible_count)
+        self.assertEqual(bands.shape, (len(QUALITY_BANDS), 30, 20))
+        self.assertEqual(bands.dtype, np.float32)
+
+        a, b, c = np.moveaxis(self.fim_sum[3:], -1, 0) / self.pointing ** 2
+        covs = np.linalg.inv(np.stack([np.stack([a, b], -1), np.stack([b, c], -1)], -1))
+        eigenvalues, eigenvectors = np.linalg.eigh(covs)
+        major = eigenvectors[..., 1]        # (east, south) components
+        azimuth = np.degrees(np.arctan2(major[..., 0], -major[..., 1])) % 180
+
+        np.testing.assert_allclose(bands[GDOP, 3:], np.sqrt(eigenvalues.sum(-1)), rtol=1e-4)
+        np.testing.assert_allclose(bands[WORST_CASE, 3:], np.sqrt(eigenvalues[..., 1]), rtol=1e-4)
+        np.testing.assert_allclose(bands[MINOR_SD, 3:], np.sqrt(eigenvalues[..., 0]), rtol=1e-4)
+        angle_error = (bands[ORIENTATION, 3:] - azimuth + 90) % 180 - 90
+        np.testing.assert_allclose(angle_error, 0, atol=1e-2)
+        np.testing.assert_array_equal(bands[VISIBLE_COUNT], self.visible_count)
+
+    def test_nodata_where_unobserved(self):
+        bands = quality_bands(self.fim_sum, self.pointing, self.visible_count, nodata_value=-1)
+        np.testing.assert_array_equal(bands[:VISIBLE_COUNT, :3], -1)
+        np.testing.assert_array_equal(bands[VISIBLE_COUNT, :3], 0)
+
+    def test_chunking(self):
+        """Chunks of a single row give the same result as the whole raster at once."""
+        whole = quality_bands(self.fim_sum, self.pointing, self.visible_count)
+        rows = quality_bands(self.fim_sum, self.pointing, self.visible_count, chunk_bytes=1)
+        np.testing.assert_array_equal(rows, whole)
+
+    def test_compute_quality(self):
+        """Each metric of `compute_quality` is the matching band, and the FIM sum is left untouched."""
+        fim_sum = self.fim_sum.copy()
+        bands = quality_bands(fim_sum, self.pointing, bands=(GDOP, WORST_CASE))
+        np.testing.assert_array_equal(compute_quality(fim_sum, self.pointing, metric=0), bands[0])
+        np.testing.assert_array_equal(compute_quality(fim_sum, self.pointing, metric=1), bands[1])
+        np.testing.assert_array_equal(fim_sum, self.fim_sum)
+
+    def test_visible_count_required(self):
+        with self.assertRaises(ValueError):
+            quality_bands(self.fim_sum, self.pointing)
+
+
+if __name__ == "__main__":
+    unittest.main()
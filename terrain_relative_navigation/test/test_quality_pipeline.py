@@ -0,0 +1,82 @@
+# coding=utf-8
+"""Tests for the quality pipeline: its outputs, cancellation and progress."""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from osgeo import gdal
+
+from ..quality_pipeline import analyze_viewsheds
+
+
+class Canceled(Exception):
+    pass
+
+
+class QualityPipelineTest(unittest.TestCase):
+    """Test the pipeline on random viewsheds"""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        rng = np.random.default_rng(6)
+        self.viewsheds = []
+        for px, py in zip(rng.integers(0, 55, 8), rng.integers(0, 40, 8)):
+            rows, cols = slice(max(py - 9, 0), min(py + 10, 40)), slice(max(px - 9, 0), min(px + 10, 55))
+            viewshed = (rng.random((rows.stop - rows.start, cols.stop - cols.start)) > 0.3).astype(np.uint8)
+            self.viewsheds.append(((int(px), int(py)), (rows, cols), viewshed))
+
+        self.template_path = os.path.join(self.directory, "dem.tif")
+        ds = gdal.GetDriverByName("GTiff").Create(self.template_path, 55, 40, 1, gdal.GDT_Float32)
+        ds.SetGeoTransform((0.0, 5.0, 0.0, 0.0, 0.0, -5.0))
+        ds = None
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_cancel_removes_outputs(self):
+        """Raising from the progress callback removes everything written so far, and is passed on."""
+        outputs = {
+            name: os.path.join(self.directory, filename) for name, filename in [
+                ("quality_path", "quality.tif"), ("store_path", "viewsheds.trnvis"), ("fim_sum_path", "fim_sum.tif"),
+                ("fims_dir", "fims"), ("bands_path", "bands.tif")
+            ]
+        }
+
+        def cancel_halfway(fraction):
+            if fraction >= 0.5:
+                raise Canceled()
+
+        for block_size in (0, 16):
+            with self.assertRaises(Canceled):
+                analyze_viewsheds(
+                    iter(self.viewsheds), len(self.viewsheds), self.template_path, (9, 9), pointing=1e-3,
+                    block_size=block_size, progress_callback=cancel_halfway, manifest={}, **outputs
+                )
+            self.assertEqual(sorted(os.listdir(self.directory)), ["dem.tif"])
+
+    def test_progress(self):
+        """The progress only grows, over the landmarks and then over the blocks."""
+        for block_size in (0, 16):
+            fractions = []
+            analyze_viewsheds(
+                iter(self.viewsheds), len(self.viewsheds), self.template_path, (9, 9),
+                os.path.join(self.directory, f"quality_{block_size}.tif"), pointing=1e-3, block_size=block_size,
+                store_path=os.path.join(self.directory, f"viewsheds_{block_size}.trnvis"),
+                progress_callback=fractions.append
+            )
+            self.assertEqual(fractions, sorted(fractions))
+            self.assertEqual(fractions[0], 0.0)
+            self.assertLessEqual(fractions[-1], 1.0)
+            if block_size:
+                # 8 landmarks over [0, 0.5), then the 3x4 blocks over (0.5, 1]
+                self.assertEqual(len(fractions), 8 + 12)
+                self.assertLess(fractions[7], 0.5)
+                self.assertEqual(fractions[-1], 1.0)
+
+
+if __name__ == "__main__":
+    unittest.main()
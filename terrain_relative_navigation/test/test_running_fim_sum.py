@@ -0,0 +1,59 @@
+# coding=utf-8
+"""Tests for incrementally updating a running FIM sum."""
+
+import unittest
+
+import numpy as np
+
+from ..quality_analysis import accumulate_viewshed_fims
+from ..running_fim_sum import landmark_changes, update_fim_sum
+
+
+class RunningFimSumTest(unittest.TestCase):
+    """Test adding and removing landmarks from a running FIM sum"""
+
+    def setUp(self):
+        self.shape = (30, 40)
+        self.radius_px = (6, 6)
+        rng = np.random.default_rng(0)
+        self.viewsheds = []
+        for px, py in [(5, 5), (20, 12), (35, 25), (20, 12)]:
+            rows = slice(max(py - 6, 0), min(py + 7, self.shape[0]))
+            cols = slice(max(px - 6, 0), min(px + 7, self.shape[1]))
+            viewshed = (rng.random((rows.stop - rows.start, cols.stop - cols.start)) > 0.3).astype(np.uint8)
+            self.viewsheds.append(((px, py), (rows, cols), viewshed))
+
+    def full_sum(self, viewsheds):
+        fim_sum = np.zeros(self.shape + (3,))
+        visible_count = np.zeros(self.shape, dtype=np.int32)
+        accumulate_viewshed_fims(
+            viewsheds, self.shape, 1.0, 1.0, self.radius_px,
+            fim_sum=fim_sum, visible_count=visible_count, dtype=np.float64
+        )
+        return fim_sum, visible_count
+
+    def test_landmark_changes(self):
+        """Duplicates are added and removed one at a time."""
+        added, removed = landmark_changes([[1, 2], [3, 4], [3, 4]], [(3, 4), (5, 6)])
+        self.assertEqual(added, [(5, 6)])
+        self.assertEqual(removed, [(1, 2), (3, 4)])
+
+    def test_update_matches_full_sum(self):
+        """Removing and adding landmarks gives the same sum as recomputing it."""
+        fim_sum, visible_count = self.full_sum(self.viewsheds[:3])
+        update_fim_sum(fim_sum, visible_count, self.viewsheds[3:], self.viewsheds[:1], 1.0, 1.0, self.radius_px)
+
+        expected_sum, expected_count = self.full_sum(self.viewsheds[1:])
+        np.testing.assert_allclose(fim_sum, expected_sum, atol=1e-12)
+        np.testing.assert_array_equal(visible_count, expected_count)
+
+    def test_remove_all(self):
+        """Removing every landmark leaves an empty sum."""
+        fim_sum, visible_count = self.full_sum(self.viewsheds)
+        update_fim_sum(fim_sum, visible_count, [], self.viewsheds, 1.0, 1.0, self.radius_px)
+        self.assertFalse(fim_sum.any())
+        self.assertFalse(visible_count.any())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,110 @@
+# coding=utf-8
+"""Tests for running a quality analysis as shards, and merging their partial FIM sums."""
+
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import unittest
+
+import numpy as np
+
+from osgeo import gdal
+
+from .. import sharding
+from ..quality_analysis import read_raster
+from ..quality_pipeline import run_quality_analysis
+from ..running_fim_sum import read_fim_sum
+
+
+class ShardingTest(unittest.TestCase):
+    """Test that sharded jobs give the same result as a single run"""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.job_dir = os.path.join(self.directory, "job")
+        rng = np.random.default_rng(4)
+        dem = np.cumsum(np.cumsum(rng.normal(size=(60, 80)), axis=0), axis=1)
+
+        self.dem_path = os.path.join(self.directory, "dem.tif")
+        ds = gdal.GetDriverByName("GTiff").Create(self.dem_path, 80, 60, 1, gdal.GDT_Float32)
+        ds.SetGeoTransform((1000.0, 10.0, 0.0, 5000.0, 0.0, -10.0))
+        ds.GetRasterBand(1).WriteArray(dem)
+        ds = None
+
+        self.landmarks = np.c_[rng.uniform(1000, 1800, 7), rng.uniform(4400, 5000, 7)]
+        self.parameters = (200, 2.0, 2.0, 1e-3)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def create_job(self, num_shards):
+        return sharding.create_job(self.job_dir, self.dem_path, self.landmarks, num_shards, *self.parameters)
+
+    def test_shards_partition_landmarks(self):
+        job = self.create_job(3)
+        shards = [sharding.shard_landmarks(job, shard) for shard in range(3)]
+        self.assertEqual([len(landmarks) for landmarks in shards], [2, 2, 3])
+        np.testing.assert_array_equal(np.concatenate(shards), self.landmarks)
+        with self.assertRaises(ValueError):
+            sharding.shard_landmarks(job, 3)
+
+    def test_merge_matches_single_run(self):
+        """Shards run by several local processes merge into the quality and FIM sum of a single run."""
+        self.create_job(3)
+        sharding.run_local(self.job_dir, 2)
+        self.assertEqual(sharding.job_status(self.job_dir)["done"], [0, 1, 2])
+
+        quality_path = os.path.join(self.directory, "quality.tif")
+        fim_sum_path = os.path.join(self.directory, "fim_sum.tif")
+        sharding.merge_shards(self.job_dir, quality_path, fim_sum_path=fim_sum_path, block_size=32)
+
+        expected_quality_path = os.path.join(self.directory, "expected_quality.tif")
+        expected_fim_sum_path = os.path.join(self.directory, "expected_fim_sum.tif")
+        run_quality_analysis(self.dem_path, self.landmarks, expected_quality_path, *self.parameters, fim_sum_path=expected_fim_sum_path)
+
+        np.testing.assert_allclose(read_raster(quality_path), read_raster(expected_quality_path), rtol=1e-5)
+        fim_sum, visible_count, manifest, _, _ = read_fim_sum(fim_sum_path)
+        expected_sum, expected_count, expected_manifest, _, _ = read_fim_sum(expected_fim_sum_path)
+        np.testing.assert_allclose(fim_sum, expected_sum, rtol=1e-9, atol=1e-15)
+        np.testing.assert_array_equal(visible_count, expected_count)
+        self.assertEqual(manifest, expected_manifest)
+
+    def test_claimed_shards_skipped(self):
+        """A process only runs the shards no other process has claimed, and the merge waits for all of them."""
+        self.create_job(2)
+        self.assertTrue(sharding.claim_shard(self.job_dir, 0))
+        self.assertEqual(sharding.run_shards(self.job_dir), [1])
+        self.assertEqual(sharding.job_status(self.job_dir), {"done": [1], "claimed": [0], "pending": []})
+
+        with self.assertRaises(RuntimeError):
+            sharding.merge_shards(self.job_dir, os.path.join(self.directory, "quality.tif"))
+
+        sharding.run_shard(self.job_dir, 0)
+        self.assertEqual(sharding.job_status(self.job_dir)["done"], [0, 1])
+
+    def test_stale_claims_taken_over(self):
+        """The claim of a dead process of this host is taken over; those of other hosts only when reclaimed."""
+        self.create_job(2)
+        process = subprocess.Popen([sys.executable, "-c", ""])
+        process.wait()      # its pid is now free
+        with open(sharding.claim_path(self.job_dir, 0), "w") as f:
+            f.write(f"{socket.gethostname()} {process.pid}\n")
+        with open(sharding.claim_path(self.job_dir, 1), "w") as f:
+            f.write("other-node 1\n")
+
+        self.assertEqual(sharding.run_shards(self.job_dir), [0])
+        self.assertEqual(sharding.job_status(self.job_dir), {"done": [0], "claimed": [1], "pending": []})
+        self.assertEqual(sharding.read_claim(sharding.claim_path(self.job_dir, 0)), (socket.gethostname(), os.getpid()))
+
+        reclaim = sharding.job_claims(self.job_dir)
+        self.assertEqual(reclaim, {0: (socket.gethostname(), os.getpid()), 1: ("other-node", 1)})
+        self.assertFalse(sharding.claim_shard(self.job_dir, 1, {1: ("other-node", 2)}))     # claimed again since
+        self.assertEqual(sharding.run_shards(self.job_dir, reclaim=reclaim), [1])
+        self.assertEqual(sharding.job_status(self.job_dir)["done"], [0, 1])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,83 @@
+# coding=utf-8
+"""Tests for extracting the peaks of a DEM tile by tile."""
+
+import multiprocessing
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from osgeo import gdal
+
+from .. import tiled_peaks
+from ..peak_extraction import extract_peaks, feature_peaks
+
+
+class Canceled(Exception):
+    pass
+
+
+class TiledPeaksTest(unittest.TestCase):
+    """Test that tiles with halos give the same peaks as the whole DEM"""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        rng = np.random.default_rng(11)
+        y, x = np.mgrid[0:90, 0:110]
+        self.dem = np.zeros((90, 110))
+        for cx, cy, height, width in zip(
+            rng.uniform(0, 110, 40), rng.uniform(0, 90, 40), rng.uniform(1, 5, 40), rng.uniform(4, 10, 40)
+        ):
+            self.dem += height * np.exp(-((x - cx)**2 + (y - cy)**2) / (2 * width**2))
+        self.dem[40:45, 60:70] = np.nan
+        self.gt = (1000.0, 10.0, 0.0, 5000.0, 0.0, -10.0)
+
+        self.dem_path = os.path.join(self.directory, "dem.tif")
+        ds = gdal.GetDriverByName("GTiff").Create(self.dem_path, 110, 90, 1, gdal.GDT_Float64)
+        ds.SetGeoTransform(self.gt)
+        ds.GetRasterBand(1).SetNoDataValue(-9999)
+        ds.GetRasterBand(1).WriteArray(np.nan_to_num(self.dem, nan=-9999))
+        ds = None
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_feature_peaks_match_whole_dem(self):
+        """Peaks across tile seams, and peaks merged over the spacing across them, are found once."""
+        for spacing in (0.0, 40.0, 150.0):
+            expected = feature_peaks(self.dem, self.gt, 5, spacing)
+            self.assertGreater(len(expected), 0)
+            for tile_size in (17, 40, 200):
+                points = tiled_peaks.tiled_feature_peaks(self.dem_path, 5, spacing, tile_size=tile_size)
+                np.testing.assert_allclose(points, expected, rtol=0, atol=1e-6)
+
+    def test_local_maxima_match_whole_dem(self):
+        expected, expected_elevations = extract_peaks(self.dem, self.gt, 7, 150.0)
+        points, elevations = tiled_peaks.tiled_extract_peaks(self.dem_path, 7, 150.0, tile_size=23)
+        np.testing.assert_array_equal(points, expected)
+        np.testing.assert_array_equal(elevations, expected_elevations)
+
+    def test_workers(self):
+        """Tiles processed by worker processes give the same peaks, and report their progress."""
+        fractions = []
+        points = tiled_peaks.tiled_feature_peaks(
+            self.dem_path, 5, 60.0, tile_size=32, num_workers=2, progress_callback=fractions.append
+        )
+        np.testing.assert_allclose(points, feature_peaks(self.dem, self.gt, 5, 60.0), rtol=0, atol=1e-6)
+        self.assertEqual(len(fractions), 12)
+        self.assertEqual(fractions[-1], 1.0)
+
+    def test_cancel_stops_workers(self):
+        """Raising from the progress callback stops the worker processes before it is passed on."""
+        def cancel(fraction):
+            raise Canceled()
+
+        with self.assertRaises(Canceled):
+            tiled_peaks.tiled_feature_peaks(self.dem_path, 5, 60.0, tile_size=16, num_workers=2, progress_callback=cancel)
+        self.assertEqual(multiprocessing.active_children(), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,97 @@
+# coding=utf-8
+"""Tests for block-by-block quality computation."""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from ..quality_analysis import accumulate_viewshed_fims, compute_quality, quality_bands
+from ..tiled_quality import iter_blocks, tiled_quality
+from ..visibility_store import VisibilityStore, write_visibility_store
+
+
+class TiledQualityTest(unittest.TestCase):
+    """Test that tiling gives the same result as the whole raster at once"""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.shape = (40, 55)
+        self.radius_px = (9, 9)
+        rng = np.random.default_rng(2)
+        self.viewsheds = []
+        for px, py in zip(rng.integers(-2, 57, 12), rng.integers(-2, 42, 12)):
+            rows = slice(min(max(py - 9, 0), 40), max(min(py + 10, 40), 0))
+            cols = slice(min(max(px - 9, 0), 55), max(min(px + 10, 55), 0))
+            viewshed = (rng.random((rows.stop - rows.start, cols.stop - cols.start)) > 0.3).astype(np.uint8)
+            self.viewsheds.append(((int(px), int(py)), (rows, cols), viewshed))
+
+        self.path = os.path.join(self.directory, "viewsheds.trnvis")
+        write_visibility_store(self.path, self.shape, (0.0, 5.0, 0.0, 0.0, 0.0, -5.0), self.viewsheds)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_blocks_cover_raster(self):
+        """Blocks tile the raster exactly once."""
+        covered = np.zeros(self.shape, dtype=int)
+        for block in iter_blocks(self.shape, 16):
+            covered[block] += 1
+        self.assertTrue((covered == 1).all())
+
+    def test_matches_whole_raster(self):
+        """Block-wise FIM sums, counts and quality match the in-memory computation."""
+        fim_sum = accumulate_viewshed_fims(self.viewsheds, self.shape, 5.0, 5.0, self.radius_px, dtype=np.float64)
+        expected_quality = compute_quality(fim_sum, 1e-3)
+
+        quality = np.full(self.shape, np.nan)
+        tiled_sum = np.full(self.shape + (3,), np.nan)
+        visible_count = np.full(self.shape, -1)
+
+        def write_quality_block(block_quality, block):
+            quality[block] = block_quality
+
+        def write_fim_sum_block(block_sum, block_count, block):
+            tiled_sum[block] = block_sum
+            visible_count[block] = block_count
+
+        tiled_quality(
+            VisibilityStore(self.path), 1e-3, write_quality_block, block_size=16, write_fim_sum_block=write_fim_sum_block
+        )
+        np.testing.assert_allclose(tiled_sum, fim_sum, rtol=1e-6, atol=1e-12)
+        np.testing.assert_allclose(quality, expected_quality, rtol=1e-4)
+
+        expected_count = np.zeros(self.shape, dtype=int)
+        for _, window, viewshed in self.viewsheds:
+            expected_count[window] += viewshed
+        np.testing.assert_array_equal(visible_count, expected_count)
+
+    def test_bands_match_whole_raster(self):
+        """Block-wise quality bands match the in-memory computation, and include the quality itself."""
+        visible_count = np.zeros(self.shape, dtype=np.int32)
+        fim_sum = accumulate_viewshed_fims(
+            self.viewsheds, self.shape, 5.0, 5.0, self.radius_px, visible_count=visible_count, dtype=np.float64
+        )
+        expected_bands = quality_bands(fim_sum, 1e-3, visible_count)
+
+        quality = np.full(self.shape, np.nan)
+        bands = np.full(expected_bands.shape, np.nan)
+
+        def write_quality_block(block_quality, block):
+            quality[block] = block_quality
+
+        def write_bands_block(block_bands, block):
+            bands[(slice(None),) + block] = block_bands
+
+        tiled_quality(
+            VisibilityStore(self.path), 1e-3, write_quality_block, metric=1, block_size=16,
+            write_bands_block=write_bands_block
+        )
+        np.testing.assert_allclose(bands, expected_bands, rtol=1e-3)     # blocks sum their FIMs in single precision
+        np.testing.assert_array_equal(quality, bands[1])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,45 @@
+# coding=utf-8
+"""Tests for the built-in viewshed engine."""
+
+import unittest
+
+import numpy as np
+
+from ..viewshed_analysis import compute_viewshed
+
+
+class ViewshedAnalysisTest(unittest.TestCase):
+    """Test the radial sweep viewshed against simple terrains"""
+
+    def test_flat_terrain(self):
+        """Everything within the radius is visible on flat terrain."""
+        dem = np.zeros((41, 41))
+        window, viewshed = compute_viewshed(dem, (20, 20), (10, 10), 1.0, 1.0, 2.0, 2.0, radius=10)
+        rows, cols = window
+        self.assertEqual((rows.start, rows.stop, cols.start, cols.stop), (10, 31, 10, 31))
+
+        yy, xx = np.mgrid[-10:11, -10:11]
+        expected = np.hypot(xx, yy) <= 10
+        np.testing.assert_array_equal(viewshed, expected.astype(np.uint8))
+
+    def test_wall_blocks_view(self):
+        """Cells behind a tall wall are hidden, cells in front of it are not."""
+        dem = np.zeros((21, 41))
+        dem[:, 25] = 100.0
+        _, viewshed = compute_viewshed(dem, (10, 10), (30, 30), 1.0, 1.0, 2.0, 2.0)
+
+        self.assertTrue(viewshed[:, :25].all())
+        self.assertTrue(viewshed[:, 25].any())
+        self.assertFalse(viewshed[:, 26:].any())
+
+    def test_window_clipped_to_dem(self):
+        """Viewsheds of landmarks near the edge only cover the DEM."""
+        dem = np.zeros((20, 20))
+        window, viewshed = compute_viewshed(dem, (2, 3), (5, 5), 1.0, 1.0, 2.0, 2.0)
+        self.assertEqual(viewshed.shape, (9, 8))
+        self.assertEqual(window[0].start, 0)
+        self.assertEqual(window[1].start, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,69 @@
+# coding=utf-8
+"""Tests for the on-disk viewshed cache."""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from ..viewshed_cache import ViewshedCache, cached_viewsheds
+
+
+class ViewshedCacheTest(unittest.TestCase):
+    """Test storing, reusing and evicting cached viewsheds"""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.cache = ViewshedCache(self.directory, max_bytes=10**9)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_round_trip(self):
+        """Viewsheds come back with the same window and values."""
+        window = (slice(3, 8), slice(10, 21))
+        viewshed = (np.random.default_rng(0).random((5, 11)) > 0.5).astype(np.uint8)
+        key = self.cache.key("dem", (15, 5), 2.0, 2.0, 100, 0)
+
+        self.assertIsNone(self.cache.get(key))
+        self.cache.put(key, window, viewshed)
+        cached_window, cached_viewshed = self.cache.get(key)
+        self.assertEqual(cached_window, window)
+        np.testing.assert_array_equal(cached_viewshed, viewshed)
+
+    def test_only_misses_are_computed(self):
+        """A second run with more landmarks only computes the new ones."""
+        computed = []
+
+        def compute_viewsheds(viewpoints):
+            for viewpoint in viewpoints:
+                computed.append(viewpoint)
+                yield viewpoint, (slice(0, 1), slice(0, 1)), np.ones((1, 1), dtype=np.uint8)
+
+        viewpoints = [(i, i) for i in range(4)]
+        keys = [self.cache.key("dem", viewpoint, 2.0, 2.0, 100, 0) for viewpoint in viewpoints]
+        list(cached_viewsheds(self.cache, keys[:2], viewpoints[:2], compute_viewsheds))
+        results = list(cached_viewsheds(self.cache, keys, viewpoints, compute_viewsheds))
+
+        self.assertEqual(computed, [(0, 0), (1, 1), (2, 2), (3, 3)])
+        self.assertEqual([viewpoint for viewpoint, _, _ in results], viewpoints)
+
+    def test_evict_least_recently_used(self):
+        """Eviction keeps the most recently used entries within the size limit."""
+        keys = [self.cache.key("dem", (i, i), 2.0, 2.0, 100, 0) for i in range(3)]
+        for i, key in enumerate(keys):
+            self.cache.put(key, (slice(0, 4), slice(0, 4)), np.ones((4, 4), dtype=np.uint8))
+            os.utime(self.cache.path(key), (i, i))
+        self.cache.get(keys[0])     # now the most recently used
+
+        self.cache.max_bytes = os.path.getsize(self.cache.path(keys[0])) + 1
+        self.cache.evict()
+        self.assertTrue(self.cache.contains(keys[0]))
+        self.assertFalse(self.cache.contains(keys[1]))
+        self.assertFalse(self.cache.contains(keys[2]))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,52 @@
+# coding=utf-8
+"""Tests for the bit-packed visibility store."""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from ..visibility_store import VisibilityStore, write_visibility_store
+
+
+class VisibilityStoreTest(unittest.TestCase):
+    """Test writing and reading back landmark viewsheds"""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "viewsheds.trnvis")
+
+        rng = np.random.default_rng(0)
+        self.viewsheds = [
+            ((5, 4), (slice(0, 9), slice(1, 10)), (rng.random((9, 9)) > 0.5).astype(np.uint8)),
+            ((20, 12), (slice(8, 17), slice(16, 25)), (rng.random((9, 9)) > 0.5).astype(np.uint8)),
+            ((30, 0), (slice(0, 3), slice(26, 31)), (rng.random((3, 5)) > 0.5).astype(np.uint8)),
+        ]
+        write_visibility_store(self.path, (20, 31), (0.0, 1.0, 0.0, 0.0, 0.0, -1.0), self.viewsheds)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_round_trip(self):
+        """Every viewshed comes back with its viewpoint and window."""
+        store = VisibilityStore(self.path)
+        self.assertEqual(store.shape, (20, 31))
+        self.assertEqual(store.geotransform, (0.0, 1.0, 0.0, 0.0, 0.0, -1.0))
+        self.assertEqual(len(store), 3)
+
+        for (viewpoint, window, viewshed), expected in zip(store, self.viewsheds):
+            self.assertEqual(viewpoint, expected[0])
+            self.assertEqual(window, expected[1])
+            np.testing.assert_array_equal(viewshed, expected[2])
+
+    def test_row_range(self):
+        """Reading a range of raster rows only returns the overlapping window rows."""
+        store = VisibilityStore(self.path)
+        np.testing.assert_array_equal(store.viewshed(1, rows=slice(5, 10)), self.viewsheds[1][2][:2])
+        self.assertEqual(store.viewshed(2, rows=slice(10, 20)).shape, (0, 5))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,173 @@
+"""
+Peak extraction of DEMs too large to process at once (e.g. 20k x 20k mosaics): the DEM is split into tiles, and
+each tile is read with a halo around it and processed by a worker process, so that the extraction scales with the
+number of cores and only a few tiles are ever in memory.
+
+Every pixel of the DEM belongs to the core of exactly one tile, and the halo is wide enough (the analysis window plus
+the peak spacing) that the core pixels are classified as on the whole DEM, and that the peak pixels that could join
+them into a peak are all seen by the tile. A tile thus finishes the peaks that lie entirely in its core, and only
+hands the pixels of the peaks that reach into its halo (i.e. that cross a tile seam) to the merge step, which groups
+them once, so that every peak is found exactly once and the result matches that of a single tile.
+"""
+
+import math
+
+import numpy as np
+
+from . import peak_extraction
+from .quality_analysis import read_raster_geometry
+from .tiled_quality import iter_blocks
+from .viewshed_analysis import pool_context, read_dem
+
+
+# tiles of this many pixels per side (without the halo) keep the per-worker memory to a few hundred MB
+DEFAULT_TILE_SIZE = 2048
+
+
+def tile_halo(size, spacing, pixelSizeX, pixelSizeY):
+    """
+    width (pixels) of the halo read around each tile: pixels up to `spacing` map units (plus one pixel) away from the
+    core can join its peaks, and those are classified from their whole (size, size) window
+    """
+    return size + math.ceil(spacing / min(pixelSizeX, pixelSizeY)) + 1
+
+
+def halo_window(tile, halo, shape):
+    """the (rows, cols) window of a tile grown by the halo, clipped to the raster"""
+    rows, cols = tile
+    return (
+        slice(max(rows.start - halo, 0), min(rows.stop + halo, shape[0])),
+        slice(max(cols.start - halo, 0), min(cols.stop + halo, shape[1])),
+    )
+
+
+def _tile_features(task):
+    """
+    peaks of a tile of the DEM: the (n, 2) centroids of the peaks entirely in its core and the flat index of the first
+    (row-major) pixel of each, and the (rows, cols) of the core pixels of the peaks that cross its seams
+    """
+    dem_path, tile, halo, size, spacing, slope_tolerance, curvature_tolerance = task
+    gt, shape = read_raster_geometry(dem_path)
+    window = halo_window(tile, halo, shape)
+    dem, _ = read_dem(dem_path, window)
+
+    features = peak_extraction.classify_features(dem, size, gt[1], -gt[5], slope_tolerance, curvature_tolerance)
+    rows, cols = np.nonzero(features == peak_extraction.PEAK)
+    labels = peak_extraction.pixel_clusters(rows, cols, features.shape, abs(gt[1]), abs(gt[5]), spacing)
+    rows, cols = rows + window[0].start, cols + window[1].start
+
+    in_core = (
+        (rows >= tile[0].start) & (rows < tile[0].stop) & (cols >= tile[1].start) & (cols < tile[1].stop)
+    )
+    crossing = np.isin(labels, labels[~in_core])
+    closed = ~crossing
+
+    # labels are the index of the first pixel of each peak, and the tile window keeps the row-major order of the DEM
+    points, _ = peak_extraction.cluster_centroids(rows[closed], cols[closed], labels[closed], gt)
+    first = np.unique(labels[closed])
+    first = rows[first] * shape[1] + cols[first]
+
+    seam = crossing & in_core
+    return (points, first), (rows[seam], cols[seam])
+
+
+def _tile_maxima(task):
+    """(rows, cols, elevations) of the candidate peaks of the core of a tile of the DEM (see `extract_peaks`)"""
+    dem_path, tile, halo, size, spacing, slope_tolerance, curvature_tolerance = task
+    gt, shape = read_raster_geometry(dem_path)
+    window = halo_window(tile, halo, shape)
+    dem, _ = read_dem(dem_path, window)
+
+    rows, cols = peak_extraction.peak_candidates(dem, size, gt[1], -gt[5], slope_tolerance, curvature_tolerance)
+    elevations = dem[rows, cols]
+    rows, cols = rows + window[0].start, cols + window[1].start
+
+    in_core = (
+        (rows >= tile[0].start) & (rows < tile[0].stop) & (cols >= tile[1].start) & (cols < tile[1].stop)
+    )
+    return rows[in_core], cols[in_core], elevations[in_core]
+
+
+def map_tiles(function, dem_path, size, spacing, tile_size, num_workers, progress_callback,
+              slope_tolerance, curvature_tolerance):
+    """
+    apply a tile function to every tile of the DEM at the given path, in-process if `num_workers` is 1, or else by a
+    pool of `num_workers` processes (0 or None = one per core); returns the results in no particular order.
+    `progress_callback(fraction)` is called after each tile (it may raise to cancel, which stops the pool's workers
+    before passing it on).
+    """
+    gt, shape = read_raster_geometry(dem_path)
+    halo = tile_halo(size, spacing, abs(gt[1]), abs(gt[5]))
+    tasks = [
+        (dem_path, tile, halo, size, spacing, slope_tolerance, curvature_tolerance)
+        for tile in iter_blocks(shape, tile_size)
+    ]
+
+    def collect(results):
+        collected = []
+        for result in results:
+            collected.append(result)
+            if progress_callback is not None:
+                progress_callback(len(collected) / len(tasks))
+        return collected
+
+    if num_workers == 1 or len(tasks) == 1:
+        return collect(map(function, tasks))
+    pool = pool_context().Pool(num_workers or None)
+    try:
+        return collect(pool.imap_unordered(function, tasks))
+    finally:
+        pool.terminate()        # drops the remaining tiles, if canceled
+        pool.join()
+
+
+def tiled_feature_peaks(dem_path, size, spacing, tile_size=DEFAULT_TILE_SIZE, num_workers=1, progress_callback=None,
+                        slope_tolerance=1.0, curvature_tolerance=0.0001):
+    """
+    `peak_extraction.feature_peaks` of the DEM at the given path, tile by tile (see the module docstring): the same
+    (n, 2) peak map coordinates, in the same order
+    """
+    gt, shape = read_raster_geometry(dem_path)
+    results = map_tiles(
+        _tile_features, dem_path, size, spacing, tile_size, num_workers, progress_callback,
+        slope_tolerance, curvature_tolerance
+    )
+    points = [tile_points for (tile_points, _), _ in results]
+    first = [tile_first for (_, tile_first), _ in results]
+
+    # peaks across tile seams, from all their pixels
+    rows = np.concatenate([np.zeros(0, dtype=np.int64)] + [seam_rows for _, (seam_rows, _) in results])
+    cols = np.concatenate([np.zeros(0, dtype=np.int64)] + [seam_cols for _, (_, seam_cols) in results])
+    if len(rows) > 0:
+        order = np.argsort(rows * shape[1] + cols)
+        rows, cols = rows[order], cols[order]
+        labels = peak_extraction.pixel_clusters(rows, cols, shape, abs(gt[1]), abs(gt[5]), spacing)
+        seam_points, _ = peak_extraction.cluster_centroids(rows, cols, labels, gt)
+        labels = np.unique(labels)
+        points.append(seam_points)
+        first.append(rows[labels] * shape[1] + cols[labels])
+
+    # in the order of their first pixels, as `cluster_peaks` gives them
+    points = np.concatenate([np.zeros((0, 2))] + points)
+    first = np.concatenate([np.zeros(0, dtype=np.int64)] + first)
+    return points[np.argsort(first)]
+
+
+def tiled_extract_peaks(dem_path, size, spacing, tile_size=DEFAULT_TILE_SIZE, num_workers=1, progress_callback=None,
+                        slope_tolerance=1.0, curvature_tolerance=0.0001):
+    """
+    `peak_extraction.extract_peaks` of the DEM at the given path, tile by tile: the candidate peaks (local maxima of
+    a peak shape) of every tile are found by the workers, and thinned to the spacing once they are all merged, so the
+    (n, 2) peak map coordinates and their elevations are the same as those of the whole DEM
+    """
+    gt, shape = read_raster_geometry(dem_path)
+    results = map_tiles(
+        _tile_maxima, dem_path, size, spacing, tile_size, num_workers, progress_callback,
+        slope_tolerance, curvature_tolerance
+    )
+    rows, cols, elevations = (np.concatenate([np.zeros(0)] + [result[k] for result in results]) for k in range(3))
+    rows, cols = rows.astype(np.int64), cols.astype(np.int64)
+
+    # ties in elevation are broken in row-major order, as on the whole DEM
+    order = np.argsort(rows * shape[1] + cols)
+    return peak_extraction.thin_peaks(rows[order], cols[order], elevations[order], gt, spacing)
@@ -0,0 +1,92 @@
+import numpy as np
+
+from . import quality_analysis
+
+
+def iter_blocks(shape, block_size):
+    """(rows, cols) windows of the blocks of at most (block_size, block_size) pixels that tile a raster, row by row"""
+    h, w = shape
+    for r0 in range(0, h, block_size):
+        for c0 in range(0, w, block_size):
+            yield slice(r0, min(r0 + block_size, h)), slice(c0, min(c0 + block_size, w))
+
+
+def block_fim_sum(store, block, kernel, visible_count=None, dtype=np.float32):
+    """
+    sum of the FIMs of all the landmarks of a visibility store over the given (rows, cols) block, as an (h, w, 3) array;
+    only the landmarks whose windows overlap the block are read, and only the rows of their viewsheds that overlap it.
+    If given, the (h, w) `visible_count` of the block is incremented by the number of landmarks visible from each pixel.
+    """
+    rows, cols = block
+    fim_sum = np.zeros((rows.stop - rows.start, cols.stop - cols.start, 3), dtype=dtype)
+    if len(store) == 0:
+        return fim_sum
+
+    r0, r1, c0, c1 = (store.index[:, i] for i in range(2, 6))
+    overlapping = (r0 < rows.stop) & (r1 > rows.start) & (c0 < cols.stop) & (c1 > cols.start)
+    for i in np.nonzero(overlapping)[0]:
+        window_rows, window_cols = store.window(i)
+        overlap = (
+            slice(max(window_rows.start, rows.start), min(window_rows.stop, rows.stop)),
+            slice(max(window_cols.start, cols.start), min(window_cols.stop, cols.stop))
+        )
+        viewshed = store.viewshed(i, rows=overlap[0])[:, overlap[1].start - window_cols.start : overlap[1].stop - window_cols.start]
+        if not viewshed.any():
+            continue
+
+        # the overlap, relative to the block
+        local = (
+            slice(overlap[0].start - rows.start, overlap[0].stop - rows.start),
+            slice(overlap[1].start - cols.start, overlap[1].stop - cols.start)
+        )
+        quality_analysis.landmark_fim(viewshed, store.viewpoint(i), overlap, kernel, out=fim_sum[local])
+        if visible_count is not None:
+            visible_count[local] += viewshed
+    return fim_sum
+
+
+def tiled_quality(store, pointing, write_quality_block, metric=0, block_size=1024, write_fim_sum_block=None,
+                  write_bands_block=None, mask=None, nodata_value=1_000_000, progress_callback=None):
+    """
+    compute the quality raster of the landmarks of a visibility store block by block, so that neither the FIM sum nor
+    the quality raster ever has to fit in memory: for each block, the FIM sum and quality are computed from the
+    viewsheds overlapping it (see `block_fim_sum`), and handed to `write_quality_block(quality, block)` before moving
+    on to the next block (unless it is None, e.g. to only write FIM sums).
+    If given, `write_fim_sum_block(fim_sum, visible_count, block)` is also called with the (float64) FIM sum of each
+    block and its visible landmark counts, and `write_bands_block(bands, block)` with all the quality metric bands of
+    each block (see `quality_analysis.quality_bands`), computed in the same pass as the quality. With a (h, w) `mask`,
+    the FIM sums of blocks without any valid pixel are never computed, and the quality of every masked-out pixel is
+    nodata (and its FIM sum and count 0). `progress_callback(fraction)` is called after each block.
+    """
+    gt = store.geotransform
+    kernel = quality_analysis.fim_kernel(gt[1], -gt[5], *store.radius_px())
+    blocks = list(iter_blocks(store.shape, block_size))
+
+    for n, block in enumerate(blocks):
+        rows, cols = block
+        visible_count = None
+        if write_fim_sum_block is not None or write_bands_block is not None:
+            visible_count = np.zeros((rows.stop - rows.start, cols.stop - cols.start), dtype=np.int32)
+        dtype = np.float32 if write_fim_sum_block is None else np.float64
+        block_mask = None if mask is None else mask[block]
+        if block_mask is None or block_mask.any():
+            fim_sum = block_fim_sum(store, block, kernel, visible_count=visible_count, dtype=dtype)
+        else:
+            fim_sum = np.zeros((rows.stop - rows.start, cols.stop - cols.start, 3), dtype=dtype)
+        if block_mask is not None:
+            fim_sum[~block_mask] = 0
+            if visible_count is not None:
+                visible_count[~block_mask] = 0
+
+        if write_fim_sum_block is not None:
+            write_fim_sum_block(fim_sum, visible_count, block)
+        if write_bands_block is not None:
+            bands = quality_analysis.quality_bands(fim_sum, pointing, visible_count, nodata_value=nodata_value)
+            write_bands_block(bands, block)
+            if write_quality_block is not None:
+                write_quality_block(bands[metric], block)
+        elif write_quality_block is not None:
+            write_quality_block(quality_analysis.compute_quality(fim_sum, pointing, metric=metric, nodata_value=nodata_value), block)
+
+        if progress_callback is not None:
+            progress_callback((n + 1) / len(blocks))
@@ -0,0 +1,122 @@
+import os
+
+import numpy as np
+
+from osgeo import ogr, osr
+
+
+# OGR drivers of the vector file extensions the command line tools write
+VECTOR_DRIVERS = {
+    ".gpkg": "GPKG",
+    ".shp": "ESRI Shapefile",
+    ".geojson": "GeoJSON",
+    ".json": "GeoJSON",
+    ".csv": "CSV",
+}
+
+# OGR field types of the numpy dtype kinds of attribute columns
+FIELD_TYPES = {
+    "i": ogr.OFTInteger64,
+    "u": ogr.OFTInteger64,
+    "f": ogr.OFTReal,
+    "b": ogr.OFTInteger,
+    "U": ogr.OFTString,
+}
+
+
+def iter_geometries(filename):
+    """lazily yield the OGR geometry of each feature of the first layer of the given vector file"""
+    ds = ogr.Open(filename)
+    if ds is None:
+        raise ValueError(f"Cannot open vector file {filename}")
+    for feature in ds.GetLayer(0):
+        geometry = feature.GetGeometryRef()
+        if geometry is not None:
+            yield geometry.Clone()
+
+
+def read_points(filename):
+    """the (x, y) coordinates of the point features of the given vector file, as an (n, 2) array"""
+    points = [geometry.GetPoint_2D() for geometry in iter_geometries(filename)]
+    return np.array(points, dtype=np.float64).reshape(-1, 2)
+
+
+def read_wkbs(filename):
+    """the WKB geometries of the features of the given vector file"""
+    return [bytes(geometry.ExportToWkb()) for geometry in iter_geometries(filename)]
+
+
+def read_lines(filename):
+    """the vertices of each part of the line features of the given vector file, as a list of (m, 2) arrays"""
+    lines = []
+    for geometry in iter_geometries(filename):
+        parts = [geometry] if geometry.GetGeometryCount() == 0 else [geometry.GetGeometryRef(i) for i in range(geometry.GetGeometryCount())]
+        for part in parts:
+            lines.append(np.array(part.GetPoints(), dtype=np.float64)[:,:2].reshape(-1, 2))
+    return lines
+
+
+def vector_projection(filename):
+    """the WKT projection of the first layer of the given vector file, or None"""
+    srs = ogr.Open(filename).GetLayer(0).GetSpatialRef()
+    return None if srs is None else srs.ExportToWkt()
+
+
+def write_vector(filename, geometry_type, wkbs, projection=None, attributes=None):
+    """
+    write the given WKB geometries to a new vector file (whose format is picked from the extension, see
+    `VECTOR_DRIVERS`), with the given WKT projection; `attributes` maps field names to sequences of values, one per
+    geometry
+    """
+    extension = os.path.splitext(filename)[1].lower()
+    if extension not in VECTOR_DRIVERS:
+        raise ValueError(f"Unsupported vector format {extension!r}, expected one of {', '.join(VECTOR_DRIVERS)}")
+    driver = ogr.GetDriverByName(VECTOR_DRIVERS[extension])
+    if os.path.exists(filename):
+        driver.DeleteDataSource(filename)
+    ds = driver.CreateDataSource(filename)
+
+    srs = None
+    if projection:
+        srs = osr.SpatialReference()
+        srs.ImportFromWkt(projection)
+    layer = ds.CreateLayer(os.path.splitext(os.path.basename(filename))[0], srs, geometry_type)
+
+    columns = {name: np.asarray(values) for name, values in (attributes or {}).items()}
+    for name, values in columns.items():
+        layer.CreateField(ogr.FieldDefn(name, FIELD_TYPES[values.dtype.kind]))
+
+    definition = layer.GetLayerDefn()
+    for i, wkb in enumerate(wkbs):
+        feature = ogr.Feature(definition)
+        feature.SetGeometry(ogr.CreateGeometryFromWkb(bytes(wkb)))
+        for name, values in columns.items():
+            feature.SetField(name, values[i].item())
+        layer.CreateFeature(feature)
+    ds = None       # flush to disk
+
+
+def point_wkbs(points):
+    """encode an (n, 2) array of coordinates as n WKB points, all at once"""
+    wkb_dtype = np.dtype([("byte_order", "u1"), ("wkb_type", "<u4"), ("point", "<f8", (2,))])
+    wkbs = np.empty(len(points), dtype=wkb_dtype)
+    wkbs["byte_order"] = 1      # little endian
+    wkbs["wkb_type"] = 1        # Point
+    wkbs["point"] = points
+
+    data = wkbs.tobytes()
+    return [data[i * wkb_dtype.itemsize : (i + 1) * wkb_dtype.itemsize] for i in range(len(points))]
+
+
+def segment_wkbs(starts, ends):
+    """encode the segments between two (n, 2) arrays of coordinates as n two-point WKB linestrings, all at once"""
+    wkb_dtype = np.dtype([("byte_order", "u1"), ("wkb_type", "<u4"), ("num_points", "<u4"), ("points", "<f8", (2, 2))])
+    wkbs = np.empty(len(starts), dtype=wkb_dtype)
+    wkbs["byte_order"] = 1      # little endian
+    wkbs["wkb_type"] = 2        # LineString
+    wkbs["num_points"] = 2
+    wkbs["points"][:,0] = starts
+    wkbs["points"][:,1] = ends
+
+    data = wkbs.tobytes()
+    return [data[i * wkb_dtype.itemsize : (i + 1) * wkb_dtype.itemsize] for i in range(len(starts))]
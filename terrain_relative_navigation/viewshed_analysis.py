@@ -0,0 +1,200 @@
+import collections
+import itertools
+import multiprocessing
+import os
+import sys
+
+import numpy as np
+
+from .quality_analysis import landmark_window, read_raster, read_raster_geometry
+
+
+# max number of (ray, step) samples processed at once, to bound the size of temporaries
+MAX_RAY_SAMPLES = 4_000_000
+
+# per-process state of pool workers (see `parallel_viewsheds`)
+_worker_dem = None
+_worker_dem_path = None
+_worker_args = None
+
+
+def read_dem(source, window=None):
+    """
+    read the given DEM raster (a filename or a QgsRasterLayer), or only its (rows, cols) window, as a float array
+    (with NaN for nodata), along with the geotransform of the whole raster
+    """
+    return read_raster(source, window, nan_nodata=True), read_raster_geometry(source)[0]
+
+
+def perimeter_offsets(rx, ry):
+    """(dx, dy) pixel offsets of every cell on the boundary of the (2*rx+1, 2*ry+1) box centered on the origin"""
+    xs = np.arange(-rx, rx + 1)
+    ys = np.arange(-ry + 1, ry)
+    dx = np.concatenate([xs, xs, np.full(len(ys), -rx), np.full(len(ys), rx)])
+    dy = np.concatenate([np.full(len(xs), -ry), np.full(len(xs), ry), ys, ys])
+    return dx, dy
+
+
+def compute_viewshed(dem, viewpoint, radius_px, pixelSizeX, pixelSizeY, observer_height, target_height, radius=None):
+    """
+    compute the viewshed of an observer standing `observer_height` above the DEM at the given (px, py) pixel,
+    looking at targets `target_height` above the DEM, up to the given (rx, ry) pixel radius (and optionally a circular
+    radius in map units); NaN DEM cells are never visible and never block.
+
+    Uses a radial sweep: a ray is cast from the observer to every cell on the boundary of the radius box, and a cell is
+    visible if its target elevation angle clears the terrain horizon accumulated along some ray passing through it.
+
+    Returns the (rows, cols) window of the DEM covered by the radius box, and the uint8 viewshed over that window.
+    """
+    h, w = dem.shape
+    px, py = viewpoint
+    rx, ry = radius_px
+    window = landmark_window(viewpoint, radius_px, dem.shape)
+    rows, cols = window
+    viewshed = np.zeros((rows.stop - rows.start, cols.stop - cols.start), dtype=np.uint8)
+
+    if not (0 <= px < w and 0 <= py < h) or np.isnan(dem[py, px]):
+        return window, viewshed     # observer is not on the DEM
+    observer_z = dem[py, px] + observer_height
+    viewshed[py - rows.start, px - cols.start] = 1
+
+    ray_dx, ray_dy = perimeter_offsets(rx, ry)
+    num_steps = max(rx, ry)
+    steps = np.arange(1, num_steps + 1)
+    chunk = max(MAX_RAY_SAMPLES // num_steps, 1)
+
+    for start in range(0, len(ray_dx), chunk):
+        dx = ray_dx[start:start + chunk, np.newaxis]
+        dy = ray_dy[start:start + chunk, np.newaxis]
+        ray_length = np.maximum(np.abs(dx), np.abs(dy))
+
+        # walk each ray one cell at a time along its major axis
+        t = steps[np.newaxis,:] / ray_length
+        ox = np.rint(dx * t).astype(np.int64)
+        oy = np.rint(dy * t).astype(np.int64)
+        cx, cy = px + ox, py + oy
+
+        valid = (steps[np.newaxis,:] <= ray_length) & (cx >= 0) & (cx < w) & (cy >= 0) & (cy < h)
+        z = np.full(valid.shape, np.nan)
+        z[valid] = dem[cy[valid], cx[valid]]
+
+        dist = np.hypot(ox * pixelSizeX, oy * pixelSizeY)
+        if radius is not None:
+            valid &= dist <= radius
+
+        # elevation angles (as slopes) of the terrain and of the targets, as seen by the observer
+        terrain_slope = (z - observer_z) / dist
+        target_slope = (z + target_height - observer_z) / dist
+
+        # highest terrain slope seen strictly before each step along its ray
+        horizon = np.fmax.accumulate(np.where(np.isnan(terrain_slope), -np.inf, terrain_slope), axis=1)
+        horizon = np.concatenate([np.full((len(dx), 1), -np.inf), horizon[:,:-1]], axis=1)
+
+        visible = valid & (target_slope >= horizon)
+        viewshed[cy[visible] - rows.start, cx[visible] - cols.start] = 1
+
+    return window, viewshed
+
+
+def windowed_viewshed(dem_path, viewpoint, radius_px, pixelSizeX, pixelSizeY, observer_height, target_height, radius=None, shape=None):
+    """
+    like `compute_viewshed`, but only the landmark's window of the DEM at the given path is read from disk, so the
+    DEM never has to fit in memory; `shape` is the DEM's (h, w), if already known
+    """
+    if shape is None:
+        _, shape = read_raster_geometry(dem_path)
+    window = landmark_window(viewpoint, radius_px, shape)
+    rows, cols = window
+    if rows.stop <= rows.start or cols.stop <= cols.start:
+        return window, np.zeros((rows.stop - rows.start, cols.stop - cols.start), dtype=np.uint8)
+
+    dem, _ = read_dem(dem_path, window)
+    local_viewpoint = (viewpoint[0] - cols.start, viewpoint[1] - rows.start)
+    _, viewshed = compute_viewshed(
+        dem, local_viewpoint, radius_px, pixelSizeX, pixelSizeY, observer_height, target_height, radius=radius
+    )
+    return window, viewshed
+
+
+def iter_viewsheds(dem, viewpoints, radius_px, pixelSizeX, pixelSizeY, observer_height, target_height, radius=None, dem_path=None):
+    """
+    lazily yield a (viewpoint, window, viewshed) tuple for each of the given (px, py) viewpoints (see `compute_viewshed`);
+    if `dem` is None, each landmark's window is read from the DEM at `dem_path` instead (see `windowed_viewshed`)
+    """
+    shape = read_raster_geometry(dem_path)[1] if dem is None else None
+    for viewpoint in viewpoints:
+        if dem is None:
+            window, viewshed = windowed_viewshed(
+                dem_path, viewpoint, radius_px, pixelSizeX, pixelSizeY, observer_height, target_height, radius=radius, shape=shape
+            )
+        else:
+            window, viewshed = compute_viewshed(
+                dem, viewpoint, radius_px, pixelSizeX, pixelSizeY, observer_height, target_height, radius=radius
+            )
+        yield viewpoint, window, viewshed
+
+
+def _init_worker(dem_path, args, windowed=False):
+    """load the DEM once per worker process (or, if `windowed`, only look up its size)"""
+    global _worker_dem, _worker_dem_path, _worker_args
+    if windowed:
+        _worker_dem, _worker_dem_path = read_raster_geometry(dem_path)[1], dem_path
+    else:
+        _worker_dem, _ = read_dem(dem_path)
+    _worker_args = args
+
+
+def _worker_viewshed(viewpoint):
+    if _worker_dem_path is not None:
+        window, viewshed = windowed_viewshed(
+            _worker_dem_path, viewpoint, *_worker_args[:-1], radius=_worker_args[-1], shape=_worker_dem
+        )
+    else:
+        window, viewshed = compute_viewshed(_worker_dem, viewpoint, *_worker_args[:-1], radius=_worker_args[-1])
+    return viewpoint, window, viewshed
+
+
+def pool_context():
+    """multiprocessing context for worker pools; embedded interpreters (e.g. QGIS on Windows) can't spawn themselves"""
+    context = multiprocessing.get_context()
+    if context.get_start_method() == "spawn" and os.path.basename(sys.executable).lower().startswith("qgis"):
+        context.set_executable(os.path.join(sys.exec_prefix, "pythonw.exe" if sys.platform == "win32" else "python3"))
+    return context
+
+
+def parallel_viewsheds(dem_path, viewpoints, radius_px, pixelSizeX, pixelSizeY, observer_height, target_height, radius=None, num_workers=None, windowed=False):
+    """
+    like `iter_viewsheds`, but the viewsheds are computed by a pool of `num_workers` processes (default: one per core),
+    each of which loads the DEM from the given path once (or, if `windowed`, reads each landmark's window of it);
+    results are yielded in the same order as the viewpoints.
+    Only a bounded number of viewsheds are in flight at once, and closing the generator early terminates the pool.
+    """
+    num_workers = num_workers or os.cpu_count()
+    args = (radius_px, pixelSizeX, pixelSizeY, observer_height, target_height, radius)
+
+    viewpoints = iter(viewpoints)
+    with pool_context().Pool(num_workers, initializer=_init_worker, initargs=(dem_path, args, windowed)) as pool:
+        pending = collections.deque(
+            pool.apply_async(_worker_viewshed, (viewpoint,)) for viewpoint in itertools.islice(viewpoints, 2 * num_workers)
+        )
+        while pending:
+            result = pending.popleft().get()
+            for viewpoint in itertools.islice(viewpoints, 1):
+                pending.append(pool.apply_async(_worker_viewshed, (viewpoint,)))
+            yield result
+
+
+def landmark_viewsheds(dem_path, dem, viewpoints, radius_px, pixelSizeX, pixelSizeY, observer_height, target_height, radius=None, num_workers=1):
+    """
+    lazily yield the (viewpoint, window, viewshed) tuple of each viewpoint, computed in-process on the given DEM array
+    if `num_workers` is 1, or else by `parallel_viewsheds` on the DEM at the given path (0 or None = one per core).
+    If `dem` is None, only each landmark's window of the DEM at the given path is ever read.
+    """
+    if num_workers == 1:
+        return iter_viewsheds(
+            dem, viewpoints, radius_px, pixelSizeX, pixelSizeY, observer_height, target_height, radius=radius, dem_path=dem_path
+        )
+    return parallel_viewsheds(
+        dem_path, viewpoints, radius_px, pixelSizeX, pixelSizeY, observer_height, target_height,
+        radius=radius, num_workers=num_workers or None, windowed=dem is None
+    )
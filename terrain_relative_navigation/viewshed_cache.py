@@ -0,0 +1,140 @@
+import hashlib
+import json
+import os
+
+import numpy as np
+
+
+def file_hash(filename, chunk_size=1 << 20):
+    """sha256 hex digest of the contents of the given file"""
+    digest = hashlib.sha256()
+    with open(filename, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class FileCache:
+    """
+    Persistent, content-addressed store of named numpy arrays, one npz archive per entry, named by its key and the
+    `SUFFIX` of the subclass (so that caches of different kinds can share a directory without evicting each other's
+    entries). Each hit refreshes the entry's modification time, and `evict` deletes the least recently used entries
+    until the cache fits within `max_bytes`.
+    """
+
+    SUFFIX = None
+
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, key):
+        return os.path.join(self.directory, key + self.SUFFIX)
+
+    def contains(self, key):
+        """whether there is an entry for the given key; also marks it as recently used"""
+        try:
+            os.utime(self.path(key))
+        except OSError:
+            return False
+        return True
+
+    def read_entry(self, key, names=None):
+        """return the given (default: all) arrays of the entry with the given key, as a dict, or None on a miss"""
+        path = self.path(key)
+        try:
+            with np.load(path) as entry:
+                arrays = {name: entry[name] for name in (entry.files if names is None else names)}
+        except (OSError, KeyError, ValueError):
+            return None     # missing (or unreadable) entry
+        os.utime(path)      # mark as recently used
+        return arrays
+
+    def write_entry(self, key, arrays):
+        """store the given named arrays (a dict) under the given key"""
+        path = self.path(key)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            np.savez(f, **arrays)
+        os.replace(tmp_path, path)      # atomic, so concurrent runs never see partial entries
+
+    def evict(self):
+        """delete least recently used entries until the total size of the cache is within `max_bytes`"""
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(self.SUFFIX):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+
+
+class ViewshedCache(FileCache):
+    """
+    Persistent, content-addressed store of viewshed windows.
+
+    Entries are keyed by everything a viewshed depends on (DEM contents, landmark pixel location, landmark and robot
+    heights, radius, engine) and stored bit-packed, one file per entry (see `FileCache` for the eviction).
+    """
+
+    SUFFIX = ".npz"
+
+    def key(self, dem_hash, viewpoint, landmark_height, robot_height, radius, engine):
+        """cache key of the viewshed of a landmark at the given (px, py) pixel of the DEM with the given hash"""
+        params = [dem_hash, [int(v) for v in viewpoint], float(landmark_height), float(robot_height), float(radius), engine]
+        return hashlib.sha256(json.dumps(params).encode()).hexdigest()
+
+    def get(self, key):
+        """return the cached (window, viewshed) for the given key, or None on a miss"""
+        entry = self.read_entry(key, ["window", "bits"])
+        if entry is None:
+            return None
+        r0, r1, c0, c1 = (int(v) for v in entry["window"])
+        shape = (r1 - r0, c1 - c0)
+        viewshed = np.unpackbits(entry["bits"], count=shape[0] * shape[1]).reshape(shape)
+        return (slice(r0, r1), slice(c0, c1)), viewshed
+
+    def put(self, key, window, viewshed):
+        """store the given (rows, cols) window and its viewshed under the given key"""
+        rows, cols = window
+        self.write_entry(key, {
+            "window": np.array([rows.start, rows.stop, cols.start, cols.stop], dtype=np.int64),
+            "bits": np.packbits(viewshed != 0),
+        })
+
+
+def cached_viewsheds(cache, keys, viewpoints, compute_viewsheds):
+    """
+    lazily yield a (viewpoint, window, viewshed) tuple for each viewpoint, in order, loading it from the cache under
+    the matching key when possible; the remaining viewpoints are passed (in order) to
+    `compute_viewsheds(viewpoints) -> iterable of (viewpoint, window, viewshed)`, and their results are cached
+    """
+    viewpoints = list(viewpoints)
+    hits = [cache.contains(key) for key in keys]
+    computed = iter(compute_viewsheds([viewpoint for viewpoint, hit in zip(viewpoints, hits) if not hit]))
+
+    try:
+        for viewpoint, key, hit in zip(viewpoints, keys, hits):
+            cached = cache.get(key) if hit else None
+            if cached is not None:
+                window, viewshed = cached
+            elif hit:
+                # entry vanished since it was looked up (e.g. evicted by another run), so recompute it on its own
+                viewpoint, window, viewshed = next(iter(compute_viewsheds([viewpoint])))
+                cache.put(key, window, viewshed)
+            else:
+                viewpoint, window, viewshed = next(computed)
+                cache.put(key, window, viewshed)
+            yield viewpoint, window, viewshed
+    finally:
+        if hasattr(computed, "close"):
+            computed.close()
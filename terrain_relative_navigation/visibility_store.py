@@ -0,0 +1,122 @@
+import struct
+
+import numpy as np
+
+
+# File layout (all integers are little-endian int64, all offsets are in bytes from the start of the file):
+#
+#   header  MAGIC, h, w, num_landmarks, index_offset, geotransform (6 x float64)
+#   data    for each landmark, its viewshed window bit-packed row by row (np.packbits(..., axis=1))
+#   index   for each landmark, (px, py, row_start, row_stop, col_start, col_stop, data_offset)
+#
+# Rows are packed separately so any range of rows of a window can be read without touching the rest.
+MAGIC = b"TRNVIS01"
+HEADER = struct.Struct("<8s4q6d")
+INDEX_FIELDS = 7
+
+
+class VisibilityStoreWriter:
+    """
+    Streams the viewsheds of all landmarks of a raster into a single visibility store file (see `VisibilityStore`).
+    Use as a context manager, or call `close` once all viewsheds have been added.
+    """
+
+    def __init__(self, path, shape, geotransform):
+        self.path = path
+        self.shape = shape
+        self.geotransform = geotransform
+        self.index = []
+        self.file = open(path, "wb")
+        self.file.write(HEADER.pack(MAGIC, shape[0], shape[1], 0, 0, *geotransform))
+
+    def add(self, viewpoint, window, viewshed):
+        """append the viewshed of the landmark at the given (px, py) pixel, covering the given (rows, cols) window"""
+        rows, cols = window
+        self.index.append((viewpoint[0], viewpoint[1], rows.start, rows.stop, cols.start, cols.stop, self.file.tell()))
+        self.file.write(np.packbits(viewshed != 0, axis=1).tobytes())
+
+    def close(self):
+        if self.file.closed:
+            return
+        index_offset = self.file.tell()
+        self.file.write(np.array(self.index, dtype="<i8").reshape(-1, INDEX_FIELDS).tobytes())
+        self.file.seek(0)
+        self.file.write(HEADER.pack(MAGIC, self.shape[0], self.shape[1], len(self.index), index_offset, *self.geotransform))
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class VisibilityStore:
+    """
+    Read-only, memory-mapped access to the viewsheds of a visibility store written by `VisibilityStoreWriter`.
+
+    Each landmark's viewshed only covers its radius window of the raster, bit-packed; viewsheds (or row ranges of
+    them) are unpacked on demand, so only the landmarks and rows that are actually used are ever read from disk.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.data = np.memmap(path, dtype=np.uint8, mode="r")
+        magic, h, w, num_landmarks, index_offset, *geotransform = HEADER.unpack(self.data[:HEADER.size].tobytes())
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a visibility store")
+
+        self.shape = (h, w)
+        self.geotransform = tuple(geotransform)
+        self.index = np.frombuffer(
+            self.data, dtype="<i8", count=num_landmarks * INDEX_FIELDS, offset=index_offset
+        ).reshape(num_landmarks, INDEX_FIELDS)
+
+    def __len__(self):
+        return len(self.index)
+
+    def viewpoint(self, i):
+        """(px, py) pixel location of the i-th landmark"""
+        return int(self.index[i, 0]), int(self.index[i, 1])
+
+    def window(self, i):
+        """(rows, cols) window of the raster covered by the i-th landmark's viewshed"""
+        r0, r1, c0, c1 = (int(v) for v in self.index[i, 2:6])
+        return slice(r0, r1), slice(c0, c1)
+
+    def radius_px(self):
+        """the smallest (rx, ry) pixel radius around their viewpoints that covers the windows of all landmarks"""
+        if len(self) == 0:
+            return 0, 0
+        px, py, r0, r1, c0, c1 = (self.index[:, i] for i in range(6))
+        rx = max(int(np.max(px - c0)), int(np.max(c1 - 1 - px)), 0)
+        ry = max(int(np.max(py - r0)), int(np.max(r1 - 1 - py)), 0)
+        return rx, ry
+
+    def viewshed(self, i, rows=None):
+        """
+        unpack the uint8 viewshed of the i-th landmark over its window; if given, only the (absolute) raster rows in
+        the `rows` slice that overlap the window are read
+        """
+        (r0, r1), (c0, c1) = self.index[i, 2:4], self.index[i, 4:6]
+        row_bytes = (c1 - c0 + 7) // 8
+        start, stop = r0, r1
+        if rows is not None:
+            start = min(max(rows.start, r0), r1)
+            stop = max(min(rows.stop, r1), start)
+
+        offset = self.index[i, 6] + (start - r0) * row_bytes
+        packed = self.data[offset : offset + (stop - start) * row_bytes].reshape(stop - start, row_bytes)
+        return np.unpackbits(packed, axis=1, count=c1 - c0)
+
+    def __iter__(self):
+        """iterate over the (viewpoint, window, viewshed) tuple of every landmark, in order"""
+        for i in range(len(self)):
+            yield self.viewpoint(i), self.window(i), self.viewshed(i)
+
+
+def write_visibility_store(path, shape, geotransform, viewsheds):
+    """write an iterable of (viewpoint, window, viewshed) tuples to a new visibility store"""
+    with VisibilityStoreWriter(path, shape, geotransform) as writer:
+        for viewpoint, window, viewshed in viewsheds:
+            writer.add(viewpoint, window, viewshed)